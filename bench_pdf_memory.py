@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+PDF 生成内存基准
+对比完整 story 与流式生成在不同页数下的峰值内存（RSS）
+
+用法: python3 bench_pdf_memory.py [sections ...]
+"""
+
+import os
+import sys
+import subprocess
+
+CHILD = r'''
+import resource, sys, time
+sys.path.insert(0, {root!r})
+import pdf_generator
+
+sections, streaming = int(sys.argv[1]), sys.argv[2] == 'stream'
+rows = '\n'.join(f'| {{i}} | value {{i}} |' for i in range(300))
+section = ('## Section\n\n' + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20 + '\n\n'
+           '| key | value |\n|-----|-------|\n' + rows + '\n\n')
+content = section * sections
+generator = pdf_generator.PDFGenerator()
+start = time.perf_counter()
+generator.generate(content, {out!r}, streaming=streaming)
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(f'{{generator.page_count}} {{rss:.1f}} {{elapsed:.2f}}')
+'''
+
+
+def run(sections, mode, out):
+    code = CHILD.format(root=os.path.dirname(os.path.abspath(__file__)), out=out)
+    result = subprocess.run([sys.executable, '-c', code, str(sections), mode],
+                            capture_output=True, text=True, check=True)
+    pages, rss, elapsed = result.stdout.strip().splitlines()[-1].split()
+    return int(pages), float(rss), float(elapsed)
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 40, 160]
+    out = os.path.join('/tmp', f'markit_bench_{os.getpid()}.pdf')
+    print(f"{'sections':>8} {'mode':>7} {'pages':>6} {'peak RSS (MB)':>14} {'time (s)':>9}")
+    try:
+        for sections in sizes:
+            for mode in ('story', 'stream'):
+                pages, rss, elapsed = run(sections, mode, out)
+                print(f'{sections:>8} {mode:>7} {pages:>6} {rss:>14.1f} {elapsed:>9.2f}')
+    finally:
+        if os.path.exists(out):
+            os.remove(out)
+
+
+if __name__ == '__main__':
+    main()
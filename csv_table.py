@@ -0,0 +1,96 @@
+"""
+外部 CSV/TSV 表格
+预览（分页加载）与 PDF 生成（逐页排版）共用
+"""
+
+import os
+from threading import Lock
+
+
+class CSVTable:
+    """外部 CSV/TSV 表格
+
+    流式扫描一遍文件，只保留表头、行数和每页起始的字节偏移；
+    读取某一页时直接 seek 到对应位置，内存占用与文件大小无关。
+    """
+
+    PAGE_SIZE = 200
+
+    def __init__(self, path):
+        self.path = path
+        self.delimiter = '\t' if path.lower().endswith('.tsv') else ','
+        stat = os.stat(path)
+        self.mtime = stat.st_mtime_ns
+        self.header = []
+        self.row_count = 0
+        self.page_offsets = []
+        self._scan()
+
+    def _reader(self, f):
+        """在二进制文件上构造 csv.reader，f.tell() 始终指向下一条记录的起点"""
+        import csv
+
+        def lines():
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                yield line.decode('utf-8', errors='replace')
+        return csv.reader(lines(), delimiter=self.delimiter)
+
+    def _scan(self):
+        with open(self.path, 'rb') as f:
+            reader = self._reader(f)
+            self.header = next(reader, [])
+            if self.header:
+                self.header[0] = self.header[0].lstrip('\ufeff')
+            offset = f.tell()
+            for row in reader:
+                if self.row_count % self.PAGE_SIZE == 0:
+                    self.page_offsets.append(offset)
+                self.row_count += 1
+                offset = f.tell()
+
+    @property
+    def page_count(self):
+        return len(self.page_offsets)
+
+    def page(self, index):
+        """返回第 index 页的数据行"""
+        if not 0 <= index < self.page_count:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.page_offsets[index])
+            rows = []
+            for row in self._reader(f):
+                rows.append(row)
+                if len(rows) == self.PAGE_SIZE:
+                    break
+            return rows
+
+    def iter_pages(self):
+        """逐页产出全部数据行（ReportLab 导出逐页排版，同一时刻只读入一页）"""
+        for index in range(self.page_count):
+            yield self.page(index)
+
+
+class CSVTableStore:
+    """CSVTable 缓存，按文件 mtime 失效"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tables = {}
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            table = self.tables.get(path)
+        if table is None or table.mtime != mtime:
+            table = CSVTable(path)
+            with self.lock:
+                self.tables[path] = table
+        return table
+
+
+csv_tables = CSVTableStore()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+前端依赖下载
+按 static/assets.yaml 中固定版本的地址把 highlight.js / Mermaid / KaTeX 下载到 static/vendor/，
+CSS 中引用的字体等相对路径一并下载，devicon 图标合并为一个 SVG sprite。
+下载完成后预览页面与 PDF 导出不再访问外网。
+
+用法: python3 fetch_assets.py [--force]
+      python3 fetch_assets.py --check    只检查是否已全部下载（缺少时退出码为 1，供 CI 使用）
+"""
+
+import os
+import re
+import sys
+import urllib.request
+from urllib.parse import urljoin
+
+import yaml
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+CSS_URL_RE = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)')
+ICON_SIZE = 128
+
+
+def download(url):
+    with urllib.request.urlopen(url, timeout=60) as resp:
+        return resp.read()
+
+
+def write(rel_path, data):
+    """原子写入 static/<rel_path>"""
+    path = os.path.join(STATIC_DIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def fetch(name, entry, force):
+    if not force and os.path.exists(os.path.join(STATIC_DIR, entry['path'])):
+        print(f'  {name}: 已存在，跳过')
+        return
+    data = download(entry['url'])
+    write(entry['path'], data)
+    print(f'  {name}: {len(data) // 1024} KB')
+    if entry['path'].endswith('.css'):
+        # CSS 引用的字体 / 图片按相同的相对路径保存
+        for ref in sorted(set(CSS_URL_RE.findall(data.decode('utf-8', 'replace')))):
+            if ref.startswith(('data:', 'http:', 'https:', '/', '#')):
+                continue
+            rel = os.path.normpath(os.path.join(os.path.dirname(entry['path']), ref.split('?')[0].split('#')[0]))
+            if force or not os.path.exists(os.path.join(STATIC_DIR, rel)):
+                write(rel, download(urljoin(entry['url'], ref)))
+                print(f'    + {rel}')
+
+
+def build_sprite(entry, force):
+    """把各语言图标拼成一个 SVG，每个图标对应一个 <view id="<slug>">，供 <img src="...#slug"> 引用"""
+    if not force and os.path.exists(os.path.join(STATIC_DIR, entry['path'])):
+        print('  devicons: 已存在，跳过')
+        return
+    parts, views = [], []
+    for i, slug in enumerate(entry['icons']):
+        try:
+            svg = download(entry['url'].format(slug=slug)).decode('utf-8')
+        except Exception as e:
+            print(f'    ! {slug}: {e}')
+            continue
+        m = re.search(r'<svg\b[^>]*>(.*)</svg>', svg, re.S)
+        if not m:
+            continue
+        view_box = re.search(r'viewBox="([^"]+)"', svg[:m.start(1)])
+        body = m.group(1)
+        # 图标内部的 id（渐变等）加前缀，避免合并后冲突
+        body = re.sub(r'\bid="([^"]+)"', rf'id="{slug}-\1"', body)
+        body = re.sub(r'url\(#([^)]+)\)', rf'url(#{slug}-\1)', body)
+        body = re.sub(r'href="#([^"]+)"', rf'href="#{slug}-\1"', body)
+        x = i * ICON_SIZE
+        parts.append(f'<svg x="{x}" y="0" width="{ICON_SIZE}" height="{ICON_SIZE}" '
+                     f'viewBox="{view_box.group(1) if view_box else f"0 0 {ICON_SIZE} {ICON_SIZE}"}">{body}</svg>')
+        views.append(f'<view id="{slug}" viewBox="{x} 0 {ICON_SIZE} {ICON_SIZE}"/>')
+    sprite = (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+              f'width="{ICON_SIZE}" height="{ICON_SIZE}" viewBox="0 0 {ICON_SIZE} {ICON_SIZE}">'
+              + ''.join(views) + ''.join(parts) + '</svg>')
+    write(entry['path'], sprite.encode('utf-8'))
+    print(f'  devicons: {len(views)} 个图标')
+
+
+def check(manifest):
+    missing = [name for name, entry in manifest.items()
+               if not os.path.exists(os.path.join(STATIC_DIR, entry['path']))]
+    for name in missing:
+        print(f'  缺少 {name}: {manifest[name]["path"]}')
+    if missing:
+        print('请运行 python3 fetch_assets.py')
+        sys.exit(1)
+    print('前端依赖已全部下载')
+
+
+def main():
+    force = '--force' in sys.argv[1:]
+    with open(os.path.join(STATIC_DIR, 'assets.yaml'), 'r', encoding='utf-8') as f:
+        manifest = yaml.safe_load(f) or {}
+    if '--check' in sys.argv[1:]:
+        check(manifest)
+        return
+    print(f'下载前端依赖到 {STATIC_DIR}')
+    for name, entry in manifest.items():
+        if 'icons' in entry:
+            build_sprite(entry, force)
+        else:
+            fetch(name, entry, force)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,10 @@ Markdown to PDF Generator with Theme Support
 
 import os
 import re
+import copy
+import pickle
+import hashlib
+import threading
 import yaml
 from reportlab.lib.pagesizes import A4, letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -14,17 +18,104 @@ from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.ttfonts import TTFont, TTFError
+from reportlab import Version as REPORTLAB_VERSION
+
+from theme_compiler import compile_config
+from csv_table import csv_tables
+
+
+FONT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                              'markit', 'fonts')
+
+_registered_fonts = {}   # 字体路径 -> 已注册的字体名
+_font_lock = threading.Lock()
+
+
+def _font_cache_path(font_path):
+    """字体解析结果的磁盘缓存路径，按路径 + mtime + 大小 + ReportLab 版本区分"""
+    stat = os.stat(font_path)
+    key = f'{os.path.abspath(font_path)}|{stat.st_mtime_ns}|{stat.st_size}|{REPORTLAB_VERSION}'
+    return os.path.join(FONT_CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pickle')
+
+
+def _restore_unpicklable(font):
+    """还原序列化时去掉的属性：按文档划分的子集状态和 TTFontFace._pdfScale（lambda）"""
+    from weakref import WeakKeyDictionary
+    upm = font.face.unitsPerEm
+    font.face._pdfScale = (lambda x: x) if upm == 1000 else (lambda x, m=1000 / upm: x * m)
+    font.state = WeakKeyDictionary()
+
+
+def _load_ttfont(font_name, font_path):
+    """解析 TTF/TTC 字体，度量和字形表持久化到磁盘，后续运行直接反序列化"""
+    cache_path = _font_cache_path(font_path)
+    try:
+        with open(cache_path, 'rb') as f:
+            font = pickle.load(f)
+        font.fontName = font_name
+        _restore_unpicklable(font)
+        return font
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    font = TTFont(font_name, font_path, subfontIndex=0)
+    scale = font.face.__dict__.pop('_pdfScale', None)
+    state = font.__dict__.pop('state', None)
+    try:
+        os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(font, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError):
+        pass
+    finally:
+        font.face._pdfScale = scale
+        font.state = state
+    return font
+
+
+def register_font(font_paths, default='Helvetica'):
+    """返回首个可用字体的注册名；每个字体在进程内只解析、注册一次"""
+    with _font_lock:
+        for font_path in font_paths:
+            if font_path in _registered_fonts:
+                return _registered_fonts[font_path]
+            if not os.path.isfile(font_path):
+                continue
+            font_name = f'ThemeFont{len(_registered_fonts)}' if _registered_fonts else 'ThemeFont'
+            try:
+                pdfmetrics.registerFont(_load_ttfont(font_name, font_path))
+            except TTFError as e:
+                print(f"[Theme] 跳过无法解析的字体 {font_path}: {e}")
+                continue
+            _registered_fonts[font_path] = font_name
+            print(f"[Theme] 使用字体: {font_path}")
+            return font_name
+    print(f"[Theme] 警告: 未找到中文字体，使用默认字体")
+    return default
 
 
 class ThemeManager:
     """主题管理器"""
 
-    def __init__(self, config_path="theme_config.yaml"):
+    def __init__(self, config_path="theme_config.yaml", config=None):
         self.config_path = config_path
-        self.config = self._load_config()
+        self.config = self._merge(self._default_config(), config) if config is not None else self._load_config()
         self.font_name = self._setup_font()
 
+    @classmethod
+    def _merge(cls, base, override):
+        """递归合并配置，override 中缺失的键沿用 base"""
+        result = dict(base)
+        for key, value in (override or {}).items():
+            if isinstance(value, dict) and isinstance(result.get(key), dict):
+                result[key] = cls._merge(result[key], value)
+            else:
+                result[key] = value
+        return result
+
     def _load_config(self):
         """加载主题配置"""
         if os.path.exists(self.config_path):
@@ -76,116 +167,46 @@ class ThemeManager:
         }
 
     def _setup_font(self):
-        """设置中文字体"""
-        font_paths = self.config.get('fonts', {}).get('chinese', [])
-        for font_path in font_paths:
-            try:
-                font_name = 'ThemeFont'
-                pdfmetrics.registerFont(TTFont(font_name, font_path, subfontIndex=0))
-                print(f"[Theme] 使用字体: {font_path}")
-                return font_name
-            except Exception as e:
-                continue
-        print(f"[Theme] 警告: 未找到中文字体，使用默认字体")
-        return self.config.get('fonts', {}).get('default', 'Helvetica')
+        """设置中文字体（经进程级字体注册表，重复创建 ThemeManager 不会重复解析）"""
+        fonts = self.config.get('fonts', {})
+        return register_font(fonts.get('chinese', []), fonts.get('default', 'Helvetica'))
 
     def get_color(self, key):
         """获取颜色"""
         hex_color = self.config.get('colors', {}).get(key, '#000000')
         return colors.HexColor(hex_color)
 
+    @property
+    def compiled(self):
+        """与预览服务器共用的编译结果（按配置内容缓存）"""
+        return compile_config(self.config)
+
     def get_style_config(self, style_type):
         """获取样式配置"""
-        config = {}
-        if style_type in ['title', 'heading', 'subheading', 'normal', 'code', 'table_header']:
-            config['fontSize'] = self.config.get('font_sizes', {}).get(style_type, 11)
-            config['leading'] = self.config.get('line_height', {}).get(style_type, 14)
-            if style_type == 'title':
-                config['textColor'] = self.get_color('title')
-                config['alignment'] = TA_CENTER
-            elif style_type == 'heading':
-                config['textColor'] = self.get_color('heading')
-            elif style_type == 'subheading':
-                config['textColor'] = self.get_color('subheading')
-            elif style_type == 'normal':
-                config['textColor'] = self.get_color('text')
-            elif style_type == 'code':
-                config['textColor'] = self.get_color('code_text')
-                config['backColor'] = self.get_color('code_bg')
-                config['leftIndent'] = self.config.get('code_block', {}).get('indent', 0.5) * cm
-                config['rightIndent'] = self.config.get('code_block', {}).get('indent', 0.5) * cm
-                config['borderPadding'] = self.config.get('code_block', {}).get('padding', 0.2) * cm
-        return config
+        return self.compiled.style_config(style_type)
 
     def create_styles(self):
-        """创建所有样式"""
-        styles = getSampleStyleSheet()
-        base_styles = {}
-
-        # Title Style
-        cfg = self.get_style_config('title')
-        base_styles['title'] = ParagraphStyle(
-            'Title',
-            parent=styles['Heading1'],
-            fontName=self.font_name,
-            **cfg
-        )
-
-        # Heading Style
-        cfg = self.get_style_config('heading')
-        cfg['spaceAfter'] = self.config.get('spacing', {}).get('heading_after', 0.3) * cm
-        cfg['spaceBefore'] = self.config.get('spacing', {}).get('heading_before', 0.4) * cm
-        base_styles['heading'] = ParagraphStyle(
-            'Heading',
-            parent=styles['Heading2'],
-            fontName=self.font_name,
-            **cfg
-        )
-
-        # Subheading Style
-        cfg = self.get_style_config('subheading')
-        cfg['spaceAfter'] = self.config.get('spacing', {}).get('subheading_after', 0.2) * cm
-        cfg['spaceBefore'] = self.config.get('spacing', {}).get('subheading_before', 0.3) * cm
-        base_styles['subheading'] = ParagraphStyle(
-            'Subheading',
-            parent=styles['Heading3'],
-            fontName=self.font_name,
-            **cfg
-        )
-
-        # Normal Style
-        cfg = self.get_style_config('normal')
-        cfg['spaceAfter'] = self.config.get('spacing', {}).get('normal_after', 0.2) * cm
-        base_styles['normal'] = ParagraphStyle(
-            'Normal',
-            parent=styles['Normal'],
-            fontName=self.font_name,
-            **cfg
-        )
-
-        # Code Style
-        cfg = self.get_style_config('code')
-        cfg['spaceAfter'] = self.config.get('spacing', {}).get('code_after', 0.3) * cm
-        base_styles['code'] = ParagraphStyle(
-            'Code',
-            parent=styles['Code'],
-            fontName=self.font_name,
-            **cfg
-        )
-
-        return base_styles
+        """创建所有样式（同一配置与字体只创建一次）"""
+        return self.compiled.reportlab_styles(self.font_name)
 
 
 class MarkdownParser:
     """Markdown 解析器"""
 
-    def __init__(self, content):
+    def __init__(self, content, base_dir=None):
         self.content = content
-        self.tokens = self._parse()
-
-    def _parse(self):
-        """解析 Markdown 内容"""
-        tokens = []
+        self.base_dir = base_dir or os.getcwd()
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        """全部 token（首次访问时解析）"""
+        if self._tokens is None:
+            self._tokens = list(self.iter_tokens())
+        return self._tokens
+
+    def iter_tokens(self):
+        """逐个产出 token，供流式生成使用"""
         lines = self.content.split('\n')
         i = 0
         n = len(lines)
@@ -200,15 +221,24 @@ class MarkdownParser:
 
             # 标题
             if line.startswith('# '):
-                tokens.append({'type': 'title', 'text': line[2:].strip()})
+                yield {'type': 'title', 'text': line[2:].strip()}
             elif line.startswith('## '):
-                tokens.append({'type': 'heading', 'text': line[3:].strip()})
+                yield {'type': 'heading', 'text': line[3:].strip()}
             elif line.startswith('### '):
-                tokens.append({'type': 'subheading', 'text': line[4:].strip()})
+                yield {'type': 'subheading', 'text': line[4:].strip()}
             elif line.startswith('#### '):
-                tokens.append({'type': 'subheading', 'text': line[5:].strip()})
+                yield {'type': 'subheading', 'text': line[5:].strip()}
             elif line.startswith('##### '):
-                tokens.append({'type': 'subheading', 'text': line[6:].strip()})
+                yield {'type': 'subheading', 'text': line[6:].strip()}
+            # 外部 CSV/TSV 表格：只记录路径与 mtime，排版时逐页读取
+            elif re.match(r'^!table\s+\S+\s*$', line.strip()):
+                src = line.strip().split(None, 1)[1]
+                path = os.path.normpath(os.path.join(self.base_dir, src))
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtime = None
+                yield {'type': 'csv_table', 'src': src, 'path': path, 'mtime': mtime}
             # 代码块
             elif line.strip().startswith('```'):
                 code_lines = []
@@ -216,7 +246,7 @@ class MarkdownParser:
                 while i < n and not lines[i].strip().startswith('```'):
                     code_lines.append(lines[i])
                     i += 1
-                tokens.append({'type': 'code', 'text': '\n'.join(code_lines)})
+                yield {'type': 'code', 'text': '\n'.join(code_lines)}
             # 列表
             elif re.match(r'^\s*[-*]\s+', line) or re.match(r'^\s*\d+\.\s+', line):
                 # 收集所有连续列表项
@@ -229,7 +259,7 @@ class MarkdownParser:
                     if match:
                         list_items.append(match.group(1))
                     i += 1
-                tokens.append({'type': 'list', 'items': list_items})
+                yield {'type': 'list', 'items': list_items}
                 continue
             # 表格
             elif '|' in line and i + 1 < n and '|' in lines[i + 1]:
@@ -240,11 +270,11 @@ class MarkdownParser:
                         table_data.append(row)
                     i += 1
                 if len(table_data) > 1:
-                    tokens.append({'type': 'table', 'data': table_data})
+                    yield {'type': 'table', 'data': table_data}
                 continue
             # 分隔线
             elif line.strip() == '---':
-                tokens.append({'type': 'divider'})
+                yield {'type': 'divider'}
             # 普通段落
             else:
                 # 收集连续的非空行
@@ -254,20 +284,58 @@ class MarkdownParser:
                       lines[i].strip() != '---' and '|' not in lines[i]:
                     para_lines.append(lines[i])
                     i += 1
-                tokens.append({'type': 'paragraph', 'text': ' '.join(para_lines)})
+                yield {'type': 'paragraph', 'text': ' '.join(para_lines)}
                 continue
 
             i += 1
 
-        return tokens
+
+class _StreamingStory(list):
+    """按需从生成器补充 Flowable 的 story
+
+    BaseDocTemplate.build 只会查看 len() 和表头的几个元素，
+    所以这里始终只在内存中保留 low_water 个左右尚未排版的 Flowable。
+    """
+
+    def __init__(self, flowables, low_water=64):
+        super().__init__()
+        self._source = iter(flowables)
+        self._low_water = low_water
+        self._fill()
+
+    def _fill(self):
+        while self._source is not None and list.__len__(self) < self._low_water:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
 
 
 class PDFGenerator:
     """PDF 生成器"""
 
+    # 表格切块行数
+    TABLE_CHUNK_ROWS = 100
+    # 超过该字符数的文档默认走流式生成
+    STREAMING_THRESHOLD = 1_000_000
+
     def __init__(self, theme_manager=None):
+        import json
         self.theme = theme_manager or ThemeManager()
         self.styles = self.theme.create_styles()
+        # 样式标识：主题配置或字体变化后，旧的 Flowable 不再命中
+        raw = json.dumps(self.theme.config, sort_keys=True, default=str) + self.theme.font_name
+        self._style_key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        self.flowable_cache = {}   # (token 哈希, 样式标识) -> [Flowable]
+        self.page_count = 0
 
     def _escape_xml(self, text):
         """转义 XML 特殊字符"""
@@ -280,12 +348,188 @@ class PDFGenerator:
         """格式化代码"""
         return self._escape_xml(text)
 
-    def generate(self, markdown_content, output_path=None):
-        """生成 PDF"""
+    # 强调标记 -> (开始标签, 结束标签)
+    EMPHASIS_TAGS = {'***': ('<b><i>', '</i></b>'), '**': ('<b>', '</b>'),
+                     '*': ('<i>', '</i>'), '~~': ('<strike>', '</strike>')}
+
+    def _emphasis(self, text):
+        """把 ***、**、*、~~ 转成标签
+
+        用栈配对标记：遇到结束标记时，它与对应开始标记之间未闭合的标记按原文输出，
+        未配对的标记也按原文输出，所以交叉的标记（如 **a *b** c*）不会产生错误嵌套的标签。
+        """
+        out = []
+        stack = []   # (标记, 在 out 中的位置)
+        for part in re.split(r'(\*\*\*|\*\*|\*|~~)', text):
+            if part not in self.EMPHASIS_TAGS:
+                out.append(part)
+                continue
+            k = next((k for k in range(len(stack) - 1, -1, -1) if stack[k][0] == part), None)
+            if k is None:
+                stack.append((part, len(out)))
+                out.append(part)
+                continue
+            out[stack[k][1]] = self.EMPHASIS_TAGS[part][0]
+            out.append(self.EMPHASIS_TAGS[part][1])
+            del stack[k:]
+        return ''.join(out)
+
+    def _inline(self, text):
+        """转义并把内联 Markdown 转成 ReportLab 段落标记"""
+        saved = []
+
+        def save(markup):
+            saved.append(markup)
+            return f'\x00SAVED{len(saved)-1}\x00'
+        code_bg = self.theme.config.get('colors', {}).get('code_bg', '#f7fafc')
+        link_color = self.theme.config.get('colors', {}).get('link', '#3182ce')
+        text = re.sub(r'`([^`]+)`', lambda m: save(f'<font backColor="{code_bg}">{m.group(1)}</font>'),
+                      self._escape_xml(text))
+        text = re.sub(r'!\[([^\]]*)\]\([^)]+\)', r'\1', text)
+        # 链接先保护起来：URL 中的 * 不参与强调，链接文字单独配对
+        text = re.sub(r'\[([^\]]+)\]\(([^)"]+)\)',
+                      lambda m: save(f'<link href="{m.group(2)}" color="{link_color}">{self._emphasis(m.group(1))}</link>'),
+                      text)
+        text = self._emphasis(text)
+        for i, markup in enumerate(saved):
+            text = text.replace(f'\x00SAVED{i}\x00', markup)
+        return text
+
+    def _paragraph(self, text, style, prefix=''):
+        """内联标记的段落；标记仍无法解析时退回纯文本，不让整个导出失败"""
+        try:
+            return Paragraph(prefix + self._inline(text), style)
+        except ValueError:
+            return Paragraph(prefix + self._escape_xml(text), style)
+
+    def _token_key(self, token):
+        """Flowable 缓存键：token 内容 + 样式"""
+        import json
+        raw = json.dumps(token, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest(), self._style_key
+
+    def _build_flowables(self, token):
+        """把单个 token 转成 Flowable 列表"""
+        flowables = []
+        token_type = token['type']
+
+        if token_type == 'title':
+            flowables.append(self._paragraph(token['text'], self.styles['title']))
+            flowables.append(Spacer(1, self.theme.config.get('spacing', {}).get('title_after', 0.5) * cm))
+
+        elif token_type == 'heading':
+            flowables.append(self._paragraph(token['text'], self.styles['heading']))
+
+        elif token_type == 'subheading':
+            flowables.append(self._paragraph(token['text'], self.styles['subheading']))
+
+        elif token_type == 'paragraph':
+            flowables.append(self._paragraph(token['text'], self.styles['normal']))
+
+        elif token_type == 'code':
+            flowables.append(Paragraph(self._format_code(token['text']), self.styles['code']))
+
+        elif token_type == 'list':
+            for item in token['items']:
+                flowables.append(self._paragraph(item, self.styles['normal'], u"\u2022 "))
+            flowables.append(Spacer(1, 0.2 * cm))
+
+        elif token_type == 'table':
+            flowables.extend(self._table_chunks(token['data']))
+            flowables.append(Spacer(1, 0.5 * cm))
+
+        elif token_type == 'csv_table':
+            flowables.extend(self._csv_table_flowables(token))
+
+        elif token_type == 'divider':
+            flowables.append(Spacer(1, 0.5 * cm))
+
+        return flowables
+
+    def _csv_table_flowables(self, token):
+        """外部表格：逐页读取 CSV，每 TABLE_CHUNK_ROWS 行产出一个带表头的 Table"""
+        try:
+            table = csv_tables.get(token['path'])
+        except (OSError, UnicodeError) as e:
+            yield Paragraph(self._escape_xml(f'⚠ !table 无法读取 {token["src"]}: {e}'), self.styles['normal'])
+            return
+        header = table.header
+        for rows in table.iter_pages():
+            for begin in range(0, len(rows), self.TABLE_CHUNK_ROWS):
+                yield self._table_chunk(header, rows[begin:begin + self.TABLE_CHUNK_ROWS])
+        if not table.row_count:
+            yield self._table_chunk(header, [])
+        yield Spacer(1, 0.5 * cm)
+
+    def _table_chunks(self, data):
+        """大表格按 TABLE_CHUNK_ROWS 行切成多个 Table，每块重复表头
+
+        单个 Table 需要整体测量所有行，切块后每次只排版一小段。
+        """
+        header, rows = data[0], data[1:]
+        return [self._table_chunk(header, rows[begin:begin + self.TABLE_CHUNK_ROWS])
+                for begin in range(0, max(len(rows), 1), self.TABLE_CHUNK_ROWS)]
+
+    def _table_chunk(self, header, rows):
+        col_widths = [w * inch for w in self.theme.config.get('table', {}).get('col_widths', [2.5, 3.5])]
+        border_width = self.theme.config.get('table', {}).get('border_width', 0.5)
+        style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), self.theme.get_color('table_header')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), self.theme.get_color('table_header_text')),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), self.theme.font_name),
+            ('FONTSIZE', (0, 0), (-1, 0), self.theme.config.get('font_sizes', {}).get('table_header', 12)),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), self.theme.get_color('table_row')),
+            ('GRID', (0, 0), (-1, -1), border_width, self.theme.get_color('table_border'))
+        ])
+        table = Table([header] + rows, colWidths=col_widths, repeatRows=1)
+        table.setStyle(style)
+        return table
+
+    def _cached_story(self, tokens):
+        """经 Flowable 缓存构建完整 story"""
+        story = []
+        used = {}
+        for token in tokens:
+            key = self._token_key(token)
+            if key in used:
+                # 同一文档内重复出现的 token 各自使用独立的 Flowable
+                story.extend(self._build_flowables(token))
+                continue
+            prototypes = self.flowable_cache.get(key)
+            if prototypes is None:
+                prototypes = self._build_flowables(token)
+            used[key] = prototypes
+            # 缓存的是未参与排版的原型；build 会在 Flowable 上记录分页状态，
+            # 所以每次使用浅拷贝（解析好的 frags、单元格数据仍然共享）
+            story.extend(copy.copy(f) for f in prototypes)
+        # 只保留本次用到的 Flowable，watch 模式下缓存不会无限增长
+        self.flowable_cache = used
+        return story
+
+    def _streaming_story(self, tokens):
+        """边解析边构建 Flowable，不经过缓存（外部表格逐块产出，不整体展开）"""
+        for token in tokens:
+            if token['type'] == 'csv_table':
+                yield from self._csv_table_flowables(token)
+            else:
+                yield from self._build_flowables(token)
+
+    def generate(self, markdown_content, output_path=None, streaming=None, base_dir=None):
+        """生成 PDF
+
+        streaming 为 True 时流式消费 token，已排版的 Flowable 随即释放；默认在文档超过
+        STREAMING_THRESHOLD 字符或引用了外部表格（!table）时启用。
+        base_dir 为 !table 相对路径的基准目录，默认当前目录。
+        """
+        if streaming is None:
+            streaming = len(markdown_content) > self.STREAMING_THRESHOLD or \
+                bool(re.search(r'^\s*!table\s', markdown_content, re.M))
         if output_path is None:
             output_path = self.theme.config.get('output', {}).get('filename', 'output.pdf')
 
-        parser = MarkdownParser(markdown_content)
+        parser = MarkdownParser(markdown_content, base_dir)
 
         # 创建文档
         page_size = A4 if self.theme.config.get('page', {}).get('size', 'A4') == 'A4' else letter
@@ -297,81 +541,92 @@ class PDFGenerator:
             rightMargin=spacing.get('right', 1) * cm,
             leftMargin=spacing.get('left', 1) * cm,
             topMargin=spacing.get('top', 1) * cm,
-            bottomMargin=spacing.get('bottom', 1) * cm
+            bottomMargin=spacing.get('bottom', 1) * cm,
+            pageCompression=1 if streaming else None,
         )
 
-        story = []
-
-        for token in parser.tokens:
-            token_type = token['type']
-
-            if token_type == 'title':
-                story.append(Paragraph(self._escape_xml(token['text']), self.styles['title']))
-                story.append(Spacer(1, self.theme.config.get('spacing', {}).get('title_after', 0.5) * cm))
-
-            elif token_type == 'heading':
-                story.append(Paragraph(self._escape_xml(token['text']), self.styles['heading']))
-
-            elif token_type == 'subheading':
-                story.append(Paragraph(self._escape_xml(token['text']), self.styles['subheading']))
-
-            elif token_type == 'paragraph':
-                story.append(Paragraph(self._escape_xml(token['text']), self.styles['normal']))
-
-            elif token_type == 'code':
-                story.append(Paragraph(self._format_code(token['text']), self.styles['code']))
-
-            elif token_type == 'list':
-                for item in token['items']:
-                    story.append(Paragraph(u"\u2022 " + self._escape_xml(item), self.styles['normal']))
-                story.append(Spacer(1, 0.2 * cm))
-
-            elif token_type == 'table':
-                col_widths = [w * inch for w in self.theme.config.get('table', {}).get('col_widths', [2.5, 3.5])]
-                table = Table(token['data'], colWidths=col_widths)
-                border_width = self.theme.config.get('table', {}).get('border_width', 0.5)
-                table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), self.theme.get_color('table_header')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), self.theme.get_color('table_header_text')),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, -1), self.theme.font_name),
-                    ('FONTSIZE', (0, 0), (-1, 0), self.theme.config.get('font_sizes', {}).get('table_header', 12)),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), self.theme.get_color('table_row')),
-                    ('GRID', (0, 0), (-1, -1), border_width, self.theme.get_color('table_border'))
-                ]))
-                story.append(table)
-                story.append(Spacer(1, 0.5 * cm))
-
-            elif token_type == 'divider':
-                story.append(Spacer(1, 0.5 * cm))
+        if streaming:
+            story = _StreamingStory(self._streaming_story(parser.iter_tokens()))
+        else:
+            story = self._cached_story(parser.iter_tokens())
 
         # 生成 PDF
+        author = self.theme.config.get('author', '')
+
         def draw_white_bg(canvas, doc):
             canvas.saveState()
             canvas.setFillColorRGB(1, 1, 1)
             canvas.rect(0, 0, page_size[0], page_size[1], fill=1, stroke=0)
+            if author:
+                # 页脚：左侧作者，右侧页码
+                canvas.setFont(self.theme.font_name, 8)
+                canvas.setFillColorRGB(0.53, 0.53, 0.53)
+                canvas.drawString(doc.leftMargin, doc.bottomMargin / 2, str(author))
+                canvas.drawRightString(page_size[0] - doc.rightMargin, doc.bottomMargin / 2, str(doc.page))
             canvas.restoreState()
 
         doc.build(story, onFirstPage=draw_white_bg, onLaterPages=draw_white_bg)
+        self.page_count = doc.page
         return output_path
 
 
+def watch(content_path, out_path=None, interval=0.3):
+    """监听 Markdown 与主题配置，保存后立即重新生成（进程常驻，字体/样式/Flowable 保持热缓存）"""
+    import time
+
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    generator = PDFGenerator()
+    last = None
+    print(f"[watch] 监听 {content_path}，按 Ctrl+C 退出")
+    while True:
+        current = (mtime(content_path), mtime(generator.theme.config_path))
+        if current != last and current[0] is not None:
+            if last is not None and current[1] != last[1]:
+                generator = PDFGenerator(ThemeManager(generator.theme.config_path))
+            last = current
+            start = time.perf_counter()
+            try:
+                with open(content_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                output_path = generator.generate(content, out_path, base_dir=os.path.dirname(os.path.abspath(content_path)))
+                print(f"[watch] PDF 已更新: {output_path} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+            except Exception as e:
+                print(f"[watch] 生成失败: {e}")
+        time.sleep(interval)
+
+
 def main():
-    """主函数"""
+    """主函数
+
+    用法: python3 pdf_generator.py [file.md] [output.pdf] [--watch] [--stream]
+    """
     import sys
-    content_path = sys.argv[1] if len(sys.argv) > 1 else "main.md"
-    out_path = sys.argv[2] if len(sys.argv) > 2 else None
+    args = [a for a in sys.argv[1:] if a not in ('--watch', '--stream')]
+    content_path = args[0] if len(args) > 0 else "main.md"
+    out_path = args[1] if len(args) > 1 else None
 
     if not os.path.exists(content_path):
         print(f"错误: 找不到 {content_path}")
         sys.exit(1)
 
+    if '--watch' in sys.argv[1:]:
+        try:
+            watch(content_path, out_path)
+        except KeyboardInterrupt:
+            print("\n[watch] 已停止")
+        return
+
     with open(content_path, 'r', encoding='utf-8') as f:
         content = f.read()
 
     generator = PDFGenerator()
-    output_path = generator.generate(content, out_path)
+    output_path = generator.generate(content, out_path, streaming=True if '--stream' in sys.argv[1:] else None,
+                                     base_dir=os.path.dirname(os.path.abspath(content_path)))
     print(f"PDF 生成成功: {output_path}")
 
 
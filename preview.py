@@ -17,15 +17,9 @@ PREVIEW_TEMPLATE = r"""
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{md_filename}</title>
-    <link id="hljs-theme" rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css">
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
-    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/katex.min.css">
-    <script src="https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/katex.min.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/contrib/auto-render.min.js"></script>
+    <link id="hljs-theme" rel="stylesheet">
     <style>
         :root {
-{css_vars}
             --bg-color: #f8f9fa;
             --border-color: #e2e8f0;
         }
@@ -278,6 +272,21 @@ PREVIEW_TEMPLATE = r"""
             border: 1px solid var(--color-table-border);
         }
 
+        .preview-content .csv-table {
+            max-height: 70vh;
+            overflow: auto;
+            margin: 1rem 0;
+        }
+        .preview-content .csv-table .table { margin: 0; table-layout: fixed; }
+        .preview-content .csv-table thead th { position: sticky; top: 0; background: var(--color-table-header); }
+        .preview-content .csv-table td { white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+        .preview-content .csv-table .csv-spacer td { padding: 0; border: none; background: transparent; }
+        body.export .preview-content .csv-table { max-height: none; overflow: visible; }
+
+        .preview-content .chart-wrapper { margin: 1rem 0; text-align: center; }
+
+        .preview-content .image { max-width: 100%; height: auto; }
+
         .preview-content .divider {
             border: none;
             border-top: 1px solid var(--border-color);
@@ -290,6 +299,11 @@ PREVIEW_TEMPLATE = r"""
         ::-webkit-scrollbar-thumb:hover { background: #a1a1a1; }
 
         body.dark main { background: var(--bg-color); }
+        .preview-content .mermaid-static { text-align: center; margin: 1rem 0; }
+        .preview-content .mermaid-static svg { max-width: 100%; height: auto; }
+        .preview-content .mermaid-static .mermaid-dark { display: none; }
+        body.dark .preview-content .mermaid-static .mermaid-light { display: none; }
+        body.dark .preview-content .mermaid-static .mermaid-dark { display: block; }
         body.dark .preview-content { background: var(--surface-color); box-shadow: 0 0 12px rgba(0,0,0,0.4); color: var(--color-text); }
         body.dark .preview-content .code-block { background: var(--color-code-bg); }
         body.dark .preview-content .copy-btn { background: rgba(45,55,72,0.9); border-color: var(--color-table-border); color: var(--color-text); }
@@ -369,6 +383,45 @@ PREVIEW_TEMPLATE = r"""
         .toc-item.h2 { padding-left: 1.75rem; font-size: 0.82rem; color: var(--color-heading); }
         .toc-item.h3 { padding-left: 2.5rem; font-size: 0.78rem; color: var(--color-subheading); }
         .toc-item.h4 { padding-left: 3.25rem; font-size: 0.74rem; color: var(--color-subheading); opacity: 0.7; }
+        .search-panel {
+            position: fixed;
+            top: 4rem;
+            right: 1.5rem;
+            background: rgba(255,255,255,0.15);
+            backdrop-filter: blur(12px);
+            -webkit-backdrop-filter: blur(12px);
+            border: 1px solid rgba(255,255,255,0.2);
+            border-radius: 8px;
+            z-index: 500;
+            width: 360px;
+            max-height: 70vh;
+            overflow-y: auto;
+            box-shadow: 0 4px 16px rgba(0,0,0,0.2);
+            display: none;
+            padding: 0.5rem;
+        }
+        .search-panel.open { display: block; }
+        .search-panel input {
+            width: 100%;
+            padding: 0.4rem 0.6rem;
+            border: 1px solid rgba(128,128,128,0.4);
+            border-radius: 6px;
+            background: transparent;
+            color: var(--color-text);
+            font-size: 0.85rem;
+            outline: none;
+        }
+        .search-item {
+            padding: 0.4rem 0.5rem;
+            font-size: 0.8rem;
+            color: var(--color-text);
+            cursor: pointer;
+            border-radius: 4px;
+            margin-top: 0.25rem;
+        }
+        .search-item:hover, .search-item.active { background: rgba(74,158,255,0.15); }
+        .search-item mark { background: rgba(255,214,0,0.5); color: inherit; }
+        .search-hit { outline: 2px solid rgba(255,214,0,0.8); outline-offset: 2px; transition: outline-color 1s; }
         .theme-dropdown-item {
             padding: 0.5rem 1rem;
             font-size: 0.82rem;
@@ -405,6 +458,14 @@ PREVIEW_TEMPLATE = r"""
         .kb-row + .kb-row { border-top: 1px solid rgba(255,255,255,0.1); }
         .kb-key { background: rgba(255,255,255,0.15); border: 1px solid rgba(255,255,255,0.25); border-radius: 4px; padding: 0.1rem 0.45rem; font-family: monospace; font-size: 0.95rem; color: var(--color-subheading); white-space: nowrap; }
     </style>
+    <link id="theme-css" rel="stylesheet" href="{theme_css_url}">
+    <script>
+        // 主题按客户端选择：导出时取 URL 参数，否则取 localStorage
+        const themeUrls = {theme_urls};
+        const themeParam = new URLSearchParams(location.search).get('theme');
+        const savedTheme = themeParam || localStorage.getItem('markit-theme');
+        if (savedTheme && themeUrls[savedTheme]) document.getElementById('theme-css').href = themeUrls[savedTheme];
+    </script>
 </head>
 <body>
     <button class="header-toggle" id="header-toggle" onclick="toggleHeader()">▲</button>
@@ -420,6 +481,10 @@ PREVIEW_TEMPLATE = r"""
         <div class="kb-modal" id="kb-modal"></div>
     </div>
     <div id="toc-panel" class="toc-panel"></div>
+    <div id="search-panel" class="search-panel">
+        <input id="search-input" type="text" autocomplete="off">
+        <div id="search-results"></div>
+    </div>
 
     <script>
         const preview = document.getElementById('preview');
@@ -429,6 +494,8 @@ PREVIEW_TEMPLATE = r"""
 
         // --- 按钮布局配置 ---
         const btnLayout = {btn_layout};
+        // 目录模式下文档相关的接口位于 /doc/<路径>/ 之下，单文档模式为空
+        const docBase = {doc_base};
 
         let autoRefresh = true;
         let lastHtml = '';
@@ -436,13 +503,15 @@ PREVIEW_TEMPLATE = r"""
         let lang = '{init_lang}';
 
         const i18n = {
-            zh: { autoOn: '自动刷新', autoOff: '✕ 已暂停', export: '导出 PDF', langBtn: '中/EN',
+            zh: { autoOn: '自动刷新', autoOff: '✕ 已暂停', export: '导出 PDF', export_draft: '草稿 PDF', langBtn: '中/EN',
                   kb_title: '快捷键', kb_export: '导出 PDF', kb_dark: '切换暗色模式',
                   kb_theme: '切换主题', kb_topbar: '显示/隐藏顶栏', kb_auto: '切换自动刷新', kb_lang: '切换语言', kb_toc: '目录',
+                  kb_search: '搜索', kb_export_draft: '导出草稿 PDF（ReportLab）', search_placeholder: '搜索文档...', search_empty: '无结果',
                   zoom_label: '缩放' },
-            en: { autoOn: 'Auto Refresh', autoOff: '✕ Paused', export: 'Export PDF', langBtn: 'EN/中',
+            en: { autoOn: 'Auto Refresh', autoOff: '✕ Paused', export: 'Export PDF', export_draft: 'Draft PDF', langBtn: 'EN/中',
                   kb_title: 'Keybindings', kb_export: 'Export PDF', kb_dark: 'Toggle dark mode',
                   kb_theme: 'Switch theme', kb_topbar: 'Toggle topbar', kb_auto: 'Toggle auto refresh', kb_lang: 'Toggle language', kb_toc: 'Table of contents',
+                  kb_search: 'Search', kb_export_draft: 'Export draft PDF (ReportLab)', search_placeholder: 'Search document...', search_empty: 'No results',
                   zoom_label: 'Zoom' }
         };
         function t(key) { return i18n[lang][key]; }
@@ -450,6 +519,12 @@ PREVIEW_TEMPLATE = r"""
         const copyIcon = `<svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>`;
         const checkIcon = `<svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="#4ade80" stroke-width="2.5"><polyline points="20 6 9 17 4 12"/></svg>`;
 
+        // 本地 sprite（devicons.svg#slug）或 CDN 单个图标（含 {slug} 的地址模板）
+        const assets = {assets};
+        function deviconUrl(slug) {
+            return assets.devicons.includes('{slug}') ? assets.devicons.split('{slug}').join(slug) : assets.devicons + '#' + slug;
+        }
+
         const deviconMap = {
             python: 'python', javascript: 'javascript', js: 'javascript',
             typescript: 'typescript', ts: 'typescript', cpp: 'cplusplus',
@@ -488,7 +563,13 @@ PREVIEW_TEMPLATE = r"""
             export_pdf: () => {
                 const b = document.createElement('button');
                 b.className = 'primary';
-                b.onclick = exportPDF;
+                b.onclick = () => exportPDF();
+                return b;
+            },
+            export_draft: () => {
+                const b = document.createElement('button');
+                b.id = 'export-draft-btn';
+                b.onclick = () => exportPDF('reportlab');
                 return b;
             },
             theme_switcher: () => {
@@ -522,6 +603,13 @@ PREVIEW_TEMPLATE = r"""
                 wrap.appendChild(b);
                 return wrap;
             },
+            search: () => {
+                const b = document.createElement('button');
+                b.id = 'search-btn';
+                b.textContent = '🔍';
+                b.onclick = toggleSearch;
+                return b;
+            },
         };
 
         function buildButtons() {
@@ -545,31 +633,12 @@ PREVIEW_TEMPLATE = r"""
             }
         });
 
-        let currentTheme = '{init_theme_name}';
-        let currentDarkVars = {dark_vars_json};  // populated by selectTheme, used by toggleDark
-
-        function applyDarkVars(isDark) {
-            const root = document.documentElement;
-            if (isDark && Object.keys(currentDarkVars).length) {
-                Object.entries(currentDarkVars).forEach(([k, v]) => root.style.setProperty(k, v));
-            } else if (!isDark) {
-                // restore light vars by reloading from server
-                fetch('/api/theme').then(r => r.json()).then(vars => {
-                    Object.entries(vars).forEach(([k, v]) => {
-                        if (!k.startsWith('--font-size') && !k.startsWith('--spacing'))
-                            root.style.setProperty(k, v);
-                    });
-                });
-            }
-        }
+        let currentTheme = savedTheme && themeUrls[savedTheme] ? savedTheme : '{init_theme_name}';
 
         function toggleDark() {
             document.body.classList.toggle('dark');
             const isDark = document.body.classList.contains('dark');
-            hljsTheme.href = isDark
-                ? 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github-dark.min.css'
-                : 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css';
-            applyDarkVars(isDark);
+            if (libs.hljs || libs.hljs_worker) hljsTheme.href = isDark ? assets.hljs_dark_css : assets.hljs_css;
             applyLang();
         }
 
@@ -583,6 +652,7 @@ PREVIEW_TEMPLATE = r"""
             dd.innerHTML = '<div class="theme-dropdown-item" style="color:#888;font-size:0.75rem">Loading...</div>';
             dd.classList.add('open');
             fetch('/api/themes').then(r => r.json()).then(themes => {
+                themes.forEach(t => { themeUrls[t.name] = t.css; });
                 dd.innerHTML = themes.map(t =>
                     `<div class="theme-dropdown-item${t.name === currentTheme ? ' active' : ''}" onclick="selectTheme('${t.name}')">${t.label}</div>`
                 ).join('');
@@ -595,15 +665,17 @@ PREVIEW_TEMPLATE = r"""
         function selectTheme(name) {
             document.getElementById('theme-dropdown').classList.remove('open');
             if (name === currentTheme) return;
-            fetch('/api/set-theme?name=' + encodeURIComponent(name))
-                .then(r => r.json()).then(vars => {
-                    currentTheme = name;
-                    currentDarkVars = vars.dark || {};
-                    delete vars.dark;
-                    const root = document.documentElement;
-                    const isDark = document.body.classList.contains('dark');
-                    Object.entries(isDark ? currentDarkVars : vars).forEach(([k, v]) => root.style.setProperty(k, v));
-                });
+            const apply = url => {
+                currentTheme = name;
+                themeUrls[name] = url;
+                document.getElementById('theme-css').href = url;
+                localStorage.setItem('markit-theme', name);
+            };
+            if (themeUrls[name]) apply(themeUrls[name]);
+            else fetch('/api/themes').then(r => r.json()).then(themes => {
+                const t = themes.find(t => t.name === name);
+                if (t) apply(t.css);
+            });
         }
 
         document.addEventListener('click', e => {
@@ -631,6 +703,8 @@ PREVIEW_TEMPLATE = r"""
             if (langBtn) langBtn.textContent = t('langBtn');
             const exportBtn = document.querySelector('.primary');
             if (exportBtn) exportBtn.textContent = t('export');
+            const draftBtn = document.getElementById('export-draft-btn');
+            if (draftBtn) draftBtn.textContent = t('export_draft');
             preview.querySelectorAll('.copy-btn').forEach(b => {
                 if (!b.classList.contains('copied')) b.innerHTML = copyIcon;
             });
@@ -646,12 +720,14 @@ PREVIEW_TEMPLATE = r"""
             if (!modal) return;
             modal.innerHTML = `<h3>${t('kb_title')}</h3>` +
                 kbRow(hotkeys.export_pdf, t('kb_export')) +
+                kbRow(hotkeys.export_pdf_draft, t('kb_export_draft')) +
                 kbRow(hotkeys.toggle_dark, t('kb_dark')) +
                 kbRow(hotkeys.toggle_theme, t('kb_theme')) +
                 kbRow(hotkeys.toggle_topbar, t('kb_topbar')) +
                 kbRow(hotkeys.toggle_auto_refresh, t('kb_auto')) +
                 kbRow(hotkeys.toggle_lang, t('kb_lang')) +
-                kbRow(hotkeys.toggle_toc, t('kb_toc'));
+                kbRow(hotkeys.toggle_toc, t('kb_toc')) +
+                kbRow(hotkeys.search, t('kb_search'));
         }
 
         function toggleKbModal() {
@@ -663,18 +739,84 @@ PREVIEW_TEMPLATE = r"""
         function toggleToc() {
             const panel = document.getElementById('toc-panel');
             if (panel.classList.contains('open')) { panel.classList.remove('open'); return; }
-            const headings = preview.querySelectorAll('h1,h2,h3,h4');
-            if (!headings.length) { panel.innerHTML = '<div class="toc-item" style="color:#718096">No headings</div>'; }
-            else {
-                headings.forEach((h, idx) => { if (!h.id) h.id = 'heading-' + idx; });
-                panel.innerHTML = Array.from(headings).map(h => {
-                    const cls = {H1:'',H2:' h2',H3:' h3',H4:' h4'}[h.tagName] || '';
-                    return `<div class="toc-item${cls}" onclick="document.getElementById('${h.id}').scrollIntoView({behavior:'smooth'})">${h.textContent}</div>`;
-                }).join('');
+            fetch(docBase + '/api/outline').then(r => r.json()).then(outline => {
+                if (!outline.length) { panel.innerHTML = '<div class="toc-item" style="color:#718096">No headings</div>'; }
+                else {
+                    panel.innerHTML = '';
+                    outline.forEach(h => {
+                        const item = document.createElement('div');
+                        item.className = 'toc-item' + (h.level > 1 ? ' h' + Math.min(h.level, 4) : '');
+                        item.textContent = h.text;
+                        item.onclick = () => scrollToAnchor(h.id, true);
+                        panel.appendChild(item);
+                    });
+                }
+                panel.classList.add('open');
+            });
+        }
+
+        function scrollToAnchor(id, smooth) {
+            const el = document.getElementById(id);
+            if (!el) return;
+            el.scrollIntoView(smooth ? {behavior: 'smooth'} : undefined);
+            history.replaceState(null, '', '#' + encodeURIComponent(id));
+        }
+
+        // --- 全文检索 ---
+        const searchPanel = document.getElementById('search-panel');
+        const searchInput = document.getElementById('search-input');
+        const searchResults = document.getElementById('search-results');
+        let searchTimer = null;
+        let searchNavIdx = -1;
+
+        function toggleSearch() {
+            if (searchPanel.classList.toggle('open')) {
+                searchInput.placeholder = t('search_placeholder');
+                searchInput.focus();
+                searchInput.select();
             }
-            panel.classList.add('open');
         }
 
+        function runSearch() {
+            const q = searchInput.value.trim();
+            if (!q) { searchResults.innerHTML = ''; return; }
+            fetch(docBase + '/api/search?q=' + encodeURIComponent(q)).then(r => r.json()).then(data => {
+                if (searchInput.value.trim() !== q) return;
+                searchNavIdx = -1;
+                if (!data.results.length) {
+                    searchResults.innerHTML = `<div class="search-item" style="color:#718096">${t('search_empty')}</div>`;
+                    return;
+                }
+                searchResults.innerHTML = data.results.map(r =>
+                    `<div class="search-item" data-line="${r.line}">${r.snippet}</div>`).join('');
+                searchResults.querySelectorAll('.search-item').forEach(item => {
+                    item.onclick = () => jumpToLine(item.dataset.line);
+                });
+            });
+        }
+
+        function jumpToLine(line) {
+            const el = preview.querySelector(`[data-line="${line}"]`);
+            if (!el) return;
+            el.scrollIntoView({behavior: 'smooth', block: 'center'});
+            el.classList.add('search-hit');
+            setTimeout(() => el.classList.remove('search-hit'), 1500);
+        }
+
+        searchInput.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(runSearch, 150);
+        });
+        searchInput.addEventListener('keydown', e => {
+            const items = searchResults.querySelectorAll('.search-item[data-line]');
+            if (e.key === 'Escape') { searchPanel.classList.remove('open'); searchInput.blur(); }
+            else if (e.key === 'ArrowDown' && items.length) { e.preventDefault(); searchNavIdx = (searchNavIdx + 1) % items.length; }
+            else if (e.key === 'ArrowUp' && items.length) { e.preventDefault(); searchNavIdx = (searchNavIdx - 1 + items.length) % items.length; }
+            else if (e.key === 'Enter' && items.length) { e.preventDefault(); items[Math.max(searchNavIdx, 0)].click(); return; }
+            else return;
+            items.forEach((el, i) => el.classList.toggle('active', i === searchNavIdx));
+        });
+
         let contentZoom = {init_zoom};
         function applyZoom() { mainEl.style.zoom = contentZoom; }
         applyZoom();
@@ -701,7 +843,7 @@ PREVIEW_TEMPLATE = r"""
                     const slug = deviconMap[rawLang.toLowerCase()];
                     const display = rawLang.charAt(0).toUpperCase() + rawLang.slice(1).toLowerCase();
                     label.innerHTML = slug
-                        ? `<img src="https://cdn.jsdelivr.net/gh/devicons/devicon/icons/${slug}/${slug}-original.svg" width="13" height="13" style="vertical-align:middle;margin-right:3px"> ${display}`
+                        ? `<img src="${deviconUrl(slug)}" width="13" height="13" style="vertical-align:middle;margin-right:3px"> ${display}`
                         : display;
                     wrapper.appendChild(label);
                 }
@@ -719,22 +861,308 @@ PREVIEW_TEMPLATE = r"""
             });
         }
 
-        function loadContent() {
-            fetch('/api/content')
-                .then(r => r.json())
-                .then(data => {
-                    if (data.html !== lastHtml) {
-                        lastHtml = data.html;
-                        preview.innerHTML = data.html;
-                        preview.querySelectorAll('pre code[class]').forEach(el => hljs.highlightElement(el));
-                        addCopyButtons();
-                        mermaid.run({ nodes: preview.querySelectorAll('.mermaid') });
-                        renderMathInElement(preview, { delimiters: [
-                            {left: '$$', right: '$$', display: true},
-                            {left: '$', right: '$', display: false}
-                        ], throwOnError: false });
+        // --- 外部 CSV/TSV 表格：虚拟滚动，按页拉取 ---
+        const exportMode = new URLSearchParams(location.search).has('export');
+        if (exportMode) document.body.classList.add('export');
+        // 导出 PDF 使用原图：插入前去掉响应式 srcset（template 中的图片不会开始加载）
+        function withOriginalImages(html) {
+            if (!exportMode || html.indexOf('srcset=') < 0) return html;
+            const tpl = document.createElement('template');
+            tpl.innerHTML = html;
+            tpl.content.querySelectorAll('img[srcset]').forEach(img => { img.removeAttribute('srcset'); img.removeAttribute('sizes'); });
+            return tpl.innerHTML;
+        }
+        const csvPages = new Map();
+
+        function escHtml(v) {
+            return String(v).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+        }
+
+        function fetchCsvPage(wrap, page) {
+            const key = wrap.dataset.src + '|' + wrap.dataset.mtime + '|' + page;
+            if (!csvPages.has(key)) {
+                csvPages.set(key, fetch(docBase + '/api/table?src=' + encodeURIComponent(wrap.dataset.src) + '&page=' + page)
+                    .then(r => { if (!r.ok) throw new Error('HTTP ' + r.status); return r.json(); })
+                    .then(d => d.rows)
+                    .catch(e => { csvPages.delete(key); throw e; }));
+            }
+            return csvPages.get(key);
+        }
+
+        function csvRowsHtml(rows) {
+            return rows.map(r => '<tr>' + r.map(c => `<td>${escHtml(c)}</td>`).join('') + '</tr>').join('');
+        }
+
+        function setupCsvTable(wrap) {
+            const total = +wrap.dataset.rows, pageSize = +wrap.dataset.pageSize;
+            const tbody = wrap.querySelector('tbody');
+            if (total <= pageSize) return;
+            if (exportMode) {
+                // 导出：每页作为一个带表头的独立 <table> 依次追加，服务端每次只读取一页，
+                // 脚本侧不保留已插入的数据；页面本身仍需容纳完整表格才能打印
+                wrap.dataset.loading = '1';
+                const thead = wrap.querySelector('thead').outerHTML;
+                let chain = Promise.resolve();
+                for (let p = 1; p * pageSize < total; p++) {
+                    chain = chain.then(() => fetchCsvPage(wrap, p)).then(rows => {
+                        wrap.insertAdjacentHTML('beforeend', `<table class="table">${thead}<tbody>${csvRowsHtml(rows)}</tbody></table>`);
+                        csvPages.clear();
+                    });
+                }
+                // 加载失败时在导出结果中注明，而不是只留下首页数据
+                chain.catch(e => {
+                    wrap.insertAdjacentHTML('beforeend', `<blockquote class="quote">⚠ !table ${escHtml(wrap.dataset.src)}: 其余行加载失败 (${escHtml(e.message)})</blockquote>`);
+                }).finally(() => { delete wrap.dataset.loading; });
+                return;
+            }
+            const cols = wrap.querySelectorAll('thead th').length;
+            const rowH = (tbody.rows[0] && tbody.rows[0].offsetHeight) || 32;
+            let ticket = 0, scheduled = false;
+            const render = () => {
+                scheduled = false;
+                const first = Math.max(0, Math.floor(wrap.scrollTop / rowH) - 20);
+                const last = Math.min(total, first + Math.ceil(wrap.clientHeight / rowH) + 40);
+                const pages = [];
+                for (let p = Math.floor(first / pageSize); p <= Math.floor((last - 1) / pageSize); p++) pages.push(p);
+                const mine = ++ticket;
+                Promise.all(pages.map(p => fetchCsvPage(wrap, p))).then(chunks => {
+                    if (mine !== ticket) return;
+                    const rows = [].concat(...chunks).slice(first - pages[0] * pageSize, last - pages[0] * pageSize);
+                    const spacer = h => `<tr class="csv-spacer"><td colspan="${cols}" style="height:${h}px"></td></tr>`;
+                    tbody.innerHTML = spacer(first * rowH) + csvRowsHtml(rows) + spacer((total - last) * rowH);
+                });
+            };
+            wrap.addEventListener('scroll', () => { if (!scheduled) { scheduled = true; requestAnimationFrame(render); } });
+            render();
+        }
+
+        // --- 前端库按需加载：服务端报告文档用到的特性，没用到的库不下载 ---
+        const libs = {};
+
+        function loadScript(src) {
+            return new Promise((resolve, reject) => {
+                const el = document.createElement('script');
+                el.src = src;
+                el.onload = resolve;
+                el.onerror = reject;
+                document.head.appendChild(el);
+            });
+        }
+
+        function loadStyle(href) {
+            const el = document.createElement('link');
+            el.rel = 'stylesheet';
+            el.href = href;
+            document.head.appendChild(el);
+        }
+
+        function ensureLib(name) {
+            if (!libs[name]) {
+                if (name === 'hljs') {
+                    hljsTheme.href = document.body.classList.contains('dark') ? assets.hljs_dark_css : assets.hljs_css;
+                    libs[name] = loadScript(assets.hljs_js);
+                } else if (name === 'hljs_worker') {
+                    hljsTheme.href = document.body.classList.contains('dark') ? assets.hljs_dark_css : assets.hljs_css;
+                    libs[name] = Promise.resolve(startHighlightWorker());
+                } else if (name === 'mermaid') {
+                    libs[name] = loadScript(assets.mermaid_js).then(() => mermaid.initialize({ startOnLoad: false }));
+                } else if (name === 'katex_css') {
+                    libs[name] = Promise.resolve(loadStyle(assets.katex_css));
+                } else if (name === 'katex') {
+                    ensureLib('katex_css');
+                    libs[name] = loadScript(assets.katex_js).then(() => loadScript(assets.katex_auto_render_js));
+                }
+            }
+            return libs[name];
+        }
+
+        // --- 渐进增强：视口附近的代码 / 图表 / 公式优先，其余在空闲时处理 ---
+        let enhanceItems = [];        // 当前内容的全部 {el, kind, done}
+        let enhanceQueue = [];        // 尚未开始处理的部分，按文档顺序
+        let enhanceObserver = null;
+        let idleHandle = null;
+        const idle = window.requestIdleCallback || (cb => setTimeout(() => cb({ timeRemaining: () => 8 }), 50));
+        const cancelIdle = window.cancelIdleCallback || clearTimeout;
+
+        // --- 代码高亮放到 Web Worker，结果按 (代码, 语言) 的哈希缓存，刷新后未变的代码块直接复用 ---
+        const highlightCache = new Map();   // 哈希 -> {code, lang, html}
+        const HIGHLIGHT_CACHE_MAX = 1000;
+        let highlightWorker = null;
+        let highlightSeq = 0;
+        const highlightPending = new Map(); // 请求 id -> {resolve, reject}
+
+        function hashKey(code, lang) {
+            // FNV-1a 32 位；命中时再比较原文，哈希冲突不会用错结果
+            let h = 0x811c9dc5;
+            const s = lang + '\0' + code;
+            for (let i = 0; i < s.length; i++) {
+                h ^= s.charCodeAt(i);
+                h = Math.imul(h, 0x01000193);
+            }
+            return lang + ':' + s.length + ':' + (h >>> 0).toString(16);
+        }
+
+        function startHighlightWorker() {
+            if (typeof Worker === 'undefined') return null;
+            const src = `importScripts(${JSON.stringify(new URL(assets.hljs_js, location.href).href)});
+                onmessage = e => {
+                    const { id, code, lang } = e.data;
+                    try {
+                        const html = self.hljs.getLanguage(lang)
+                            ? self.hljs.highlight(code, { language: lang, ignoreIllegals: true }).value
+                            : self.hljs.highlightAuto(code).value;
+                        postMessage({ id, html });
+                    } catch (err) {
+                        postMessage({ id, error: String(err) });
                     }
+                };`;
+            try {
+                highlightWorker = new Worker(URL.createObjectURL(new Blob([src], { type: 'text/javascript' })));
+            } catch (err) {
+                return null;
+            }
+            highlightWorker.onmessage = e => {
+                const p = highlightPending.get(e.data.id);
+                highlightPending.delete(e.data.id);
+                if (p) e.data.error ? p.reject(e.data.error) : p.resolve(e.data.html);
+            };
+            highlightWorker.onerror = () => {
+                // Worker 无法加载（如脚本被拦截）：退回主线程高亮
+                highlightWorker = null;
+                highlightPending.forEach(p => p.reject('worker failed'));
+                highlightPending.clear();
+            };
+            return highlightWorker;
+        }
+
+        function highlightCode(code, lang) {
+            const key = hashKey(code, lang);
+            const hit = highlightCache.get(key);
+            if (hit && hit.code === code && hit.lang === lang) {
+                // LRU：命中的条目移到末尾，淘汰时从最久未用的开头删除
+                highlightCache.delete(key);
+                highlightCache.set(key, hit);
+                return Promise.resolve(hit.html);
+            }
+            if (!highlightWorker) return Promise.reject('no worker');
+            const id = ++highlightSeq;
+            return new Promise((resolve, reject) => {
+                highlightPending.set(id, { resolve, reject });
+                highlightWorker.postMessage({ id, code, lang });
+            }).then(html => {
+                highlightCache.delete(key);
+                if (highlightCache.size >= HIGHLIGHT_CACHE_MAX) highlightCache.delete(highlightCache.keys().next().value);
+                highlightCache.set(key, { code, lang, html });
+                return html;
+            });
+        }
+
+        function highlightBlock(el) {
+            const lang = el.className.trim().split(/\s+/)[0].toLowerCase();
+            const code = el.textContent;
+            return ensureLib('hljs_worker')
+                .then(() => highlightCode(code, lang))
+                .then(html => {
+                    el.innerHTML = html;
+                    el.classList.add('hljs', 'language-' + lang);
+                })
+                .catch(() => ensureLib('hljs').then(() => hljs.highlightElement(el)));
+        }
+
+        function runEnhance(item) {
+            if (item.done) return item.done;
+            if (enhanceObserver) enhanceObserver.unobserve(item.el);
+            const el = item.el;
+            if (item.kind === 'hljs') {
+                item.done = highlightBlock(el);
+            } else if (item.kind === 'mermaid') {
+                item.done = ensureLib('mermaid').then(() => mermaid.run({ nodes: [el] }));
+            } else {
+                item.done = ensureLib('katex').then(() => renderMathInElement(el, { delimiters: [
+                    {left: '$$', right: '$$', display: true},
+                    {left: '$', right: '$', display: false}
+                ], throwOnError: false }));
+            }
+            item.done = item.done.catch(err => console.error(err));
+            return item.done;
+        }
+
+        function drainIdle(deadline) {
+            idleHandle = null;
+            while (enhanceQueue.length && deadline.timeRemaining() > 4) {
+                const item = enhanceQueue.shift();
+                if (!item.done) runEnhance(item);
+            }
+            if (enhanceQueue.length) idleHandle = idle(drainIdle);
+            else preview.dataset.enhanced = '1';
+        }
+
+        function enhance(features) {
+            if (enhanceObserver) enhanceObserver.disconnect();
+            if (idleHandle !== null) cancelIdle(idleHandle);
+            const items = [];
+            // 服务端已预渲染的公式只需 KaTeX 样式
+            if (features.math_css) ensureLib('katex_css');
+            if (features.languages && features.languages.length) {
+                preview.querySelectorAll('pre code[class]').forEach(el => items.push({ el, kind: 'hljs' }));
+            }
+            if (features.mermaid) {
+                preview.querySelectorAll('.mermaid').forEach(el => items.push({ el, kind: 'mermaid' }));
+            }
+            if (features.math) {
+                Array.from(preview.children).forEach(el => {
+                    if (el.textContent.includes('$') && !el.matches('.code-wrapper, .mermaid')) items.push({ el, kind: 'math' });
                 });
+            }
+            items.sort((a, b) => a.el.compareDocumentPosition(b.el) & Node.DOCUMENT_POSITION_FOLLOWING ? -1 : 1);
+            enhanceItems = items;
+            enhanceQueue = items.slice();
+            if (!items.length) { preview.dataset.enhanced = '1'; return; }
+            const byEl = new Map(items.map(item => [item.el, item]));
+            enhanceObserver = new IntersectionObserver(entries => {
+                entries.forEach(e => { if (e.isIntersecting) runEnhance(byEl.get(e.target)); });
+            }, { root: document.querySelector('main'), rootMargin: '800px 0px' });
+            items.forEach(item => enhanceObserver.observe(item.el));
+            idleHandle = idle(drainIdle);
+            if (exportMode) markitEnhanceAll();
+        }
+
+        // 立即处理全部剩余内容（导出 PDF 前调用），全部完成后 resolve
+        window.markitEnhanceAll = function () {
+            enhanceQueue = [];
+            if (idleHandle !== null) { cancelIdle(idleHandle); idleHandle = null; }
+            return Promise.all(enhanceItems.map(runEnhance))
+                .then(() => document.fonts ? document.fonts.ready : null)
+                .then(() => { preview.dataset.enhanced = '1'; });
+        };
+
+        function applyContent(data) {
+            if (data.html === lastHtml) return;
+            const firstLoad = !lastHtml;
+            lastHtml = data.html;
+            delete preview.dataset.enhanced;
+            preview.innerHTML = withOriginalImages(data.html);
+            addCopyButtons();
+            preview.querySelectorAll('.csv-table').forEach(setupCsvTable);
+            enhance(data.features || {});
+            if (firstLoad && location.hash) scrollToAnchor(decodeURIComponent(location.hash.slice(1)), false);
+        }
+
+        function loadContent() {
+            fetch(docBase + '/api/content').then(r => r.json()).then(applyContent);
+        }
+
+        // 编辑器通过 WebSocket 推送未保存的内容时，服务端直接把渲染结果推到页面；断开后自动重连
+        let liveDelay = 1000;
+        function connectLive() {
+            if (exportMode || !('WebSocket' in window)) return;
+            const ws = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + docBase + '/ws');
+            ws.onopen = () => { liveDelay = 1000; ws.send(JSON.stringify({ type: 'subscribe' })); };
+            ws.onmessage = e => {
+                const msg = JSON.parse(e.data);
+                if (msg.type === 'content' && autoRefresh) applyContent(msg);
+            };
+            ws.onclose = () => { setTimeout(connectLive, liveDelay); liveDelay = Math.min(liveDelay * 2, 30000); };
         }
 
         let toastTimer = null;
@@ -753,12 +1181,15 @@ PREVIEW_TEMPLATE = r"""
             toastTimer = setTimeout(() => { toast.classList.remove('show'); }, 1500);
         }
 
-        function exportPDF() {
+        function exportPDF(engine) {
             if (exportStatus) return;
             exportStatus = true;
             showToast('⏳', lang === 'zh' ? '正在生成 PDF...' : 'Generating PDF...', false);
-            fetch('/api/export-pdf')
+            const params = new URLSearchParams({ theme: currentTheme });
+            if (engine) params.set('engine', engine);
+            fetch(docBase + '/api/export-pdf?' + params)
                 .then(r => r.ok ? r.text() : Promise.reject())
+                .then(text => text.startsWith('PDF 生成失败') ? Promise.reject() : text)
                 .then(path => { showToast('✅', (lang === 'zh' ? '导出 PDF 到 ' : 'Exported PDF to ') + path, false); })
                 .catch(() => { showToast('❌', lang === 'zh' ? '导出失败' : 'Export failed', true); })
                 .finally(() => { exportStatus = null; });
@@ -792,6 +1223,7 @@ PREVIEW_TEMPLATE = r"""
             }
 
             if (hotkeys.export_pdf && k === hotkeys.export_pdf) exportPDF();
+            else if (hotkeys.export_pdf_draft && k === hotkeys.export_pdf_draft) exportPDF('reportlab');
             else if (hotkeys.toggle_dark && k === hotkeys.toggle_dark) toggleDark();
             else if (hotkeys.toggle_theme && k === hotkeys.toggle_theme) { themeNavIdx = -1; toggleThemeDropdown(); }
             else if (hotkeys.toggle_topbar && k === hotkeys.toggle_topbar) toggleHeader();
@@ -799,6 +1231,7 @@ PREVIEW_TEMPLATE = r"""
             else if (hotkeys.toggle_lang && k === hotkeys.toggle_lang) toggleLang();
             else if (e.key === '?' || (hotkeys.keybindings && k === hotkeys.keybindings)) toggleKbModal();
             else if (hotkeys.toggle_toc && k === hotkeys.toggle_toc) toggleToc();
+            else if (hotkeys.search && k === hotkeys.search) { e.preventDefault(); toggleSearch(); }
         });
 
         // --- 初始化 ---
@@ -807,59 +1240,88 @@ PREVIEW_TEMPLATE = r"""
         if ('{init_topbar}' === 'false') toggleHeader();
         applyLang();
         loadContent();
+        connectLive();
         setInterval(() => { if (autoRefresh) loadContent(); }, 1500);
     </script>
 </body>
 </html>
 """
 
+INDEX_TEMPLATE = r"""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Noto Sans CJK SC", sans-serif;
+               background: #f8f9fa; color: #2d3748; }
+        .index { max-width: 860px; margin: 1.5rem auto; padding: 2rem; background: white; box-shadow: 0 0 12px rgba(0,0,0,0.08); }
+        h1 { font-size: 1.4rem; margin-bottom: 0.25rem; }
+        .root { color: #718096; font-size: 0.85rem; margin-bottom: 1rem; word-break: break-all; }
+        #filter { width: 100%; padding: 0.5rem 0.75rem; border: 1px solid #e2e8f0; border-radius: 6px; font-size: 0.95rem; margin-bottom: 1rem; }
+        .doc { display: flex; justify-content: space-between; padding: 0.4rem 0.25rem; border-bottom: 1px solid #edf2f7; }
+        .doc a { color: #3182ce; text-decoration: none; }
+        .doc a:hover { text-decoration: underline; }
+        .doc .dir { color: #a0aec0; }
+        .doc .mtime { color: #a0aec0; font-size: 0.8rem; white-space: nowrap; margin-left: 1rem; }
+        .empty { color: #718096; }
+    </style>
+</head>
+<body>
+    <div class="index">
+        <h1>{title}</h1>
+        <div class="root">{root} · {count}</div>
+        <input id="filter" type="text" placeholder="Filter..." autocomplete="off" autofocus>
+        <div id="docs">{items}</div>
+    </div>
+    <script>
+        const items = Array.from(document.querySelectorAll('.doc'));
+        document.getElementById('filter').addEventListener('input', e => {
+            const q = e.target.value.toLowerCase();
+            items.forEach(el => { el.style.display = el.dataset.path.toLowerCase().includes(q) ? '' : 'none'; });
+        });
+    </script>
+</body>
+</html>
+"""
+
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     daemon_threads = True
-from threading import Thread
+from threading import Thread, Lock, Timer, Event, get_ident
 import webbrowser
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import socket
 import re
+from collections import Counter
+from theme_compiler import ThemeRegistry
+from csv_table import csv_tables
 
 
 class ThemeManager:
-    """主题管理器"""
+    """主题管理器（主题在 ThemeRegistry 中解析、编译一次，以只读快照共享）"""
 
     def __init__(self, config_dir=None):
         self.base_dir = config_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
-        self.config = self._load_config()
-
-    def _load_config(self):
-        main_cfg_path = os.path.join(self.base_dir, 'config.yaml')
-        if not os.path.exists(main_cfg_path):
-            # 兼容旧路径
-            old = os.path.join(os.path.dirname(self.base_dir), 'theme_config.yaml')
-            if os.path.exists(old):
-                with open(old, 'r', encoding='utf-8') as f:
-                    return yaml.safe_load(f) or {}
-            return {}
-        with open(main_cfg_path, 'r', encoding='utf-8') as f:
-            main = yaml.safe_load(f) or {}
-        theme_name = main.get('theme', 'default')
-        theme_path = os.path.join(self.base_dir, 'themes', f'{theme_name}.yaml')
-        if not os.path.exists(theme_path):
-            theme_path = os.path.join(self.base_dir, 'themes', 'default.yaml')
-        theme_cfg = {}
-        if os.path.exists(theme_path):
-            with open(theme_path, 'r', encoding='utf-8') as f:
-                theme_cfg = yaml.safe_load(f) or {}
-        # 合并：main 中的 preview/buttons/font_sizes/spacing 保留，theme 文件提供颜色等
-        result = dict(theme_cfg)
-        result['preview'] = main.get('preview', {})
-        result['buttons'] = main.get('buttons', {})
-        result['font_sizes'] = main.get('font_sizes', theme_cfg.get('font_sizes', {}))
-        result['spacing'] = main.get('spacing', theme_cfg.get('spacing', {}))
-        result['hotkeys'] = main.get('hotkeys', {})
-        result['theme'] = theme_name
-        result['author'] = main.get('author', '')
-        result['pdf'] = main.get('pdf', {})
-        return result
+        self.registry = ThemeRegistry(self.base_dir)
+
+    def snapshot(self):
+        """当前配置快照；一次请求内只取一次"""
+        return self.registry.snapshot
+
+    @property
+    def config(self):
+        return self.registry.snapshot.config
+
+    def reload(self, path=None):
+        """配置文件变化：只更新该文件对应的主题，未指定时全部重新加载"""
+        if path is None:
+            self.registry.reload()
+            return True
+        return self.registry.update(path)
 
     def get_color(self, key, default='#000000'):
         """获取颜色"""
@@ -879,66 +1341,217 @@ class ThemeManager:
 
     def to_html_vars(self):
         """转换为 HTML CSS 变量"""
-        return {
-            '--color-title': self.get_color('title', '#1a365d'),
-            '--color-heading': self.get_color('heading', '#2c5282'),
-            '--color-subheading': self.get_color('subheading', '#2f855a'),
-            '--color-text': self.get_color('text', '#1a202c'),
-            '--color-code-bg': self.get_color('code_bg', '#f7fafc'),
-            '--color-code-text': self.get_color('code_text', '#1a202c'),
-            '--color-table-header': self.get_color('table_header', '#2c5282'),
-            '--color-table-header-text': self.get_color('table_header_text', '#ffffff'),
-            '--color-table-row': self.get_color('table_row', '#ebf8ff'),
-            '--color-table-border': self.get_color('table_border', '#a0aec0'),
-            '--color-link': self.get_color('link', '#3182ce'),
-            '--header-bg': self.get_color('topbar_bg', 'linear-gradient(135deg, #1a365d 0%, #2c5282 100%)'),
-            '--header-text': self.get_color('topbar_text', '#ffffff'),
-
-            '--font-size-title': self.get_font_size('title', 28),
-            '--font-size-heading': self.get_font_size('heading', 18),
-            '--font-size-subheading': self.get_font_size('subheading', 14),
-            '--font-size-subsubheading': self.get_font_size('subsubheading', 12),
-            '--font-size-normal': self.get_font_size('normal', 11),
-            '--font-size-code': self.get_font_size('code', 9),
-            '--font-size-table-header': self.get_font_size('table_header', 12),
-
-            '--spacing-title-after': self.get_spacing('title_after', 0.5),
-            '--spacing-heading-before': self.get_spacing('heading_before', 0.4),
-            '--spacing-heading-after': self.get_spacing('heading_after', 0.3),
-            '--spacing-subheading-before': self.get_spacing('subheading_before', 0.3),
-            '--spacing-subheading-after': self.get_spacing('subheading_after', 0.2),
-            '--spacing-normal-after': self.get_spacing('normal_after', 0.2),
-            '--spacing-code-after': self.get_spacing('spacing_after', 0.3),
-        }
-
-    def _get_dark(self, key, default):
-        return self.config.get('dark_colors', {}).get(key, default)
+        return dict(self.compiled.light_vars)
 
     def to_dark_html_vars(self):
         """转换为 dark mode CSS 变量"""
-        return {
-            '--color-title': self._get_dark('title', '#90cdf4'),
-            '--color-heading': self._get_dark('heading', '#63b3ed'),
-            '--color-subheading': self._get_dark('subheading', '#68d391'),
-            '--color-text': self._get_dark('text', '#e2e8f0'),
-            '--color-code-bg': self._get_dark('code_bg', '#2d3748'),
-            '--color-code-text': self._get_dark('code_text', '#e2e8f0'),
-            '--color-table-header': self._get_dark('table_header', '#2c5282'),
-            '--color-table-header-text': self._get_dark('table_header_text', '#e2e8f0'),
-            '--color-table-row': self._get_dark('table_row', '#1e3a5f'),
-            '--color-table-border': self._get_dark('table_border', '#4a5568'),
-            '--bg-color': self._get_dark('bg', '#1a1a2e'),
-            '--surface-color': self._get_dark('surface', '#1e2433'),
-            '--header-bg': self._get_dark('topbar_bg', 'linear-gradient(135deg, #1a365d 0%, #2c5282 100%)'),
-            '--header-text': self._get_dark('topbar_text', '#ffffff'),
-        }
+        return dict(self.compiled.dark_vars)
+
+
+# KaTeX auto-render 识别的公式分隔符：$$...$$ 与 $...$
+_MATH_RE = re.compile(r'\$\$[\s\S]+?\$\$|\$[^$\n]+\$')
+
+# !include 代码文件的扩展名 -> 代码块语言
+INCLUDE_LANGS = {
+    '.py': 'python', '.js': 'javascript', '.ts': 'typescript', '.sh': 'bash',
+    '.c': 'c', '.h': 'c', '.cpp': 'cpp', '.hpp': 'cpp', '.cc': 'cpp',
+    '.go': 'go', '.rs': 'rust', '.java': 'java', '.rb': 'ruby',
+    '.yaml': 'yaml', '.yml': 'yaml', '.json': 'json', '.html': 'html',
+    '.css': 'css', '.sql': 'sql', '.txt': '',
+}
 
 
 class MarkdownToHTML:
     """Markdown 转 HTML"""
 
-    def __init__(self, theme):
+    def __init__(self, theme, asset_url=None):
         self.theme = theme
+        # 预览服务中主文档目录之外的本地文件（上级目录片段中的图片）改经该前缀加载：
+        # 浏览器会把 ../ 截断在站点根，相对路径无法访问到这些文件
+        self.asset_url = asset_url
+        self.outline = []
+        self.blocks = []
+        self.dependencies = set()
+        self.assets = set()      # 引用的本地图片（预览服务只提供其中的文件）
+        self.tables = set()      # !table 引用的表格文件（/api/table 只提供其中的文件）
+        self.features = self._empty_features()
+        self.base_dir = os.getcwd()
+        self._slugs = set()
+        self.line_map = None     # 展开 !include 后的行号 -> 源文件行号（None 表示未展开）
+
+    @staticmethod
+    def _empty_features():
+        """文档用到的需前端库的特性：代码语言（highlight.js）、mermaid、数学公式（KaTeX）
+
+        mermaid / math 只统计未能服务端预渲染的部分；math_css 表示有预渲染公式，只需 KaTeX 样式
+        """
+        return {'languages': set(), 'mermaid': False, 'math': False, 'math_css': False}
+
+    def features_json(self):
+        f = self.features
+        return {'languages': sorted(f['languages']), 'mermaid': f['mermaid'], 'math': f['math'],
+                'math_css': f['math_css']}
+
+    def _add_dependency(self, src):
+        """记录文档引用的本地文件（图片等），供依赖图定向失效"""
+        if not src or re.match(r'^[a-zA-Z][\w+.-]*:|^//|^#', src):
+            return
+        src = src.split('#')[0].split('?')[0].replace('&amp;', '&')
+        path = os.path.normpath(os.path.join(self.base_dir, src))
+        self.dependencies.add(path)
+        self.assets.add(path)
+
+    def _asset_src(self, src):
+        """图片地址：指向主文档目录之外的本地文件时改为 asset_url + 相对路径"""
+        if not self.asset_url or re.match(r'^[a-zA-Z][\w+.-]*:|^//|^/|^#', src):
+            return src
+        if not os.path.normpath(src.split('#')[0].split('?')[0]).startswith('..'):
+            return src
+        from urllib.parse import quote
+        return self.asset_url + quote(src.replace('&amp;', '&'), safe='/#')
+
+    def expand_includes(self, markdown_content, base_dir, _stack=(), _root=None):
+        """展开 !include 指令
+
+        `!include part.md` 内联另一个 Markdown 文件；`!include src/a.py:10-20`
+        以代码块形式插入代码文件的第 10~20 行。路径相对于所在文件目录：片段中的图片、
+        `!table` 与 ```chart 的 data 路径在内联时改写为相对于主文档目录。
+        顶层调用同时生成 self.line_map：片段内容的各行对应主文档中 !include 所在行。
+        """
+        root = _root or base_dir
+        lines = markdown_content.split('\n')
+        out = []
+        marks = []   # (out 中的位置, 本文件行号)
+        fence = None
+        for idx, line in enumerate(lines):
+            marks.append((len(out), idx))
+            if line.strip().startswith('```'):
+                fence = None if fence is not None else line.strip()[3:].strip().lower()
+            m = None if fence is not None else re.match(r'^!include\s+(\S+?)(?::(\d+)-(\d+))?\s*$', line.strip())
+            if not m:
+                out.append(self._rebase_line(line, fence, base_dir, root) if base_dir != root else line)
+                continue
+            path = os.path.normpath(os.path.join(base_dir, m.group(1)))
+            if path in _stack or len(_stack) >= 8:
+                out.extend(['', f'> ⚠ !include 循环引用: {m.group(1)}', ''])
+                continue
+            self.dependencies.add(path)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except OSError:
+                out.extend(['', f'> ⚠ !include 找不到文件: {m.group(1)}', ''])
+                continue
+            content = content.rstrip('\n')
+            if m.group(2):
+                first, last = int(m.group(2)), int(m.group(3))
+                content = '\n'.join(content.split('\n')[max(first - 1, 0):last])
+            ext = os.path.splitext(path)[1].lower()
+            if ext in ('.md', '.markdown'):
+                out.extend(['', self.expand_includes(content, os.path.dirname(path), _stack + (path,), root), ''])
+            else:
+                lang = INCLUDE_LANGS.get(ext, ext.lstrip('.'))
+                out.extend(['', f'```{lang}', content, '```', ''])
+        if _root is None:
+            self.line_map = []
+            marks.append((len(out), None))
+            for (pos, idx), (end, _) in zip(marks, marks[1:]):
+                for item in out[pos:end]:
+                    self.line_map.extend([idx] * (item.count('\n') + 1))
+        return '\n'.join(out)
+
+    @staticmethod
+    def _rebase(src, base_dir, root):
+        """片段中的相对路径 -> 相对于主文档目录；URL、绝对路径与锚点不变"""
+        if re.match(r'^[a-zA-Z][\w+.-]*:|^//|^/|^#', src):
+            return src
+        rebased = os.path.relpath(os.path.normpath(os.path.join(base_dir, src)), root)
+        return rebased.replace(os.sep, '/')
+
+    def _rebase_line(self, line, fence, base_dir, root):
+        """改写片段中一行内引用的本地文件路径（fence 为所在代码块的语言，不在代码块中为 None）"""
+        rebase = lambda src: self._rebase(src, base_dir, root)
+        if fence is not None:
+            if fence == 'chart':
+                line = re.sub(r'^(\s*data\s*:\s*)([\'"]?)([^\'"\s#]+)\2',
+                              lambda m: m.group(1) + m.group(2) + rebase(m.group(3)) + m.group(2), line)
+            return line
+        m = re.match(r'^(\s*!table\s+)(\S+)(\s*)$', line)
+        if m:
+            return m.group(1) + rebase(m.group(2)) + m.group(3)
+        line = re.sub(r'(!\[[^\]]*\]\()([^)\s]+)(\))', lambda m: m.group(1) + rebase(m.group(2)) + m.group(3), line)
+        line = re.sub(r'(<img\b[^>]*?\ssrc=)(["\'])([^"\']+)\2',
+                      lambda m: m.group(1) + m.group(2) + rebase(m.group(3)) + m.group(2), line)
+        return line
+
+    def _plain_text(self, text):
+        """去掉内联 Markdown 标记，得到纯文本"""
+        text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+        text = re.sub(r'[*_~`]', '', text)
+        return text.strip()
+
+    def _slugify(self, text):
+        """生成稳定的标题锚点（与已有锚点重复时追加 -1、-2 ...，直到不重复）"""
+        base = re.sub(r'[^\w\s-]', '', text.lower()).strip()
+        base = re.sub(r'[\s]+', '-', base) or 'section'
+        slug, count = base, 0
+        while slug in self._slugs:
+            count += 1
+            slug = f'{base}-{count}'
+        self._slugs.add(slug)
+        return slug
+
+    def _source_line(self, line_no):
+        """展开后的行号 -> 源文件行号（片段中的行对应 !include 所在行）"""
+        return line_no if self.line_map is None else self.line_map[line_no]
+
+    def _block(self, line_no, text):
+        """登记一个内容块（供全文检索），返回 data-line 属性（源文件行号）"""
+        line = self._source_line(line_no) + 1
+        self.blocks.append({'line': line, 'text': self._plain_text(text)})
+        return f' data-line="{line}"'
+
+    def _heading(self, level, css_class, text, line_no, offset):
+        """渲染标题并记录到大纲"""
+        plain = self._plain_text(text)
+        slug = self._slugify(plain)
+        self.outline.append({'id': slug, 'level': level, 'text': plain, 'offset': offset})
+        tag = f'h{min(level, 4)}'
+        attrs = self._block(line_no, text)
+        return f'<{tag} class="{css_class}" id="{slug}"{attrs}>{self._inline(self._escape_html(text))}</{tag}>'
+
+    def _csv_table(self, src, line_no):
+        """渲染外部表格：表头 + 首页数据，其余行由前端按需分页加载"""
+        path = os.path.normpath(os.path.join(self.base_dir, src))
+        self.dependencies.add(path)
+        self.tables.add(path)
+        try:
+            table = csv_tables.get(path)
+        except (OSError, UnicodeError) as e:
+            return f'<blockquote class="quote">⚠ !table 无法读取 {self._escape_html(src)}: {self._escape_html(str(e))}</blockquote>'
+        esc = lambda v: v.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        line = self._source_line(line_no) + 1
+        self.blocks.append({'line': line, 'text': ' '.join(table.header)})
+        out = [f'<div class="csv-table" data-line="{line}" data-src="{esc(src)}" '
+               f'data-rows="{table.row_count}" data-page-size="{table.PAGE_SIZE}" data-mtime="{table.mtime}">',
+               '<table class="table"><thead><tr>']
+        out.extend(f'<th>{esc(cell)}</th>' for cell in table.header)
+        out.append('</tr></thead><tbody>')
+        for row in table.page(0):
+            out.append('<tr>' + ''.join(f'<td>{esc(cell)}</td>' for cell in row) + '</tr>')
+        out.append('</tbody></table></div>')
+        return ''.join(out)
+
+    def _chart(self, spec_text, block_attr):
+        """渲染 ```chart 代码块为内联 SVG"""
+        try:
+            svg, path = chart_renderer.render(spec_text, self.base_dir)
+        except ImportError:
+            return f'<blockquote class="quote"{block_attr}>⚠ chart 需要安装 numpy</blockquote>'
+        except Exception as e:
+            return f'<blockquote class="quote"{block_attr}>⚠ chart: {self._escape_html(str(e))}</blockquote>'
+        self.dependencies.add(path)
+        return f'<div class="chart-wrapper"{block_attr}>{svg}</div>'
 
     def _escape_html(self, text):
         """转义 HTML 特殊字符，保护 LaTeX 公式不被转义"""
@@ -960,6 +1573,36 @@ class MarkdownToHTML:
             codes.append(f'<code>{self._escape_html(m.group(1))}</code>')
             return f'\x00CODE{len(codes)-1}\x00'
         text = re.sub(r'`([^`]+)`', save_code, text)
+        # 公式：有预渲染结果时内联 KaTeX HTML，否则保留原文交给浏览器端 auto-render
+        def save_math(m):
+            import html as _html
+            display = m.group(0).startswith('$$')
+            tex = _html.unescape(m.group(0)[2:-2] if display else m.group(0)[1:-1])
+            rendered = prerender.get('math_display' if display else 'math', tex)
+            if rendered is None:
+                self.features['math'] = True
+                return m.group(0)
+            self.features['math_css'] = True
+            codes.append(rendered)
+            return f'\x00CODE{len(codes)-1}\x00'
+        if '$' in text:
+            text = _MATH_RE.sub(save_math, text)
+        # 图片 ![alt](src)，同样先保护起来
+        def save_image(m):
+            src = m.group(2)
+            self._add_dependency(src)
+            url = self._asset_src(src)
+            srcset = None
+            if not re.match(r'^[a-zA-Z][\w+.-]*:|^//|^/', src):
+                srcset = image_variants.srcset(os.path.normpath(os.path.join(self.base_dir, src)), src, url)
+            src = url
+            if srcset:
+                codes.append(f'<img class="image" src="{src}" srcset="{srcset}" '
+                             f'sizes="{image_variants.SIZES}" alt="{m.group(1)}">')
+            else:
+                codes.append(f'<img class="image" src="{src}" alt="{m.group(1)}">')
+            return f'\x00CODE{len(codes)-1}\x00'
+        text = re.sub(r'!\[([^\]]*)\]\(([^)\s]+)\)', save_image, text)
         # 加粗斜体 ***text***
         text = re.sub(r'\*\*\*(.+?)\*\*\*', r'<strong><em>\1</em></strong>', text)
         # 加粗 **text**
@@ -993,9 +1636,28 @@ class MarkdownToHTML:
             result.append('<code class="line">' + self._escape_html(line.rstrip()) + '</code>')
         return '\n'.join(result)
 
-    def parse(self, markdown_content):
-        """解析 Markdown 为 HTML"""
+    def parse(self, markdown_content, source_path=None):
+        """解析 Markdown 为 HTML，同时生成大纲 self.outline 与内容块 self.blocks
+
+        给出 source_path 时展开 !include，并把引用到的文件记录在 self.dependencies。
+        """
+        self.outline = []
+        self.blocks = []
+        self.dependencies = set()
+        self.assets = set()
+        self.tables = set()
+        self.features = self._empty_features()
+        self.line_map = None
+        source_lines = markdown_content.split('\n')
+        if source_path:
+            self.base_dir = os.path.dirname(os.path.abspath(source_path))
+            markdown_content = self.expand_includes(markdown_content, self.base_dir, (os.path.abspath(source_path),))
         lines = markdown_content.split('\n')
+        self._slugs = set()
+        # 源文件中每行起始的字节偏移，供大纲定位
+        line_offsets = [0]
+        for line in source_lines:
+            line_offsets.append(line_offsets[-1] + len(line.encode('utf-8')) + 1)
         i = 0
         n = len(lines)
         html = []
@@ -1011,6 +1673,7 @@ class MarkdownToHTML:
 
         while i < n:
             line = lines[i]
+            start = i
 
             # 空行
             if not line.strip():
@@ -1021,27 +1684,33 @@ class MarkdownToHTML:
             if line.startswith('# '):
                 if in_list:
                     close_list()
-                html.append(f'<h1 class="title">{self._inline(self._escape_html(line[2:].strip()))}</h1>')
+                html.append(self._heading(1, 'title', line[2:].strip(), i, line_offsets[self._source_line(i)]))
 
             elif line.startswith('## '):
                 if in_list:
                     close_list()
-                html.append(f'<h2 class="heading">{self._inline(self._escape_html(line[3:].strip()))}</h2>')
+                html.append(self._heading(2, 'heading', line[3:].strip(), i, line_offsets[self._source_line(i)]))
 
             elif line.startswith('### '):
                 if in_list:
                     close_list()
-                html.append(f'<h3 class="subheading">{self._inline(self._escape_html(line[4:].strip()))}</h3>')
+                html.append(self._heading(3, 'subheading', line[4:].strip(), i, line_offsets[self._source_line(i)]))
 
             elif line.startswith('#### '):
                 if in_list:
                     close_list()
-                html.append(f'<h4 class="subsubheading">{self._inline(self._escape_html(line[5:].strip()))}</h4>')
+                html.append(self._heading(4, 'subsubheading', line[5:].strip(), i, line_offsets[self._source_line(i)]))
 
             elif line.startswith('##### '):
                 if in_list:
                     close_list()
-                html.append(f'<h4 class="subsubheading">{self._inline(self._escape_html(line[6:].strip()))}</h4>')
+                html.append(self._heading(5, 'subsubheading', line[6:].strip(), i, line_offsets[self._source_line(i)]))
+
+            # 外部 CSV/TSV 表格  !table data.csv
+            elif re.match(r'^!table\s+\S+\s*$', line.strip()):
+                if in_list:
+                    close_list()
+                html.append(self._csv_table(line.strip().split(None, 1)[1], start))
 
             # 引用块
             elif line.startswith('>'):
@@ -1051,7 +1720,8 @@ class MarkdownToHTML:
                 while i < n and lines[i].startswith('>'):
                     quote_lines.append(lines[i].lstrip('>').strip())
                     i += 1
-                html.append(f'<blockquote class="quote">{self._inline(self._escape_html(" ".join(quote_lines)))}</blockquote>')
+                quote = " ".join(quote_lines)
+                html.append(f'<blockquote class="quote"{self._block(start, quote)}>{self._inline(self._escape_html(quote))}</blockquote>')
                 continue
 
             # 代码块
@@ -1066,12 +1736,24 @@ class MarkdownToHTML:
                     code = '\n'.join(code_lines)
                     if in_list:
                         close_list()
-                    if lang.lower() == 'mermaid':
-                        html.append(f'<div class="mermaid">{self._escape_html(code)}</div>')
+                    block_attr = self._block(start, code)
+                    if lang.lower() == 'chart':
+                        html.append(self._chart(code, block_attr))
+                    elif lang.lower() == 'mermaid':
+                        light = prerender.get('mermaid', code, 'light')
+                        dark = prerender.get('mermaid', code, 'dark')
+                        if light and dark:
+                            html.append(f'<div class="mermaid-static"{block_attr}><div class="mermaid-light">{light}</div>'
+                                        f'<div class="mermaid-dark">{dark}</div></div>')
+                        else:
+                            self.features['mermaid'] = True
+                            html.append(f'<div class="mermaid"{block_attr}>{self._escape_html(code)}</div>')
                     else:
+                        if lang:
+                            self.features['languages'].add(lang.lower())
                         lang_attr = f' data-lang="{self._escape_html(lang)}"' if lang else ''
                         lang_class = f' class="{self._escape_html(lang)}"' if lang else ''
-                        html.append(f'<div class="code-wrapper"{lang_attr}><pre class="code-block"><code{lang_class}>{self._escape_html(code)}</code></pre></div>')
+                        html.append(f'<div class="code-wrapper"{block_attr}{lang_attr}><pre class="code-block"><code{lang_class}>{self._escape_html(code)}</code></pre></div>')
 
             # 列表
             elif re.match(r'^\s*[-*]\s+', line) or re.match(r'^\s*\d+\.\s+', line):
@@ -1088,7 +1770,7 @@ class MarkdownToHTML:
                         tag = 'ol' if is_ordered else 'ul'
                         html.append(f'<{tag} class="list">')
                         in_ordered = is_ordered
-                    html.append(f'<li>{self._inline(self._escape_html(match.group(1)))}</li>')
+                    html.append(f'<li{self._block(start, match.group(1))}>{self._inline(self._escape_html(match.group(1)))}</li>')
                 i += 1
                 continue
 
@@ -1103,7 +1785,8 @@ class MarkdownToHTML:
                         table_data.append(row)
                     i += 1
                 if len(table_data) > 1:
-                    html.append('<table class="table">')
+                    table_text = ' '.join(' '.join(row) for row in table_data)
+                    html.append(f'<table class="table"{self._block(start, table_text)}>')
                     # 表头
                     html.append('<thead><tr>')
                     for cell in table_data[0]:
@@ -1135,7 +1818,14 @@ class MarkdownToHTML:
                       lines[i].strip() != '---' and not lines[i].strip().startswith('```'):
                     raw_lines.append(lines[i])
                     i += 1
-                html.append('\n'.join(raw_lines))
+                raw_html = '\n'.join(raw_lines)
+                for src in re.findall(r'<img[^>]*?\ssrc=["\']([^"\']+)', raw_html):
+                    self._add_dependency(src)
+                if self.asset_url:
+                    raw_html = re.sub(r'(<img\b[^>]*?\ssrc=)(["\'])([^"\']+)\2',
+                                      lambda m: m.group(1) + m.group(2) + self._asset_src(m.group(3)) + m.group(2), raw_html)
+                self._block(start, re.sub(r'<[^>]+>', ' ', raw_html))
+                html.append(raw_html)
                 continue
 
             # 普通段落
@@ -1150,7 +1840,7 @@ class MarkdownToHTML:
                     para_lines.append(lines[i])
                     i += 1
                 text = ' '.join(para_lines)
-                html.append(f'<p class="paragraph">{self._inline(self._escape_html(text))}</p>')
+                html.append(f'<p class="paragraph"{self._block(start, text)}>{self._inline(self._escape_html(text))}</p>')
                 continue
 
             i += 1
@@ -1161,6 +1851,552 @@ class MarkdownToHTML:
         return '\n'.join(html)
 
 
+class ChartRenderer:
+    """```chart 代码块渲染器
+
+    用 NumPy 读取 CSV/TSV/NPY 数据，按像素宽度做向量化的 min/max 分桶降采样，
+    输出内联 SVG。结果按 (数据文件哈希, 图表配置) 缓存。
+    """
+
+    PALETTE = ['var(--color-heading)', 'var(--color-subheading)', 'var(--color-link)',
+               '#d69e2e', '#e53e3e', '#805ad5']
+
+    def __init__(self, max_entries=64):
+        from collections import OrderedDict
+        self.lock = Lock()
+        self.svgs = OrderedDict()
+        self.max_entries = max_entries
+        self.file_hashes = {}   # (path, mtime_ns, size) -> sha1
+
+    def _file_hash(self, path):
+        import hashlib
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self.file_hashes.get(key)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with self.lock:
+                self.file_hashes = {k: v for k, v in self.file_hashes.items() if k[0] != path}
+                self.file_hashes[key] = digest
+        return digest
+
+    def render(self, spec_text, base_dir):
+        """返回图表 SVG 和数据文件路径"""
+        import json
+        spec = yaml.safe_load(spec_text) or {}
+        if not isinstance(spec, dict) or not spec.get('data'):
+            raise ValueError('chart 需要 data 字段')
+        path = os.path.normpath(os.path.join(base_dir, str(spec['data'])))
+        key = (self._file_hash(path), json.dumps(spec, sort_keys=True, default=str))
+        with self.lock:
+            svg = self.svgs.get(key)
+            if svg is not None:
+                self.svgs.move_to_end(key)
+                return svg, path
+        svg = self._render_svg(spec, path)
+        with self.lock:
+            self.svgs[key] = svg
+            while len(self.svgs) > self.max_entries:
+                self.svgs.popitem(last=False)
+        return svg, path
+
+    def _load(self, spec, path):
+        """读取数据，返回 (x, [(name, y), ...])"""
+        import numpy as np
+        x_col = spec.get('x')
+        y_cols = spec.get('y')
+        if y_cols is not None and not isinstance(y_cols, list):
+            y_cols = [y_cols]
+        if path.lower().endswith('.npy'):
+            data = np.load(path, mmap_mode='r')
+            data = data.reshape(-1, 1) if data.ndim == 1 else data
+            names = [str(k) for k in range(data.shape[1])]
+        else:
+            import csv
+            delimiter = '\t' if path.lower().endswith('.tsv') else ','
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                names = next(csv.reader(f, delimiter=delimiter), [])
+            data = np.loadtxt(path, delimiter=delimiter, skiprows=1, ndmin=2, dtype=np.float64)
+
+        def column(ref):
+            if isinstance(ref, int):
+                return ref
+            if str(ref) not in names:
+                raise ValueError(f'chart 找不到列: {ref}')
+            return names.index(str(ref))
+        x_idx = column(x_col) if x_col is not None else None
+        if y_cols is None:
+            y_cols = [n for k, n in enumerate(names) if k != x_idx]
+        x = np.asarray(data[:, x_idx], dtype=np.float64) if x_idx is not None else np.arange(data.shape[0], dtype=np.float64)
+        series = [(str(ref), np.asarray(data[:, column(ref)], dtype=np.float64)) for ref in y_cols]
+        return x, series
+
+    @staticmethod
+    def _downsample(x, y, buckets):
+        """min/max 分桶：每个像素桶保留最小值和最大值两个点（保持原有先后顺序）
+
+        除不尽的余数并入最后一个桶，末尾一段 x 范围不会丢失。
+        """
+        import numpy as np
+        keep = np.isfinite(x) & np.isfinite(y)
+        if not keep.all():
+            x, y = x[keep], y[keep]
+        n = len(y)
+        if n <= 2 * buckets:
+            return x, y
+        size = n // buckets
+        m = size * (buckets - 1)
+        grouped = y[:m].reshape(buckets - 1, size)
+        tail = y[m:]
+        lo = np.append(grouped.argmin(axis=1), tail.argmin())
+        hi = np.append(grouped.argmax(axis=1), tail.argmax())
+        base = np.arange(buckets) * size
+        idx = np.empty(2 * buckets + 1, dtype=np.int64)
+        idx[0:-1:2] = base + np.minimum(lo, hi)
+        idx[1:-1:2] = base + np.maximum(lo, hi)
+        idx[-1] = n - 1
+        idx = np.unique(idx)
+        return x[idx], y[idx]
+
+    def _render_svg(self, spec, path):
+        import numpy as np
+        width = int(spec.get('width', 760))
+        height = int(spec.get('height', 300))
+        title = str(spec.get('title', ''))
+        x, series = self._load(spec, path)
+        pad_l, pad_r, pad_t, pad_b = 56, 16, 28 if title else 12, 28
+        plot_w, plot_h = width - pad_l - pad_r, height - pad_t - pad_b
+        sampled = [(name, *self._downsample(x, y, max(plot_w, 1))) for name, y in series]
+        xs = [sx for _, sx, _ in sampled if len(sx)]
+        ys = [sy for _, _, sy in sampled if len(sy)]
+        if not xs:
+            raise ValueError('chart 没有有效数据')
+        x_min, x_max = min(float(a.min()) for a in xs), max(float(a.max()) for a in xs)
+        y_min, y_max = min(float(a.min()) for a in ys), max(float(a.max()) for a in ys)
+        x_span = (x_max - x_min) or 1.0
+        y_span = (y_max - y_min) or 1.0
+
+        esc = lambda v: v.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        fmt = lambda v: f'{v:.4g}'
+        out = [f'<svg class="chart" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+               f'width="100%" style="max-width:{width}px" font-size="11" fill="var(--color-text)">']
+        if title:
+            out.append(f'<text x="{width / 2:.0f}" y="18" text-anchor="middle" font-weight="600">{esc(title)}</text>')
+        out.append(f'<g stroke="var(--color-table-border)" stroke-width="1">'
+                   f'<line x1="{pad_l}" y1="{pad_t}" x2="{pad_l}" y2="{pad_t + plot_h}"/>'
+                   f'<line x1="{pad_l}" y1="{pad_t + plot_h}" x2="{pad_l + plot_w}" y2="{pad_t + plot_h}"/></g>')
+        out.append(f'<text x="{pad_l - 6}" y="{pad_t + 4}" text-anchor="end">{fmt(y_max)}</text>'
+                   f'<text x="{pad_l - 6}" y="{pad_t + plot_h}" text-anchor="end">{fmt(y_min)}</text>'
+                   f'<text x="{pad_l}" y="{height - 8}">{fmt(x_min)}</text>'
+                   f'<text x="{pad_l + plot_w}" y="{height - 8}" text-anchor="end">{fmt(x_max)}</text>')
+        for k, (name, sx, sy) in enumerate(sampled):
+            px = np.round(pad_l + (sx - x_min) / x_span * plot_w, 1)
+            py = np.round(pad_t + plot_h - (sy - y_min) / y_span * plot_h, 1)
+            points = ' '.join(f'{a:g},{b:g}' for a, b in zip(px.tolist(), py.tolist()))
+            color = self.PALETTE[k % len(self.PALETTE)]
+            out.append(f'<polyline fill="none" stroke="{color}" stroke-width="1.5" '
+                       f'stroke-linejoin="round" points="{points}"/>')
+            if len(sampled) > 1:
+                lx = pad_l + 12 + k * 110
+                out.append(f'<rect x="{lx}" y="{pad_t + 4}" width="10" height="3" fill="{color}"/>'
+                           f'<text x="{lx + 14}" y="{pad_t + 9}">{esc(name)}</text>')
+        out.append('</svg>')
+        return ''.join(out)
+
+
+chart_renderer = ChartRenderer()
+
+
+class StaticAssets:
+    """本地前端资源（清单 static/assets.yaml，由 fetch_assets.py 下载）
+
+    已下载的资源经 /static/<hash>/<path> 提供：hash 为 static/ 下全部文件内容的摘要，
+    任一文件变化即换 URL，因此可永久缓存；CSS 中的相对路径（KaTeX 字体）在同一前缀下解析。
+    未下载的资源在 preview.assets 为 cdn（默认）时使用清单中的 CDN 地址；设为 local 时
+    缺少资源启动即报错（见 check_static_assets）。static/ 下的目录变化后（如运行期间执行了
+    fetch_assets.py）自动重新计算，无需重启。
+    """
+
+    # 两次检查 static/ 目录变化的最小间隔（秒）
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.lock = Lock()
+        self.manifest = {}
+        self.hash = ''
+        self.files = set()
+        self.allow_cdn = True
+        self.signature = None
+        self.checked = 0.0
+        self.warned = set()
+        self.refresh()
+
+    def _signature(self):
+        """static/ 下全部目录与清单的 mtime；fetch_assets.py 写入文件（os.replace）会改变所在目录的 mtime"""
+        def mtime(path):
+            try:
+                return os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+        sig = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            sig.append((dirpath, mtime(dirpath)))
+        sig.append(('assets.yaml', mtime(os.path.join(self.root, 'assets.yaml'))))
+        return tuple(sig)
+
+    def _fresh(self):
+        """距上次检查超过 CHECK_INTERVAL 且目录有变化时重新计算"""
+        now = time.monotonic()
+        if now - self.checked < self.CHECK_INTERVAL:
+            return
+        self.checked = now
+        if self._signature() != self.signature:
+            self.refresh()
+
+    def refresh(self):
+        """重新读取清单并计算内容摘要"""
+        import hashlib
+        manifest_path = os.path.join(self.root, 'assets.yaml')
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = yaml.safe_load(f) or {}
+        digest = hashlib.sha1()
+        files = set()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+                digest.update(rel.encode('utf-8'))
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+                files.add(rel)
+        signature = self._signature()
+        with self.lock:
+            self.manifest = manifest
+            self.hash = digest.hexdigest()[:12]
+            self.files = files
+            self.signature = signature
+            self.checked = time.monotonic()
+
+    def configure(self, config):
+        """按 preview.assets（cdn | local）设置未下载资源是否回退到 CDN"""
+        self.allow_cdn = config.get('preview', {}).get('assets', 'cdn') != 'local'
+
+    def missing(self):
+        """清单中尚未下载到本地的资源名"""
+        self._fresh()
+        return [name for name, entry in self.manifest.items() if entry.get('path') not in self.files]
+
+    def url(self, name):
+        """资源地址：本地已下载时为带摘要的 /static/ 路径；否则 preview.assets 为 cdn 时
+        为 CDN 地址，为 local 时提示一次并返回空字符串（不悄悄访问外网）"""
+        self._fresh()
+        entry = self.manifest.get(name, {})
+        if entry.get('path') in self.files:
+            return f'/static/{self.hash}/{entry["path"]}'
+        if self.allow_cdn:
+            return entry.get('url', '')
+        if name not in self.warned:
+            self.warned.add(name)
+            print(f"[预览] 缺少本地资源 {name}，请运行 python3 fetch_assets.py")
+        return ''
+
+    def resolve(self, path):
+        """/static/<hash>/<rel> -> (本地文件, 摘要是否为当前版本)；越界或不存在返回 None"""
+        m = re.match(r'^/static/([0-9a-f]+)/(.+)$', path)
+        if not m:
+            return None
+        self._fresh()
+        from urllib.parse import unquote
+        full = os.path.realpath(os.path.join(self.root, unquote(m.group(2))))
+        if not full.startswith(self.root + os.sep) or not os.path.isfile(full):
+            return None
+        return full, m.group(1) == self.hash
+
+    def local_path(self, name):
+        """已下载资源的本地路径，未下载返回 None"""
+        self._fresh()
+        entry = self.manifest.get(name, {})
+        if entry.get('path') in self.files:
+            return os.path.join(self.root, entry['path'])
+        return None
+
+
+static_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+
+
+def check_static_assets(config):
+    """按 preview.assets（cdn | local）配置前端资源来源；local 模式下缺少资源时报错退出"""
+    import sys
+    static_assets.configure(config)
+    missing = static_assets.missing()
+    if missing and not static_assets.allow_cdn:
+        print(f"[预览] 缺少本地前端资源: {', '.join(missing)}", file=sys.stderr)
+        print("[预览] 请先运行 python3 fetch_assets.py 下载到 static/vendor/，"
+              "或在 config.yaml 中设置 preview.assets: cdn 改用 CDN", file=sys.stderr)
+        raise SystemExit(1)
+    if missing:
+        print(f"[预览] 以下前端资源从 CDN 加载（python3 fetch_assets.py 可下载到本地）: {', '.join(missing)}")
+
+
+class PrerenderService:
+    """Mermaid / KaTeX 服务端预渲染
+
+    后台线程持有一个无头 Chromium 页面（Playwright），把 Mermaid 源码渲染为 SVG、
+    公式渲染为 KaTeX HTML。结果按 sha1(类型, 源码, 主题, 模式, 库地址) 缓存在内存与
+    ~/.cache/markit/prerender/。解析时只查缓存，未命中则排队渲染并先输出原始内容
+    （由浏览器端兜底），队列清空后调用 on_ready 让渲染缓存失效，下一次刷新即为预渲染结果。
+    Playwright 或浏览器不可用时只提示一次，之后不再排队。
+    """
+
+    CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                             'markit', 'prerender')
+    # Mermaid 主题：亮色 / 暗色两套 SVG，页面用 CSS 按 body.dark 切换
+    MERMAID_THEMES = {'light': 'default', 'dark': 'dark'}
+
+    def __init__(self, max_entries=512):
+        from collections import OrderedDict
+        import queue
+        self.enabled = False     # 由 PreviewServer 按 preview.prerender 开启
+        self.on_ready = None
+        self.lock = Lock()
+        self.memory = OrderedDict()
+        self.max_entries = max_entries
+        self.pending = set()
+        self.failed = set()      # 渲染失败的键，不再重复排队
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def _key(self, kind, source, mode):
+        import hashlib
+        import json
+        lib = static_assets.url('mermaid_js' if kind == 'mermaid' else 'katex_js')
+        theme = self.MERMAID_THEMES.get(mode, mode)
+        raw = json.dumps([kind, source, theme, mode, lib])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, kind, source, mode='any'):
+        """查缓存；未命中时排队渲染并返回 None"""
+        if not self.enabled:
+            return None
+        key = self._key(kind, source, mode)
+        with self.lock:
+            html = self.memory.get(key)
+            if html is not None:
+                self.memory.move_to_end(key)
+                return html
+        path = os.path.join(self.CACHE_DIR, key[:2], key + '.html')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+        except OSError:
+            if key not in self.failed:
+                self._request(key, kind, source, mode)
+            return None
+        self._remember(key, html)
+        return html
+
+    def _remember(self, key, html):
+        with self.lock:
+            self.memory[key] = html
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def _request(self, key, kind, source, mode):
+        with self.lock:
+            if key in self.pending or not self.enabled:
+                return
+            self.pending.add(key)
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.jobs.put((key, kind, source, mode))
+
+    def _open_page(self, playwright):
+        browser = playwright.chromium.launch()
+        page = browser.new_page()
+        page.set_content('<!DOCTYPE html><html><head><meta charset="UTF-8"></head><body></body></html>')
+        for name in ('mermaid_js', 'katex_js'):
+            local = static_assets.local_path(name)
+            if local:
+                page.add_script_tag(path=local)
+            else:
+                page.add_script_tag(url=static_assets.url(name))
+        return browser, page
+
+    _RENDER_JS = """async ({ kind, source, mode, id, theme }) => {
+        if (kind === 'mermaid') {
+            mermaid.initialize({ startOnLoad: false, theme });
+            const { svg } = await mermaid.render(id, source);
+            return svg;
+        }
+        return katex.renderToString(source, { displayMode: kind === 'math_display', throwOnError: false });
+    }"""
+
+    def _run(self):
+        try:
+            from playwright.sync_api import sync_playwright
+            with sync_playwright() as p:
+                browser, page = self._open_page(p)
+                print("[预览] 服务端预渲染已启动")
+                self._loop(page)
+                browser.close()
+        except Exception as e:
+            with self.lock:
+                self.enabled = False
+                self.pending.clear()
+            print(f"[预览] 服务端预渲染不可用，改由浏览器渲染: {e}")
+
+    def _loop(self, page):
+        while True:
+            key, kind, source, mode = self.jobs.get()
+            try:
+                html = page.evaluate(self._RENDER_JS, {
+                    'kind': kind, 'source': source, 'mode': mode,
+                    'id': f'mmd-{key[:12]}', 'theme': self.MERMAID_THEMES.get(mode, 'default'),
+                })
+                self._store(key, html)
+            except Exception as e:
+                # 语法错误等：缓存为空，页面会输出原始内容交给浏览器端显示错误
+                print(f"[预览] 预渲染失败 ({kind}): {str(e).splitlines()[0]}")
+                with self.lock:
+                    self.failed.add(key)
+            with self.lock:
+                self.pending.discard(key)
+                idle = not self.pending
+            if idle and self.jobs.empty() and self.on_ready:
+                self.on_ready()
+
+    def _store(self, key, html):
+        path = os.path.join(self.CACHE_DIR, key[:2], key + '.html')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp, path)
+        self._remember(key, html)
+
+
+prerender = PrerenderService()
+
+
+class ImageVariants:
+    """文档图片的缩小版本（响应式 srcset）
+
+    预览中大图只按栏宽显示，没必要每次下载并解码原图。解析时为本地位图生成
+    `src?w=480 480w, ...` 的 srcset（只包含小于原图宽度的档位），首次请求时用 Pillow
+    缩放并重新压缩（JPEG 原图输出 JPEG，其他输出 WebP），按 (原图内容摘要, 宽度) 缓存在
+    ~/.cache/markit/images/。未安装 Pillow 时不改写 srcset。导出 PDF 时页面去掉 srcset，
+    仍使用原图。
+    """
+
+    CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                             'markit', 'images')
+    WIDTHS = (480, 960, 1440)
+    EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff')
+    # 预览内容区宽度（.preview-content 的 max-width 减去左右内边距）
+    SIZES = '(max-width: 860px) 100vw, 800px'
+
+    def __init__(self):
+        self.lock = Lock()
+        self.info = {}           # 路径 -> ((mtime_ns, size), 原图宽度, 内容摘要)
+        self.available = None
+
+    def _pillow(self):
+        if self.available is None:
+            try:
+                import PIL.Image  # noqa: F401
+                self.available = True
+            except ImportError:
+                self.available = False
+        return self.available
+
+    def _info(self, full):
+        """原图宽度与内容摘要，按 mtime / 大小缓存；不是可读位图时返回 None"""
+        import hashlib
+        try:
+            st = os.stat(full)
+        except OSError:
+            return None
+        sig = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.info.get(full)
+        if cached and cached[0] == sig:
+            return cached[1:]
+        from PIL import Image
+        try:
+            with Image.open(full) as im:
+                width = im.width
+                animated = getattr(im, 'is_animated', False)
+            digest = hashlib.sha1()
+            with open(full, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except Exception:
+            return None
+        entry = (sig, 0 if animated else width, digest.hexdigest())
+        with self.lock:
+            self.info[full] = entry
+        return entry[1:]
+
+    def srcset(self, full, src, url=None):
+        """img 的 srcset 属性值（url 为实际加载地址，默认即 src）；无需缩小或不支持时返回 None"""
+        if '?' in src or '#' in src or not full.lower().endswith(self.EXTENSIONS) or not self._pillow():
+            return None
+        info = self._info(full)
+        if not info:
+            return None
+        width = info[0]
+        widths = [w for w in self.WIDTHS if w < width]
+        if not widths:
+            return None
+        url = url or src
+        sep = '&' if '?' in url else '?'
+        return ', '.join([f'{url}{sep}w={w} {w}w' for w in widths] + [f'{url} {width}w'])
+
+    def variant(self, full, width):
+        """返回宽度为 width 的缩小版本路径（首次请求时生成）；不适用时返回 None"""
+        if width not in self.WIDTHS or not full.lower().endswith(self.EXTENSIONS) or not self._pillow():
+            return None
+        info = self._info(full)
+        if not info or width >= info[0]:
+            return None
+        from PIL import Image, features
+        jpeg = full.lower().endswith(('.jpg', '.jpeg'))
+        ext = '.jpg' if jpeg or not features.check('webp') else '.webp'
+        key = info[1]
+        path = os.path.join(self.CACHE_DIR, key[:2], f'{key}-{width}{ext}')
+        if os.path.exists(path):
+            return path
+        try:
+            with Image.open(full) as im:
+                im = im.convert('RGB' if ext == '.jpg' else 'RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+                im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+                if ext == '.jpg':
+                    im.save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+                else:
+                    im.save(tmp, 'WEBP', quality=80, method=4)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[预览] 生成缩略图失败 ({os.path.basename(full)}): {e}")
+            return None
+        return path
+
+
+image_variants = ImageVariants()
+
+
 class CacheManager:
     """缓存管理器"""
     def __init__(self):
@@ -1172,55 +2408,763 @@ class CacheManager:
     def set(self, key, value):
         self.cache[key] = value
 
+    def delete(self, key):
+        self.cache.pop(key, None)
+
     def clear(self):
         self.cache.clear()
 
 
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af'
+_WORD_RE = re.compile(f'[^\\W_{_CJK_CHARS}]+')
+_CJK_RE = re.compile(f'[{_CJK_CHARS}]+')
+
+
+class SearchIndex:
+    """全文检索倒排索引，按内容块增量更新"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.postings = {}   # term -> {block_key: tf}
+        self.blocks = {}     # block_key -> {'text', 'lines', 'terms'}
+
+    @staticmethod
+    def _tokenize(text):
+        """英文/数字按词切分，中日韩文字按二元组切分"""
+        text = text.lower()
+        terms = _WORD_RE.findall(text)
+        for run in _CJK_RE.findall(text):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend([run[k:k + 2] for k in range(len(run) - 1)])
+        return terms
+
+    def update(self, blocks):
+        """用新的块序列更新索引，只重建内容发生变化的块"""
+        import hashlib
+        current = {}
+        for block in blocks:
+            if not block['text']:
+                continue
+            key = hashlib.md5(block['text'].encode('utf-8')).digest()
+            entry = current.setdefault(key, {'text': block['text'], 'lines': []})
+            entry['lines'].append(block['line'])
+
+        with self.lock:
+            for key in [k for k in self.blocks if k not in current]:
+                for term in self.blocks.pop(key)['terms']:
+                    posting = self.postings[term]
+                    del posting[key]
+                    if not posting:
+                        del self.postings[term]
+            for key, entry in current.items():
+                old = self.blocks.get(key)
+                if old is not None:
+                    old['lines'] = entry['lines']
+                    continue
+                terms = Counter(self._tokenize(entry['text']))
+                for term, tf in terms.items():
+                    self.postings.setdefault(term, {})[key] = tf
+                entry['terms'] = terms
+                self.blocks[key] = entry
+
+    def _snippet(self, text, terms, width=60):
+        """截取首个命中词附近的文本，命中处用 <mark> 标出"""
+        lower = text.lower()
+        hits = [p for p in (lower.find(t) for t in terms) if p >= 0]
+        pos = min(hits) if hits else 0
+        begin = max(0, pos - width // 2)
+        end = min(len(text), begin + width)
+        snippet = text[begin:end]
+        snippet = snippet.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        pattern = '|'.join(re.escape(t) for t in sorted(set(terms), key=len, reverse=True))
+        if pattern:
+            snippet = re.sub(f'({pattern})', r'<mark>\1</mark>', snippet, flags=re.IGNORECASE)
+        return ('…' if begin > 0 else '') + snippet + ('…' if end < len(text) else '')
+
+    def search(self, query, limit=20):
+        """检索同时包含所有查询词的块，按 TF-IDF 排序"""
+        import math
+        import heapq
+        terms = self._tokenize(query)
+        if not terms:
+            return []
+        with self.lock:
+            postings = [self.postings.get(t) for t in set(terms)]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            total = len(self.blocks)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    return []
+            weights = [math.log(1 + total / len(p)) for p in postings]
+            scored = heapq.nlargest(limit, (
+                (sum((1 + math.log(p[key])) * w for p, w in zip(postings, weights)), key)
+                for key in candidates
+            ), key=lambda item: item[0])
+            results = []
+            for score, key in scored:
+                block = self.blocks[key]
+                results.append({
+                    'line': block['lines'][0],
+                    'lines': block['lines'],
+                    'score': round(score, 3),
+                    'snippet': self._snippet(block['text'], terms),
+                })
+            return results
+
+
+class DependencyGraph:
+    """依赖图：被引用的文件（!include 片段、图片）-> 使用它的文档"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.dependencies = {}   # 文档 -> 依赖文件集合
+        self.dependents = {}     # 依赖文件 -> 文档集合
+        self.on_new_dir = None   # 出现新的依赖目录时回调（用于追加监听）
+        self.on_new_deps = None  # 出现新的依赖文件时回调（轮询监听立即记录基线）
+
+    def update(self, doc, deps):
+        """登记文档的最新依赖集合"""
+        doc = os.path.abspath(doc)
+        deps = set(deps)
+        new_dirs = set()
+        with self.lock:
+            known_dirs = {os.path.dirname(p) for p in self.dependents}
+            new_doc = doc not in self.dependents
+            if new_doc and os.path.dirname(doc) not in known_dirs:
+                new_dirs.add(os.path.dirname(doc))
+            old = self.dependencies.get(doc, set())
+            for dep in old - deps:
+                users = self.dependents.get(dep)
+                if users:
+                    users.discard(doc)
+                    if not users:
+                        del self.dependents[dep]
+            for dep in deps - old:
+                self.dependents.setdefault(dep, set()).add(doc)
+                if os.path.dirname(dep) not in known_dirs:
+                    new_dirs.add(os.path.dirname(dep))
+            self.dependencies[doc] = deps
+            self.dependents.setdefault(doc, set()).add(doc)
+        if self.on_new_dir:
+            for d in new_dirs:
+                self.on_new_dir(d)
+        if self.on_new_deps and (new_doc or deps - old):
+            self.on_new_deps()
+
+    def remove(self, doc):
+        """移除文档及其依赖登记（目录模式回收空闲文档）"""
+        doc = os.path.abspath(doc)
+        with self.lock:
+            for dep in self.dependencies.pop(doc, set()) | {doc}:
+                users = self.dependents.get(dep)
+                if users:
+                    users.discard(doc)
+                    if not users:
+                        del self.dependents[dep]
+
+    def affected(self, path):
+        """返回受 path 变化影响的文档集合"""
+        with self.lock:
+            return set(self.dependents.get(os.path.abspath(path), ()))
+
+    def is_tracked(self, path):
+        return bool(self.affected(path))
+
+    def tracked(self):
+        """全部被跟踪的文件（文档本身及其依赖）"""
+        with self.lock:
+            return list(self.dependents)
+
+
+class DocumentState:
+    """目录模式下单个文档的状态"""
+
+    def __init__(self, md_file):
+        self.md_file = md_file
+        self.search_index = SearchIndex()
+        self.last_used = time.monotonic()
+
+
+class DocumentStore:
+    """目录模式：root 下的 Markdown 文档按需打开，空闲时回收
+
+    文档首次访问时创建状态（搜索索引）并登记到依赖图（随之监听所在目录）；超过 idle 秒
+    未访问，或打开的文档超过 max_docs 个时，删除其渲染缓存、搜索索引与依赖登记，
+    不再被任何文档使用的目录由 on_evict 回调取消监听。
+    """
+
+    EXTENSIONS = ('.md', '.markdown')
+    SKIP_DIRS = {'node_modules', '__pycache__'}
+
+    def __init__(self, root, cache, dependency_graph, idle=300, max_docs=64):
+        from collections import OrderedDict
+        self.root = os.path.realpath(root)
+        self.cache = cache
+        self.dependency_graph = dependency_graph
+        self.idle = idle
+        self.max_docs = max_docs
+        self.lock = Lock()
+        self.docs = OrderedDict()    # 绝对路径 -> DocumentState，按最近访问排序
+        self.on_evict = None
+
+    def list(self):
+        """root 下全部文档：[(相对路径, mtime)]，跳过隐藏目录"""
+        docs = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d not in self.SKIP_DIRS)
+            for name in sorted(filenames):
+                if name.lower().endswith(self.EXTENSIONS):
+                    full = os.path.join(dirpath, name)
+                    try:
+                        mtime = os.stat(full).st_mtime
+                    except OSError:
+                        continue
+                    docs.append((os.path.relpath(full, self.root).replace(os.sep, '/'), mtime))
+        return docs
+
+    def resolve(self, rel):
+        """URL 中的相对路径 -> 文档绝对路径；越界、不是 Markdown 或不存在时返回 None"""
+        from urllib.parse import unquote
+        full = os.path.realpath(os.path.join(self.root, unquote(rel)))
+        if not full.startswith(self.root + os.sep) or not full.lower().endswith(self.EXTENSIONS) \
+                or not os.path.isfile(full):
+            return None
+        return full
+
+    def open(self, rel):
+        full = self.resolve(rel)
+        if full is None:
+            return None
+        with self.lock:
+            state = self.docs.get(full)
+            created = state is None
+            if created:
+                state = self.docs[full] = DocumentState(full)
+            else:
+                self.docs.move_to_end(full)
+                state.last_used = time.monotonic()
+        if created:
+            self.dependency_graph.update(full, ())
+            self.sweep()
+        return state
+
+    def sweep(self):
+        """回收空闲文档及超出 max_docs 的最久未访问文档"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [p for p, st in self.docs.items() if now - st.last_used > self.idle]
+            for p in expired:
+                del self.docs[p]
+            while len(self.docs) > self.max_docs:
+                expired.append(self.docs.popitem(last=False)[0])
+        for p in expired:
+            self.cache.delete(('render', p))
+            self.dependency_graph.remove(p)
+        if expired and self.on_evict:
+            self.on_evict(expired)
+        return expired
+
+
 class FileWatcher(FileSystemEventHandler):
-    """文件监听器"""
+    """文件监听器（尾沿合并）
+
+    accept: 判断路径是否需要处理的函数，默认只关心 .md / .yaml。
+    同一文件的一串事件在最后一次事件后静默 settle 秒才回调一次；持续写入时
+    最迟 max_wait 秒也会回调，避免长时间不刷新。编辑器的原子保存（写临时文件后
+    重命名、或先移走原文件再新建）通过 on_moved / on_created / on_deleted 处理。
+    """
 
-    def __init__(self, on_change):
+    def __init__(self, on_change, accept=None, settle=0.2, max_wait=1.0):
         super().__init__()
         self.on_change = on_change
-        self.last_modified = 0
-        self.debounce_time = 0.5
+        self.accept = accept or (lambda path: path.endswith('.md') or path.endswith('.yaml'))
+        self.settle = settle
+        self.max_wait = max_wait
+        self.pending = {}   # 路径 -> [首次事件时间, 最近事件时间]
+        self.lock = Lock()
+        self.timer = None
+
+    def _touch(self, path):
+        if not path or not self.accept(path):
+            return
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.get(path)
+            if entry is None:
+                self.pending[path] = [now, now]
+            else:
+                entry[1] = now
+            if self.timer is None:
+                self._schedule(self.settle)
+
+    def _schedule(self, delay):
+        """调用方持有 lock"""
+        self.timer = Timer(delay, self._flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _flush(self):
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            self.timer = None
+            next_due = None
+            for path, (first, last) in list(self.pending.items()):
+                due = min(last + self.settle, first + self.max_wait)
+                if due <= now:
+                    ready.append(path)
+                    del self.pending[path]
+                elif next_due is None or due < next_due:
+                    next_due = due
+            if next_due is not None:
+                self._schedule(next_due - now)
+        for path in ready:
+            print(f"[预览] 检测到变化: {os.path.basename(path)}")
+            if self.on_change:
+                self.on_change(path)
 
     def on_modified(self, event):
-        if event.src_path.endswith('.md') or event.src_path.endswith('.yaml'):
-            current_time = time.time()
-            if current_time - self.last_modified > self.debounce_time:
-                self.last_modified = current_time
-                filename = os.path.basename(event.src_path)
-                print(f"[预览] 检测到变化: {filename}")
-                if self.on_change:
-                    self.on_change()
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._touch(event.src_path)
+            self._touch(event.dest_path)
+
+
+# inotify 收不到其他主机 / 宿主机写入的文件系统类型
+NETWORK_FS_TYPES = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'virtiofs', 'vboxsf', 'davfs', 'afs',
+    'fuse.sshfs', 'fuse.grpcfuse', 'fuse.osxfs', 'fuse.rclone', 'fakeowner',
+}
+
+
+def detect_network_fs(paths):
+    """根据 /proc/mounts 判断路径是否位于网络或容器共享文件系统，返回文件系统类型或 None"""
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return None
+    for path in paths:
+        path = os.path.realpath(path)
+        best, fstype = '', None
+        for mount_point, fs in mounts:
+            mount_point = mount_point.replace('\\040', ' ')
+            inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+            if inside and len(mount_point) >= len(best):
+                best, fstype = mount_point, fs
+        if fstype in NETWORK_FS_TYPES:
+            return fstype
+    return None
+
+
+class StatPoller:
+    """轮询监听器：只 stat 被跟踪的文件 (mtime_ns, size, inode)，不扫描目录
+
+    适用于 inotify 不可靠的 NFS / SMB / 容器挂载卷。空闲时轮询间隔逐步放大到
+    max_interval，检测到变化后回到 min_interval。接口与 watchdog Observer 的
+    start / stop / join 一致，事件交给 FileWatcher 合并。
+    """
+
+    def __init__(self, min_interval=0.25, max_interval=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.watches = []   # (FileWatcher, 返回待检查路径的函数, 新路径是否视为新建)
+        self.state = {}     # (监听序号, 路径) -> stat 签名，文件不存在为 None
+        self.started = False
+        self.stopped = False
+        self.wake_event = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def watch(self, handler, paths, report_new=False):
+        self.watches.append((handler, paths, report_new))
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def poll(self):
+        """检查一轮，返回是否有变化；新出现的路径默认只记录基线"""
+        from watchdog.events import FileModifiedEvent, FileCreatedEvent, FileDeletedEvent
+        changed = False
+        seen = set()
+        for idx, (handler, paths, report_new) in enumerate(self.watches):
+            for path in paths():
+                key = (idx, path)
+                seen.add(key)
+                sig = self._signature(path)
+                if key not in self.state and not (report_new and self.started):
+                    self.state[key] = sig
+                    continue
+                old = self.state.get(key)
+                if sig == old:
+                    continue
+                self.state[key] = sig
+                changed = True
+                if sig is None:
+                    handler.on_deleted(FileDeletedEvent(path))
+                elif old is None:
+                    handler.on_created(FileCreatedEvent(path))
+                else:
+                    handler.on_modified(FileModifiedEvent(path))
+        for key in set(self.state) - seen:
+            del self.state[key]
+        return changed
+
+    def wake(self):
+        """立即轮询一次，并把间隔恢复到 min_interval"""
+        self.wake_event.set()
+
+    def _run(self):
+        interval = self.min_interval
+        while True:
+            woken = self.wake_event.wait(interval)
+            self.wake_event.clear()
+            if self.stopped:
+                break
+            try:
+                changed = self.poll()
+            except Exception as e:
+                print(f"[预览] 轮询监听出错: {e}")
+                changed = False
+            interval = self.min_interval if changed or woken else min(interval * 1.5, self.max_interval)
+
+    def start(self):
+        self.poll()
+        self.started = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wake_event.set()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+
+class WebSocket:
+    """最小的 RFC 6455 服务端实现：文本 / 二进制消息、分片、ping / pong、close
+
+    握手由 HTTP 处理器完成，这里只负责握手之后的帧收发。发送加锁，可在其他线程广播。
+    """
+
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+    MAX_MESSAGE = 16 * 1024 * 1024
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b''
+        self.send_lock = Lock()
+        self.closed = False
+
+    @classmethod
+    def accept_key(cls, key):
+        import base64
+        import hashlib
+        return base64.b64encode(hashlib.sha1((key.strip() + cls.GUID).encode('ascii')).digest()).decode('ascii')
+
+    def _read(self, n):
+        while len(self.buf) < n:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('连接已关闭')
+            self.buf += chunk
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def pending(self):
+        """是否已有未读取的数据（用于合并连续到达的消息）"""
+        import select
+        if self.buf:
+            return True
+        try:
+            return bool(select.select([self.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return False
+
+    def recv(self):
+        """读取下一条完整消息（文本返回 str，二进制返回 bytes）；连接关闭返回 None"""
+        import struct
+        parts, size, opcode = [], 0, None
+        try:
+            while True:
+                b1, b2 = self._read(2)
+                fin, op, length = b1 & 0x80, b1 & 0x0F, b2 & 0x7F
+                if length == 126:
+                    length = struct.unpack('>H', self._read(2))[0]
+                elif length == 127:
+                    length = struct.unpack('>Q', self._read(8))[0]
+                if not b2 & 0x80:
+                    # 客户端帧必须带掩码
+                    self.close(1002)
+                    return None
+                if size + length > self.MAX_MESSAGE:
+                    self.close(1009)
+                    return None
+                mask = self._read(4)
+                payload = self._read(length)
+                if length:
+                    key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+                    payload = (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+                if op == 0x8:
+                    self.close()
+                    return None
+                if op == 0x9:
+                    self._send(0xA, payload)
+                    continue
+                if op == 0xA:
+                    continue
+                if op in (0x1, 0x2):
+                    opcode, parts, size = op, [], 0
+                elif op != 0x0 or opcode is None:
+                    self.close(1002)
+                    return None
+                parts.append(payload)
+                size += length
+                if fin:
+                    data = b''.join(parts)
+                    return data.decode('utf-8') if opcode == 0x1 else data
+        except (ConnectionError, OSError, UnicodeDecodeError):
+            self.closed = True
+            return None
+
+    def _send(self, opcode, payload):
+        import struct
+        n = len(payload)
+        if n < 126:
+            header = bytes([0x80 | opcode, n])
+        elif n < 65536:
+            header = bytes([0x80 | opcode, 126]) + struct.pack('>H', n)
+        else:
+            header = bytes([0x80 | opcode, 127]) + struct.pack('>Q', n)
+        with self.send_lock:
+            if self.closed:
+                return False
+            try:
+                self.sock.sendall(header + payload)
+                return True
+            except OSError:
+                self.closed = True
+                return False
+
+    def send_text(self, text):
+        return self._send(0x1, text.encode('utf-8'))
+
+    def close(self, code=1000):
+        import struct
+        if not self.closed:
+            self._send(0x8, struct.pack('>H', code))
+            self.closed = True
+
+
+class LiveBuffers:
+    """编辑器未保存的缓冲区与预览页面的 WebSocket 订阅
+
+    编辑器插件通过 /ws 发送整个缓冲区或按行编辑，渲染时缓冲区优先于磁盘文件；
+    编辑器保存、关闭缓冲区或断开连接后恢复读取磁盘。渲染结果推送给订阅同一文档的所有页面。
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.buffers = {}        # 文档绝对路径 -> (序号, 行列表, 所属连接)
+        self.subscribers = {}    # WebSocket -> 文档绝对路径
+        self.seq = 0
+
+    def get(self, path):
+        """(序号, 文本)；没有未保存的缓冲区时返回 None"""
+        with self.lock:
+            entry = self.buffers.get(path)
+        return (entry[0], '\n'.join(entry[1])) if entry else None
+
+    def set(self, path, text, owner):
+        with self.lock:
+            self.seq += 1
+            self.buffers[path] = (self.seq, text.split('\n'), owner)
+
+    def edit(self, path, start, end, lines, owner):
+        """把第 start 到 end 行（从 0 开始，不含 end）替换为 lines；没有缓冲区时返回 False"""
+        with self.lock:
+            entry = self.buffers.get(path)
+            if entry is None:
+                return False
+            current = list(entry[1])
+            if not 0 <= start <= end or start > len(current):
+                return False
+            current[start:end] = lines
+            self.seq += 1
+            self.buffers[path] = (self.seq, current, owner)
+        return True
+
+    def drop(self, owner, path=None):
+        """丢弃 owner 的缓冲区（path 为空时丢弃全部），返回受影响的文档"""
+        with self.lock:
+            paths = [p for p, entry in self.buffers.items()
+                     if entry[2] is owner and (path is None or p == path)]
+            for p in paths:
+                del self.buffers[p]
+        return paths
+
+    def subscribe(self, ws, path):
+        with self.lock:
+            self.subscribers[ws] = path
+
+    def unsubscribe(self, ws):
+        with self.lock:
+            self.subscribers.pop(ws, None)
+
+    def broadcast(self, path, text):
+        with self.lock:
+            targets = [ws for ws, p in self.subscribers.items() if p == path]
+        for ws in targets:
+            if not ws.send_text(text):
+                self.unsubscribe(ws)
+
+
+_reportlab_generators = {}
+_reportlab_lock = Lock()
+
+
+def _reportlab_generator(compiled, version):
+    """按 (配置版本, 主题) 缓存 pdf_generator.PDFGenerator，进程内保持字体、样式与 Flowable 缓存"""
+    import pdf_generator
+    key = (version, compiled.name)
+    with _reportlab_lock:
+        generator = _reportlab_generators.get(key)
+        if generator is None:
+            theme = pdf_generator.ThemeManager(config=compiled.config)
+            generator = _reportlab_generators[key] = pdf_generator.PDFGenerator(theme)
+            while len(_reportlab_generators) > 4:
+                _reportlab_generators.pop(next(iter(_reportlab_generators)))
+    return generator
 
 
 class PreviewHTTPRequestHandler(SimpleHTTPRequestHandler):
     """HTTP 请求处理器"""
 
-    def __init__(self, *args, cache_manager=None, theme_manager=None, md_file='main.md', **kwargs):
+    def __init__(self, *args, cache_manager=None, theme_manager=None, md_file='main.md',
+                 search_index=None, dependency_graph=None, live_buffers=None, documents=None, **kwargs):
         self.cache = cache_manager
         self.theme = theme_manager
         self.md_file = md_file
+        self.search_index = search_index
+        self.dependency_graph = dependency_graph
+        self.live = live_buffers
+        self.documents = documents
+        self.doc_base = ''       # 目录模式下当前文档的 URL 前缀 /doc/<路径>
+        self.asset_root = None
         super().__init__(*args, **kwargs)
 
+    def _route(self, path):
+        """目录模式：/doc/<路径>[/api/...] 定位文档，返回文档内的路径；已直接响应时返回 None"""
+        if self.documents is None:
+            return path
+        if path == '/':
+            self._serve_index()
+            return None
+        if path.startswith(('/static/', '/themes/')) or path in ('/api/themes', '/api/theme'):
+            return path
+        m = re.match(r'^/doc/(.+?\.(?:md|markdown))(/.*)?$', path, re.I)
+        if m:
+            state = self.documents.open(m.group(1))
+            if state is None:
+                self.send_error(404)
+                return None
+            self.md_file = state.md_file
+            self.search_index = state.search_index
+            self.doc_base = '/doc/' + m.group(1)
+            return m.group(2) or '/'
+        if path.startswith('/doc/'):
+            # 文档引用的图片等，相对于目录根
+            self.asset_root = self.documents.root
+            return path[len('/doc'):]
+        self.send_error(404)
+        return None
+
     def do_GET(self):
-        path = self.path.split('?')[0]
-        if path == '/' or path == '/preview':
+        self.snapshot = self.theme.snapshot()
+        path = self._route(self.path.split('?')[0])
+        if path is None:
+            return
+        if path == '/ws':
+            self._serve_websocket()
+        elif path == '/' or path == '/preview':
             self._serve_preview()
         elif path == '/api/content':
             self._serve_content()
+        elif path == '/api/outline':
+            self._serve_outline()
+        elif path == '/api/search':
+            self._serve_search()
+        elif path == '/api/table':
+            self._serve_table_page()
+        elif path == '/api/asset':
+            self._serve_dependency()
         elif path == '/api/theme':
             self._serve_theme()
         elif path == '/api/themes':
             self._serve_themes()
-        elif path == '/api/set-theme':
-            self._set_theme()
+        elif path.startswith('/static/'):
+            self._serve_static(path)
+        elif path.startswith('/themes/'):
+            self._serve_theme_css(path)
         elif path == '/api/export-pdf':
             self._export_pdf()
         else:
-            super().do_GET()
+            self._serve_asset(path)
+
+    def do_HEAD(self):
+        self.snapshot = self.theme.snapshot()
+        path = self._route(self.path.split('?')[0])
+        if path is None:
+            return
+        if path.startswith('/static/'):
+            self._serve_static(path, head=True)
+        elif path == '/api/asset':
+            self._serve_dependency(head=True)
+        else:
+            self._serve_asset(path, head=True)
+
+    def _serve_index(self):
+        """目录模式首页：root 下全部文档"""
+        import html as _html
+        from urllib.parse import quote
+        docs = self.documents.list()
+        items = []
+        for rel, mtime in docs:
+            directory, name = rel.rpartition('/')[0], rel.rpartition('/')[2]
+            label = (f'<span class="dir">{_html.escape(directory)}/</span>' if directory else '') + _html.escape(name)
+            items.append(f'<div class="doc" data-path="{_html.escape(rel)}"><a href="/doc/{quote(rel)}">{label}</a>'
+                         f'<span class="mtime">{time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))}</span></div>')
+        body = (INDEX_TEMPLATE
+                .replace('{title}', _html.escape(os.path.basename(self.documents.root) or self.documents.root))
+                .replace('{root}', _html.escape(self.documents.root))
+                .replace('{count}', str(len(docs)))
+                .replace('{items}', ''.join(items) or '<div class="empty">No Markdown files</div>'))
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
 
     def _serve_preview(self):
         """提供预览页面"""
@@ -1234,42 +3178,28 @@ class PreviewHTTPRequestHandler(SimpleHTTPRequestHandler):
     def _get_preview_html(self):
         """获取预览页面 HTML"""
         import json as _json
-        css_vars = self.theme.to_html_vars()
-        dark_vars = self.theme.to_dark_html_vars()
         md_filename = os.path.basename(self.md_file)
 
-        preview_cfg = self.theme.config.get('preview', {})
+        preview_cfg = self.snapshot.config.get('preview', {})
         topbar_height = preview_cfg.get('topbar_height', 44)
         btn_height = max(topbar_height - 16, 24)
         init_lang = preview_cfg.get('lang', 'zh')
         init_theme = preview_cfg.get('theme', 'light')
         init_topbar = 'true' if preview_cfg.get('topbar_visible', True) else 'false'
         init_zoom = str(preview_cfg.get('zoom', 1.0))
-        init_theme_name = self.theme.config.get('theme', 'default')
+        init_theme_name = self.snapshot.config.get('theme', 'default')
 
-        btn_cfg = self.theme.config.get('buttons', {})
+        btn_cfg = self.snapshot.config.get('buttons', {})
         btn_left = btn_cfg.get('left', ['dark', 'lang'])
         btn_right = btn_cfg.get('right', ['auto_refresh', 'export_pdf'])
         btn_layout_json = _json.dumps({'left': btn_left, 'right': btn_right})
 
-        def build_vars(d):
-            lines = []
-            for k, v in d.items():
-                if k.startswith('--spacing'):
-                    lines.append(f'            {k}: {v}rem;')
-                elif k.startswith('--font-size'):
-                    lines.append(f'            {k}: {v}px;')
-                else:
-                    lines.append(f'            {k}: {v};')
-            return '\n'.join(lines)
-
-        root_vars = build_vars(css_vars)
-        dark_css_vars = build_vars(dark_vars)
-        dark_vars_json = _json.dumps(dark_vars)
+        theme_urls = _json.dumps({name: theme.css_url for name, theme in self.snapshot.themes.items()})
 
-        hotkeys = self.theme.config.get('hotkeys', {})
+        hotkeys = self.snapshot.config.get('hotkeys', {})
         hotkeys_json = _json.dumps({
             'export_pdf': hotkeys.get('export_pdf', 'p'),
+            'export_pdf_draft': hotkeys.get('export_pdf_draft', 'o'),
             'toggle_dark': hotkeys.get('toggle_dark', 'd'),
             'toggle_theme': hotkeys.get('toggle_theme', 'c'),
             'toggle_topbar': hotkeys.get('toggle_topbar', 'b'),
@@ -1277,15 +3207,16 @@ class PreviewHTTPRequestHandler(SimpleHTTPRequestHandler):
             'keybindings': hotkeys.get('keybindings', 'k'),
             'toggle_lang': hotkeys.get('toggle_lang', 'l'),
             'toggle_toc': hotkeys.get('toggle_toc', 't'),
+            'search': hotkeys.get('search', 'f'),
         })
 
         template = PREVIEW_TEMPLATE
 
         return (template
                 .replace('{md_filename}', md_filename)
-                .replace('{css_vars}', root_vars)
-                .replace('{dark_css_vars}', dark_css_vars)
-                .replace('{dark_vars_json}', dark_vars_json)
+                .replace('{theme_css_url}', self.snapshot.default.css_url)
+                .replace('{assets}', _json.dumps({name: static_assets.url(name) for name in static_assets.manifest}))
+                .replace('{theme_urls}', theme_urls)
                 .replace('{topbar_height}', str(topbar_height))
                 .replace('{btn_height}', str(btn_height))
                 .replace('{init_lang}', init_lang)
@@ -1295,26 +3226,200 @@ class PreviewHTTPRequestHandler(SimpleHTTPRequestHandler):
                 .replace('{btn_layout}', btn_layout_json)
                 .replace('{init_theme_name}', init_theme_name)
                 .replace('{hotkeys}', hotkeys_json)
+                .replace('{doc_base}', _json.dumps(self.doc_base))
                 )
 
+    def _render(self):
+        """渲染当前文档，按文件 mtime（或编辑器缓冲区序号）与配置版本缓存 HTML 与大纲"""
+        live = self.live.get(self.md_file) if self.live is not None else None
+        if live is not None:
+            mtime = ('buffer', live[0])
+        else:
+            try:
+                mtime = os.stat(self.md_file).st_mtime_ns
+            except OSError:
+                mtime = None
+        cache_key = ('render', self.md_file)
+        result = self.cache.get(cache_key)
+        if result is not None and result['mtime'] == mtime and result['version'] == self.snapshot.version:
+            return result
+
+        if live is not None:
+            raw_content = live[1]
+        elif mtime is not None:
+            with open(self.md_file, 'r', encoding='utf-8') as f:
+                raw_content = f.read()
+        else:
+            raw_content = ''
+
+        import json
+        import hashlib
+        parser = MarkdownToHTML(self.theme, asset_url=self.doc_base + '/api/asset?src=')
+        html_content = parser.parse(raw_content, self.md_file)
+        outline_json = json.dumps(parser.outline, ensure_ascii=False).encode('utf-8')
+        result = {
+            'mtime': mtime,
+            'version': self.snapshot.version,
+            'html': html_content,
+            'outline': parser.outline,
+            'outline_json': outline_json,
+            'outline_etag': '"' + hashlib.sha1(outline_json).hexdigest()[:16] + '"',
+            'features': parser.features_json(),
+            'assets': frozenset(parser.assets),
+            'tables': frozenset(parser.tables),
+        }
+        if self.search_index is not None:
+            self.search_index.update(parser.blocks)
+        if self.dependency_graph is not None:
+            self.dependency_graph.update(self.md_file, parser.dependencies)
+        self.cache.set(cache_key, result)
+        return result
+
     def _serve_content(self):
         """提供内容 API"""
+        result = self._render()
         self.send_response(200)
         self.send_header('Content-type', 'application/json; charset=utf-8')
         self.end_headers()
 
-        if os.path.exists(self.md_file):
-            with open(self.md_file, 'r', encoding='utf-8') as f:
-                raw_content = f.read()
+        import json
+        response = json.dumps({'html': result['html'], 'features': result['features']})
+        self.wfile.write(response.encode('utf-8'))
+
+    def _serve_websocket(self):
+        """WebSocket：编辑器推送未保存的缓冲区，预览页面订阅渲染结果
+
+        消息均为 JSON 文本：
+          {"type": "subscribe"}                                  订阅渲染结果（预览页面）
+          {"type": "buffer", "text": "..."}                      整个缓冲区
+          {"type": "edit", "start": 3, "end": 5, "lines": [...]} 替换第 3~4 行（从 0 开始）
+          {"type": "save"} / {"type": "close"}                   恢复读取磁盘文件
+        推送 {"type": "content", "html": ..., "features": ...}；出错时回复 {"type": "error", "message": ...}。
+        """
+        import json
+        from urllib.parse import urlparse
+        key = self.headers.get('Sec-WebSocket-Key')
+        if self.live is None or not key or self.headers.get('Upgrade', '').lower() != 'websocket':
+            self.send_error(400)
+            return
+        # 浏览器中只允许同源页面连接，避免其他网站向预览推送内容
+        origin = self.headers.get('Origin')
+        if origin and urlparse(origin).netloc != self.headers.get('Host'):
+            self.send_error(403)
+            return
+        self.wfile.write(('HTTP/1.1 101 Switching Protocols\r\n'
+                          'Upgrade: websocket\r\n'
+                          'Connection: Upgrade\r\n'
+                          f'Sec-WebSocket-Accept: {WebSocket.accept_key(key)}\r\n\r\n').encode('ascii'))
+        self.wfile.flush()
+        self.close_connection = True
+        ws = WebSocket(self.connection)
+        doc = self.md_file
+        try:
+            while True:
+                message = ws.recv()
+                if message is None:
+                    break
+                try:
+                    msg = json.loads(message)
+                    kind = msg.get('type')
+                    changed = False
+                    if kind == 'subscribe':
+                        self.live.subscribe(ws, doc)
+                        self._push_live(doc, ws)
+                    elif kind == 'buffer':
+                        self.live.set(doc, str(msg['text']), ws)
+                        changed = True
+                    elif kind == 'edit':
+                        lines = [str(line) for line in msg['lines']]
+                        if not self.live.edit(doc, int(msg['start']), int(msg['end']), lines, ws):
+                            raise ValueError('行范围无效或尚未发送完整缓冲区')
+                        changed = True
+                    elif kind in ('save', 'close'):
+                        changed = bool(self.live.drop(ws, doc))
+                    else:
+                        raise ValueError(f'未知消息类型: {kind}')
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    ws.send_text(json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False))
+                    continue
+                # 连续输入时只渲染最后一个版本
+                if changed and not ws.pending():
+                    self._push_live(doc)
+        finally:
+            self.live.unsubscribe(ws)
+            if self.live.drop(ws):
+                self._push_live(doc)
+            ws.close()
+
+    def _push_live(self, doc, target=None):
+        """渲染并推送给订阅该文档的页面（给出 target 时只发给它）"""
+        import json
+        self.snapshot = self.theme.snapshot()
+        result = self._render()
+        payload = json.dumps({'type': 'content', 'html': result['html'], 'features': result['features']})
+        if target is not None:
+            target.send_text(payload)
         else:
-            raw_content = ''
+            self.live.broadcast(doc, payload)
+
+    def _serve_outline(self):
+        """提供文档大纲 API（支持 ETag 协商缓存）"""
+        result = self._render()
+        etag = result['outline_etag']
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(result['outline_json'])
 
-        parser = MarkdownToHTML(self.theme)
-        html_content = parser.parse(raw_content)
+    def _serve_search(self):
+        """全文检索 API：/api/search?q=...&limit=20"""
+        import json
+        from urllib.parse import urlparse, parse_qs
+        qs = parse_qs(urlparse(self.path).query)
+        query = qs.get('q', [''])[0]
+        try:
+            limit = max(1, min(int(qs.get('limit', ['20'])[0]), 200))
+        except ValueError:
+            limit = 20
+        self._render()
+        results = self.search_index.search(query, limit) if self.search_index is not None else []
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(json.dumps({'query': query, 'results': results}, ensure_ascii=False).encode('utf-8'))
 
+    def _serve_table_page(self):
+        """外部表格分页 API：/api/table?src=data.csv&page=3（只允许文档中 !table 引用的表格）"""
         import json
-        response = json.dumps({'html': html_content})
-        self.wfile.write(response.encode('utf-8'))
+        from urllib.parse import urlparse, parse_qs
+        qs = parse_qs(urlparse(self.path).query)
+        src = qs.get('src', [''])[0]
+        try:
+            page = int(qs.get('page', ['0'])[0])
+        except ValueError:
+            page = 0
+        path = os.path.normpath(os.path.join(os.path.dirname(self.md_file), src))
+        if path not in self._render()['tables']:
+            self.send_error(404)
+            return
+        try:
+            table = csv_tables.get(path)
+        except OSError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(json.dumps({'page': page, 'mtime': table.mtime, 'rows': table.page(page)},
+                                    ensure_ascii=False).encode('utf-8'))
 
     def _serve_theme(self):
         """提供主题 API"""
@@ -1323,113 +3428,289 @@ class PreviewHTTPRequestHandler(SimpleHTTPRequestHandler):
         self.end_headers()
 
         import json
-        response = json.dumps(self.theme.to_html_vars())
+        response = self.snapshot.default.light_json
         self.wfile.write(response.encode('utf-8'))
 
+    def _serve_static(self, path, head=False):
+        """本地前端资源：当前摘要下的 URL 永久缓存"""
+        resolved = static_assets.resolve(path)
+        if resolved is None:
+            self.send_error(404)
+            return
+        full, current = resolved
+        self._send_file(full, 'public, max-age=31536000, immutable' if current else 'no-cache', head)
+
+    def _serve_asset(self, path, head=False):
+        """文档引用的本地文件（图片等），以 .md 所在目录（目录模式为目录根）为根，不允许越界"""
+        from urllib.parse import unquote
+        root = os.path.realpath(self.asset_root or os.path.dirname(self.md_file))
+        full = os.path.realpath(os.path.join(root, unquote(path).lstrip('/')))
+        if not full.startswith(root + os.sep) or not os.path.isfile(full):
+            self.send_error(404)
+            return
+        self._send_image(full, head)
+
+    def _serve_dependency(self, head=False):
+        """主文档目录之外的图片：/api/asset?src=../frag/img.png，只提供当前文档（含片段）引用的图片"""
+        from urllib.parse import urlparse, parse_qs
+        src = parse_qs(urlparse(self.path).query).get('src', [''])[0]
+        path = os.path.normpath(os.path.join(os.path.dirname(self.md_file), src))
+        if path not in self._render()['assets'] or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        self._send_image(path, head)
+
+    def _send_image(self, full, head=False):
+        """发送文档引用的文件"""
+        # 缩小版本 ?w=N（srcset 引用）；不适用时回退到原图
+        m = re.search(r'[?&]w=(\d+)', self.path)
+        if m:
+            full = image_variants.variant(full, int(m.group(1))) or full
+        # 编辑期间文件随时可能变化：每次用 ETag 重新验证，未变化时只回 304
+        self._send_file(full, 'no-cache', head)
+
+    # 超过该大小的文件用 sendfile 零拷贝发送
+    SENDFILE_MIN = 64 * 1024
+
+    def _send_file(self, full, cache_control, head=False):
+        """发送文件：ETag / Last-Modified 条件请求，单段 Range 请求，大文件走 sendfile"""
+        import mimetypes
+        from email.utils import formatdate, parsedate_to_datetime
+        try:
+            f = open(full, 'rb')
+        except OSError:
+            self.send_error(404)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+            last_modified = formatdate(st.st_mtime, usegmt=True)
+
+            def not_modified():
+                inm = self.headers.get('If-None-Match')
+                if inm is not None:
+                    return inm.strip() == '*' or etag in [t.strip() for t in inm.split(',')]
+                ims = self.headers.get('If-Modified-Since')
+                if ims:
+                    try:
+                        return int(st.st_mtime) <= parsedate_to_datetime(ims).timestamp()
+                    except (TypeError, ValueError):
+                        return False
+                return False
+
+            if not_modified():
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+
+            start, end = 0, size - 1
+            status = 200
+            range_header = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if range_header and (not if_range or if_range.strip() in (etag, last_modified)):
+                m = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+                if m and (m.group(1) or m.group(2)):
+                    if m.group(1):
+                        start = int(m.group(1))
+                        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+                    else:
+                        start = max(size - int(m.group(2)), 0)
+                    if start > end or start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+                # 多段或格式不符的 Range 忽略，返回完整内容
+
+            ctype = mimetypes.guess_type(full)[0] or 'application/octet-stream'
+            if full.endswith('.woff2'):
+                ctype = 'font/woff2'
+            length = end - start + 1
+            self.send_response(status)
+            self.send_header('Content-type', ctype)
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', cache_control)
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if head or length <= 0:
+                return
+            if length >= self.SENDFILE_MIN:
+                self.wfile.flush()
+                self.connection.sendfile(f, start, length)
+            else:
+                f.seek(start)
+                self.wfile.write(f.read(length))
+
     def _serve_themes(self):
-        """列出所有可用主题"""
+        """列出所有可用主题及其样式表地址"""
         import json
-        themes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'themes')
         themes = []
-        for f in sorted(os.listdir(themes_dir)):
-            if f.endswith('.yaml'):
-                name = f[:-5]
-                with open(os.path.join(themes_dir, f), 'r', encoding='utf-8') as fh:
-                    cfg = yaml.safe_load(fh) or {}
-                themes.append({'name': name, 'label': cfg.get('name', name)})
+        for name in self.snapshot.names():
+            compiled = self.snapshot.get(name)
+            themes.append({'name': name, 'label': compiled.config.get('name', name), 'css': compiled.css_url})
         self.send_response(200)
         self.send_header('Content-type', 'application/json; charset=utf-8')
         self.end_headers()
         self.wfile.write(json.dumps(themes).encode('utf-8'))
 
-    def _set_theme(self):
-        """切换主题并返回新颜色 CSS 变量"""
-        import json
-        from urllib.parse import urlparse, parse_qs
-        qs = parse_qs(urlparse(self.path).query)
-        name = qs.get('name', [''])[0]
-        themes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'themes')
-        theme_path = os.path.join(themes_dir, f'{name}.yaml')
+    def _serve_theme_css(self, path):
+        """主题样式表 /themes/<name>.<hash>.css：地址随内容变化，可永久缓存"""
+        m = re.match(r'^/themes/([\w-]+)\.([0-9a-f]+)\.css$', path)
+        if not m or m.group(1) not in self.snapshot.themes:
+            self.send_error(404)
+            return
+        compiled = self.snapshot.get(m.group(1))
+        etag = f'"{compiled.css_hash}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = compiled.stylesheet.encode('utf-8')
         self.send_response(200)
-        self.send_header('Content-type', 'application/json; charset=utf-8')
-        self.end_headers()
-        if os.path.exists(theme_path):
-            theme_cfg = yaml.safe_load(open(theme_path, encoding='utf-8'))
-            self.theme.config['colors'] = theme_cfg.get('colors', {})
-            self.theme.config['dark_colors'] = theme_cfg.get('dark_colors', {})
-            color_vars = {k: v for k, v in self.theme.to_html_vars().items()
-                          if not k.startswith('--font-size') and not k.startswith('--spacing')}
-            color_vars['dark'] = self.theme.to_dark_html_vars()
-            self.wfile.write(json.dumps(color_vars).encode('utf-8'))
+        self.send_header('Content-type', 'text/css; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if m.group(2) == compiled.css_hash:
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
         else:
-            self.wfile.write(b'')
+            # 旧哈希：主题已修改，返回当前内容但不缓存
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
 
-    def _export_pdf(self):
-        """导出 PDF"""
+    def _pdf_output_path(self):
+        """导出的 PDF 与 .md 同目录同名"""
+        md_stem = os.path.splitext(os.path.basename(self.md_file))[0]
+        return os.path.join(os.path.dirname(self.md_file), md_stem + '.pdf')
+
+    def _export_pdf_reportlab(self, compiled):
+        """用 ReportLab 快速生成草稿 PDF（无需浏览器）"""
         self.send_response(200)
         self.send_header('Content-type', 'text/plain; charset=utf-8')
         self.end_headers()
+        try:
+            with open(self.md_file, 'r', encoding='utf-8') as f:
+                raw_content = f.read()
+            content = MarkdownToHTML(self.theme).expand_includes(raw_content, os.path.dirname(self.md_file),
+                                                                 (os.path.abspath(self.md_file),))
+            generator = _reportlab_generator(compiled, self.snapshot.version)
+            with _reportlab_lock:
+                out_pdf = generator.generate(content, self._pdf_output_path(), base_dir=os.path.dirname(self.md_file))
+            self.wfile.write(out_pdf.encode('utf-8'))
+        except Exception as e:
+            self.wfile.write(f'PDF 生成失败: {str(e)}'.encode('utf-8'))
+
+    def _export_pdf(self):
+        """导出 PDF：/api/export-pdf?engine=chromium|reportlab&theme=<name>
+
+        engine 默认取 config.yaml 的 pdf.engine，theme 为客户端当前选择的主题
+        """
+        from urllib.parse import urlparse, parse_qs, quote
+        qs = parse_qs(urlparse(self.path).query)
+        compiled = self.snapshot.get(qs.get('theme', [''])[0])
+        engine = qs.get('engine', [''])[0] or self.snapshot.config.get('pdf', {}).get('engine', 'chromium')
+        if engine == 'reportlab':
+            self._export_pdf_reportlab(compiled)
+            return
 
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; charset=utf-8')
+        self.end_headers()
         try:
-            from playwright.sync_api import sync_playwright
-            import queue
-            md_stem = os.path.splitext(os.path.basename(self.md_file))[0]
-            out_pdf = os.path.join(os.path.dirname(self.md_file), md_stem + '.pdf')
             server_port = self.server.server_address[1]
-            author = self.theme.config.get('author', '')
-            pdf_cfg = self.theme.config.get('pdf', {})
-            margin_bottom = pdf_cfg.get('margin_bottom', '1.5cm')
-            result_q = queue.Queue()
-
-            def run():
-                try:
-                    with sync_playwright() as p:
-                        browser = p.chromium.launch()
-                        page = browser.new_page()
-                        page.goto(f'http://localhost:{server_port}/', wait_until='domcontentloaded')
-                        page.wait_for_function("document.querySelector('#preview') && document.querySelector('#preview').children.length > 0")
-                        page.wait_for_timeout(1000)
-                        page.evaluate("""() => {
-                            const c = document.querySelector('.preview-content');
-                            const h = c ? c.scrollHeight : document.body.scrollHeight;
-                            document.body.style.cssText += ';height:auto!important;min-height:0!important;overflow:visible!important;background:white!important';
-                            const main = document.querySelector('main');
-                            if (main) main.style.cssText += ';height:auto!important;min-height:0!important;flex:none!important;background:white!important';
-                        }""")
-                        page.pdf(path=out_pdf, format='A4', print_background=True,
-                                 margin={'top': '1cm', 'bottom': margin_bottom, 'left': '1cm', 'right': '1cm'},
-                                 display_header_footer=True,
-                                 header_template='<span></span>',
-                                 footer_template=f'<div style="position:relative;width:100%;font-size:10px;color:#888;padding:0 1.2cm;box-sizing:border-box;"><span style="position:absolute;left:1.2cm;color:#888;">{author}</span><span style="position:absolute;right:1.2cm;color:#888;"><span class="pageNumber"></span> / <span class="totalPages"></span></span></div>')
-                        browser.close()
-                    result_q.put(('ok', out_pdf))
-                except Exception as e:
-                    result_q.put(('err', str(e)))
-                    result_q.put(('err', str(e)))
-
-            t = Thread(target=run, daemon=True)
-            t.start()
-            t.join(timeout=60)
-
-            status, val = result_q.get()
-            if status == 'ok':
-                self.wfile.write(val.encode('utf-8'))
-            else:
-                self.wfile.write(f'PDF 生成失败: {val}'.encode('utf-8'))
+            out_pdf = chromium_pdf(f'http://localhost:{server_port}{self.doc_base or "/"}?export=1&theme={quote(compiled.name)}',
+                                   self._pdf_output_path(), self.snapshot.config)
+            self.wfile.write(out_pdf.encode('utf-8'))
         except Exception as e:
             self.wfile.write(f'PDF 生成失败: {str(e)}'.encode('utf-8'))
 
 
+def chromium_pdf(url, out_pdf, config, timeout=60):
+    """用无头 Chromium 打开导出页面（?export=1）并打印为 PDF，返回输出路径"""
+    from playwright.sync_api import sync_playwright
+    import queue
+    author = config.get('author', '')
+    pdf_cfg = config.get('pdf', {})
+    margin_bottom = pdf_cfg.get('margin_bottom', '1.5cm')
+    result_q = queue.Queue()
+
+    def run():
+        try:
+            with sync_playwright() as p:
+                browser = p.chromium.launch()
+                page = browser.new_page()
+                page.goto(url, wait_until='domcontentloaded')
+                page.wait_for_function("document.querySelector('#preview') && document.querySelector('#preview').children.length > 0")
+                page.wait_for_function("!document.querySelector('.csv-table[data-loading]')", timeout=55000)
+                page.evaluate("() => window.markitEnhanceAll()")
+                page.wait_for_timeout(1000)
+                page.evaluate("""() => {
+                    const c = document.querySelector('.preview-content');
+                    const h = c ? c.scrollHeight : document.body.scrollHeight;
+                    document.body.style.cssText += ';height:auto!important;min-height:0!important;overflow:visible!important;background:white!important';
+                    const main = document.querySelector('main');
+                    if (main) main.style.cssText += ';height:auto!important;min-height:0!important;flex:none!important;background:white!important';
+                }""")
+                page.pdf(path=out_pdf, format='A4', print_background=True,
+                         margin={'top': '1cm', 'bottom': margin_bottom, 'left': '1cm', 'right': '1cm'},
+                         display_header_footer=True,
+                         header_template='<span></span>',
+                         footer_template=f'<div style="position:relative;width:100%;font-size:10px;color:#888;padding:0 1.2cm;box-sizing:border-box;"><span style="position:absolute;left:1.2cm;color:#888;">{author}</span><span style="position:absolute;right:1.2cm;color:#888;"><span class="pageNumber"></span> / <span class="totalPages"></span></span></div>')
+                browser.close()
+            result_q.put(('ok', out_pdf))
+        except Exception as e:
+            result_q.put(('err', str(e)))
+
+    t = Thread(target=run, daemon=True)
+    t.start()
+    t.join(timeout=timeout)
+    try:
+        status, val = result_q.get_nowait()
+    except queue.Empty:
+        raise RuntimeError(f'导出超时（{timeout}s）')
+    if status != 'ok':
+        raise RuntimeError(val)
+    return val
+
+
 class PreviewServer:
-    """预览服务器"""
+    """预览服务器
 
-    def __init__(self, port=8000, md_file='main.md'):
+    给出 root 时为目录模式：首页列出 root 下全部文档，/doc/<路径> 预览单个文档，
+    各文档的渲染缓存、搜索索引与文件监听在首次打开时创建，空闲时回收。
+    """
+
+    def __init__(self, port=8000, md_file='main.md', root=None):
         self.port = port
-        self.md_file = os.path.abspath(md_file)
+        self.md_file = os.path.abspath(md_file) if root is None else None
         self.server = None
         self.config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
         self.theme = ThemeManager(self.config_dir)
         self.cache = CacheManager()
+        self.search_index = SearchIndex()
+        self.dependency_graph = DependencyGraph()
+        self.documents = None
+        if root is None:
+            self.dependency_graph.update(self.md_file, ())
+        else:
+            self.documents = DocumentStore(root, self.cache, self.dependency_graph)
+            self.documents.on_evict = self._on_documents_evicted
+        self.live_buffers = LiveBuffers()
+        self.observer = None
+        self.watched_dirs = {}   # 目录 -> watchdog ObservedWatch
+        self.watch_lock = Lock()  # 请求线程追加监听与回收线程取消监听共用
+        self._config_listing = None
 
     def _get_available_port(self):
         """获取可用端口"""
@@ -1444,12 +3725,17 @@ class PreviewServer:
 
     def start(self):
         """启动服务器"""
+        check_static_assets(self.theme.config)
         available_port = self._get_available_port()
 
         # 保存引用供内部类使用
         cache_ref = self.cache
         theme_ref = self.theme
         md_file_ref = self.md_file
+        search_ref = self.search_index
+        deps_ref = self.dependency_graph
+        live_ref = self.live_buffers
+        documents_ref = self.documents
 
         # 创建自定义 handler
         class Handler(PreviewHTTPRequestHandler):
@@ -1457,27 +3743,34 @@ class PreviewServer:
                 kwargs['cache_manager'] = cache_ref
                 kwargs['theme_manager'] = theme_ref
                 kwargs['md_file'] = md_file_ref
+                kwargs['search_index'] = search_ref
+                kwargs['dependency_graph'] = deps_ref
+                kwargs['live_buffers'] = live_ref
+                kwargs['documents'] = documents_ref
                 super().__init__(*args, **kwargs)
 
         # 创建服务器（allow_reuse_address 确保停止后端口立即释放）
         ThreadedHTTPServer.allow_reuse_address = True
         self.server = ThreadedHTTPServer(('localhost', available_port), Handler)
 
-        # 启动文件监听器
-        watch_dir = os.path.dirname(self.md_file)
-        observer = Observer()
-        observer.schedule(FileWatcher(self._on_file_change), watch_dir, recursive=False)
-        # 监听 config 目录
-        if os.path.isdir(self.config_dir):
-            observer.schedule(FileWatcher(self._on_config_change), self.config_dir, recursive=True)
-        observer.start()
+        self._start_watcher()
+
+        # Mermaid / 公式服务端预渲染：结果就绪后让渲染缓存失效，下一次刷新取到预渲染内容
+        prerender.enabled = bool(self.theme.config.get('preview', {}).get('prerender', True))
+        prerender.on_ready = self.cache.clear
+
+        if self.documents is not None:
+            Thread(target=self._sweep_documents, daemon=True).start()
 
         # 显示访问信息
         url = f"http://localhost:{available_port}"
         print("=" * 60)
         print("🚀 Markdown 实时预览服务器")
         print("=" * 60)
-        print(f"📁 工作目录: {os.getcwd()}")
+        if self.documents is not None:
+            print(f"📁 文档目录: {self.documents.root}")
+        else:
+            print(f"📁 工作目录: {os.getcwd()}")
         print(f"🌐 访问地址: {url}")
         print("=" * 60)
         print("编辑器功能:")
@@ -1502,23 +3795,378 @@ class PreviewServer:
         finally:
             self.server.server_close()
 
-    def _on_file_change(self):
-        """文件变化回调"""
-        self.cache.clear()
+    def _start_watcher(self):
+        """启动文件监听：preview.watcher = auto | inotify | poll
+
+        inotify: watchdog 原生 Observer，监听文档目录 + 依赖文件所在目录（随依赖图增长追加）
+        poll:    StatPoller，只轮询依赖图中的文件和 config 下的 .yaml
+        auto:    文档或配置位于网络 / 容器共享文件系统时用 poll，否则用 inotify
+        """
+        mode = self.theme.config.get('preview', {}).get('watcher', 'auto')
+        if mode == 'auto':
+            doc_dir = self.documents.root if self.documents is not None else os.path.dirname(self.md_file)
+            fstype = detect_network_fs([doc_dir, self.config_dir])
+            mode = 'poll' if fstype else 'inotify'
+            if fstype:
+                print(f"[预览] 检测到 {fstype} 文件系统，使用轮询监听")
+        if mode != 'poll':
+            try:
+                self.observer = Observer()
+                if self.md_file:
+                    self._watch_dir(os.path.dirname(self.md_file))
+                self.dependency_graph.on_new_dir = self._watch_dir
+                if os.path.isdir(self.config_dir):
+                    self.observer.schedule(FileWatcher(self._on_config_change, lambda path: path.endswith('.yaml')),
+                                           self.config_dir, recursive=True)
+                self.observer.start()
+                return
+            except OSError as e:
+                # 例如 inotify watch 数量达到上限
+                print(f"[预览] 文件监听启动失败 ({e})，改用轮询监听")
+                self.dependency_graph.on_new_dir = None
+                with self.watch_lock:
+                    self.watched_dirs.clear()
+        self.observer = StatPoller()
+        self.observer.watch(FileWatcher(self._on_file_change, self.dependency_graph.is_tracked),
+                            self.dependency_graph.tracked)
+        self.observer.watch(FileWatcher(self._on_config_change, lambda path: path.endswith('.yaml')),
+                            self._config_files, report_new=True)
+        self.dependency_graph.on_new_deps = self.observer.wake
+        self.observer.start()
+
+    def _config_files(self):
+        """config 与 config/themes 下的 .yaml；目录 mtime 未变时复用上次的列表"""
+        dirs = [self.config_dir, os.path.join(self.config_dir, 'themes')]
+        key = tuple(StatPoller._signature(d) for d in dirs)
+        if self._config_listing is None or self._config_listing[0] != key:
+            files = []
+            for d in dirs:
+                if os.path.isdir(d):
+                    files.extend(os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith('.yaml'))
+            self._config_listing = (key, files)
+        return self._config_listing[1]
+
+    def _watch_dir(self, directory):
+        """监听目录（只处理依赖图中登记过的文件）"""
+        with self.watch_lock:
+            if directory in self.watched_dirs or not os.path.isdir(directory):
+                return
+            self.watched_dirs[directory] = self.observer.schedule(
+                FileWatcher(self._on_file_change, self.dependency_graph.is_tracked), directory, recursive=False)
+
+    def _on_documents_evicted(self, docs):
+        """目录模式回收文档后，取消不再有文件被跟踪的目录的监听（轮询模式下跟踪列表自动缩小）"""
+        with self.watch_lock:
+            # 在锁内读取依赖图：并发打开的文档要么已登记（目录保留），
+            # 要么稍后经 on_new_dir 在本次取消之后重新追加监听
+            in_use = {os.path.dirname(p) for p in self.dependency_graph.tracked()}
+            for directory in [d for d in self.watched_dirs if d not in in_use]:
+                try:
+                    self.observer.unschedule(self.watched_dirs.pop(directory))
+                except (KeyError, OSError):
+                    pass
+        print(f"[预览] 回收 {len(docs)} 个空闲文档")
 
-    def _on_config_change(self):
-        """配置文件变化回调，重新加载主题"""
-        self.theme.config = self.theme._load_config()
-        self.cache.clear()
-        print("[预览] 配置已重新加载")
+    def _sweep_documents(self):
+        """目录模式：定期回收空闲文档"""
+        while True:
+            time.sleep(min(self.documents.idle / 2, 60))
+            self.documents.sweep()
+
+    def _on_file_change(self, path):
+        """文件变化回调：只让受影响文档的渲染缓存失效"""
+        for doc in self.dependency_graph.affected(path):
+            self.cache.delete(('render', doc))
+
+    def _on_config_change(self, path=None):
+        """配置文件变化回调，只重新加载变化的主题文件；新版本号使渲染与导出缓存自然失效"""
+        if not self.theme.reload(path):
+            return
+        print(f"[预览] 配置已重新加载 (v{self.theme.snapshot().version})")
+
+
+class InvalidParams(ValueError):
+    """JSON-RPC 参数错误（-32602）；其余异常按服务端错误返回"""
+
+
+class RenderDaemon:
+    """常驻渲染进程：以 JSON-RPC 2.0 提供 render / outline / export
+
+    每行一个请求（stdin / stdout 或 Unix 域套接字）。主题、解析结果与 ReportLab 生成器常驻内存：
+    文档及其 !include / 图片依赖按 mtime 校验，未变化时直接返回缓存；配置文件变化时只重新加载变化的文件。
+    """
+
+    MAX_ENTRIES = 256
+
+    def __init__(self, config_dir=None):
+        from collections import OrderedDict
+        self.config_dir = config_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+        self.theme = ThemeManager(self.config_dir)
+        self.lock = Lock()
+        self.config_lock = Lock()
+        self.cache = OrderedDict()
+        self.config_sigs = self._config_signatures()
+        self.config_checked = time.monotonic()
+        self.methods = {'render': self.render, 'outline': self.outline, 'export': self.export}
+        # render / outline / export 不提供页面 JS/CSS，只设置资源来源（Chromium 导出时使用）
+        static_assets.configure(self.theme.config)
+        prerender.enabled = bool(self.theme.config.get('preview', {}).get('prerender', True))
+        prerender.on_ready = self._clear
+
+    def _clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def _config_signatures(self):
+        sigs = {}
+        for d in (self.config_dir, os.path.join(self.config_dir, 'themes')):
+            if os.path.isdir(d):
+                for f in os.listdir(d):
+                    if f.endswith('.yaml'):
+                        path = os.path.join(d, f)
+                        sigs[path] = StatPoller._signature(path)
+        return sigs
+
+    def _check_config(self):
+        """最多每 0.5s 检查一次配置文件"""
+        now = time.monotonic()
+        if now - self.config_checked < 0.5 or not self.config_lock.acquire(blocking=False):
+            return
+        try:
+            self.config_checked = now
+            sigs = self._config_signatures()
+            for path in set(sigs) | set(self.config_sigs):
+                if sigs.get(path) != self.config_sigs.get(path):
+                    self.theme.reload(path)
+            self.config_sigs = sigs
+        finally:
+            self.config_lock.release()
+
+    @staticmethod
+    def _param(params, name, required=False):
+        """取字符串参数；缺少（required 时）或类型不对时抛出 InvalidParams"""
+        value = params.get(name)
+        if value is None:
+            if required:
+                raise InvalidParams(f'缺少参数 {name}')
+            return None
+        if not isinstance(value, str):
+            raise InvalidParams(f'参数 {name} 应为字符串')
+        return value
+
+    def _document(self, params):
+        """按 path（文件）或 text（内容，path 作为 !include 的基准）渲染，返回缓存条目"""
+        import hashlib
+        path, text = self._param(params, 'path'), self._param(params, 'text')
+        if path is None and text is None:
+            raise InvalidParams('需要 path 或 text 参数')
+        if path is not None:
+            path = os.path.abspath(os.path.expanduser(path))
+        self._check_config()
+        version = self.theme.snapshot().version
+        if text is not None:
+            key = ('text', hashlib.sha1(text.encode('utf-8')).hexdigest(), path)
+            own = ()
+        else:
+            key = ('path', path)
+            own = ((path, StatPoller._signature(path)),)
+            if own[0][1] is None:
+                raise FileNotFoundError(f'文件不存在: {path}')
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+        if entry is not None and entry['version'] == version and entry['own'] == own and \
+                all(StatPoller._signature(p) == sig for p, sig in entry['deps']):
+            return entry
+
+        if text is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        parser = MarkdownToHTML(self.theme)
+        html = parser.parse(text, path)
+        entry = {
+            'version': version,
+            'own': own,
+            'deps': tuple((p, StatPoller._signature(p)) for p in sorted(parser.dependencies)),
+            'html': html,
+            'features': parser.features_json(),
+            'outline': parser.outline,
+        }
+        with self.lock:
+            self.cache[key] = entry
+            while len(self.cache) > self.MAX_ENTRIES:
+                self.cache.popitem(last=False)
+        return entry
+
+    def render(self, params):
+        entry = self._document(params)
+        return {'html': entry['html'], 'features': entry['features']}
+
+    def outline(self, params):
+        return {'outline': self._document(params)['outline']}
+
+    def export(self, params):
+        """导出 PDF：engine 默认取 pdf.engine，output 默认与 .md 同目录同名"""
+        path = os.path.abspath(os.path.expanduser(self._param(params, 'path', required=True)))
+        theme, engine, output = (self._param(params, name) for name in ('theme', 'engine', 'output'))
+        if engine not in (None, 'reportlab', 'chromium'):
+            raise InvalidParams(f'未知导出引擎: {engine}')
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'文件不存在: {path}')
+        self._check_config()
+        snapshot = self.theme.snapshot()
+        compiled = snapshot.get(theme or '')
+        engine = engine or snapshot.config.get('pdf', {}).get('engine', 'chromium')
+        out_pdf = os.path.abspath(os.path.expanduser(output or os.path.splitext(path)[0] + '.pdf'))
+        if engine == 'reportlab':
+            with open(path, 'r', encoding='utf-8') as f:
+                raw_content = f.read()
+            content = MarkdownToHTML(self.theme).expand_includes(raw_content, os.path.dirname(path),
+                                                                 (os.path.abspath(path),))
+            generator = _reportlab_generator(compiled, snapshot.version)
+            with _reportlab_lock:
+                out_pdf = generator.generate(content, out_pdf, base_dir=os.path.dirname(path))
+        elif engine == 'chromium':
+            out_pdf = self._export_chromium(path, compiled, snapshot, out_pdf)
+        else:
+            raise RuntimeError(f'pdf.engine 配置无效: {engine}')
+        return {'path': out_pdf, 'engine': engine}
+
+    def _export_chromium(self, path, compiled, snapshot, out_pdf):
+        """临时在随机端口上为该文档起一个预览服务供 Chromium 打开，导出后关闭
+
+        与 PreviewServer 一样登记依赖图，页面中 !table 的其余分页、片段图片经 /api/table、
+        /api/asset 加载。
+        """
+        from functools import partial
+        from urllib.parse import quote
+        dependency_graph = DependencyGraph()
+        dependency_graph.update(path, ())
+        handler = partial(PreviewHTTPRequestHandler, cache_manager=CacheManager(), theme_manager=self.theme,
+                          md_file=path, dependency_graph=dependency_graph)
+        server = ThreadedHTTPServer(('localhost', 0), handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://localhost:{server.server_address[1]}/?export=1&theme={quote(compiled.name)}'
+            return chromium_pdf(url, out_pdf, snapshot.config)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @staticmethod
+    def _error(rid, code, message):
+        return {'jsonrpc': '2.0', 'id': rid, 'error': {'code': code, 'message': message}}
+
+    def _call(self, req):
+        if not isinstance(req, dict) or req.get('jsonrpc') != '2.0' or not isinstance(req.get('method'), str):
+            return self._error(req.get('id') if isinstance(req, dict) else None, -32600, 'Invalid Request')
+        rid = req.get('id')
+        method = self.methods.get(req['method'])
+        params = req.get('params', {})
+        if method is None:
+            resp = self._error(rid, -32601, f'Method not found: {req["method"]}')
+        elif not isinstance(params, dict):
+            resp = self._error(rid, -32602, 'Invalid params: 需要命名参数（对象）')
+        else:
+            try:
+                resp = {'jsonrpc': '2.0', 'id': rid, 'result': method(params)}
+            except InvalidParams as e:
+                resp = self._error(rid, -32602, f'Invalid params: {e}')
+            except OSError as e:
+                # 文件不存在、无权限等：服务端错误
+                resp = self._error(rid, -32000, str(e))
+            except Exception as e:
+                # 渲染 / 导出过程中的其他异常（解析器或 ReportLab 错误）
+                resp = self._error(rid, -32603, f'Internal error: {type(e).__name__}: {e}')
+        # 通知（没有 id）不回复
+        return resp if 'id' in req else None
+
+    def handle(self, line):
+        """处理一行请求（单个或批量），返回响应文本；全部为通知时返回 None"""
+        import json
+        try:
+            req = json.loads(line)
+        except ValueError:
+            return json.dumps(self._error(None, -32700, 'Parse error'))
+        if isinstance(req, list):
+            if not req:
+                return json.dumps(self._error(None, -32600, 'Invalid Request'))
+            responses = [r for r in map(self._call, req) if r is not None]
+            return json.dumps(responses, ensure_ascii=False) if responses else None
+        resp = self._call(req)
+        return json.dumps(resp, ensure_ascii=False) if resp is not None else None
+
+    def serve_stdio(self, out):
+        """从 stdin 逐行读取请求，响应写到 out（原 stdout；提示信息走 stderr）"""
+        import sys
+        print("[预览] 渲染服务已启动 (stdio)", file=sys.stderr)
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            resp = self.handle(line)
+            if resp is not None:
+                out.write(resp + '\n')
+                out.flush()
+
+    def serve_unix(self, path):
+        """在 Unix 域套接字上提供服务，每个连接一个线程，连接内逐行请求 / 响应"""
+        import socketserver
+        import stat
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    resp = daemon.handle(line)
+                    if resp is not None:
+                        self.wfile.write(resp.encode('utf-8') + b'\n')
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        path = os.path.abspath(path)
+        # 清理上次异常退出留下的套接字文件（普通文件不动）
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        server = Server(path, Handler)
+        os.chmod(path, 0o600)
+        print(f"[预览] 渲染服务已启动: {path}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(path)
 
 
 def main():
-    """主函数"""
+    """主函数
+
+    python3 preview.py [file.md]                       预览服务器
+    python3 preview.py --daemon [--socket PATH]        常驻渲染服务（JSON-RPC，默认 stdin / stdout）
+    """
     import sys
-    md_file = sys.argv[1] if len(sys.argv) > 1 else 'main.md'
+    args = sys.argv[1:]
+    if '--daemon' in args:
+        socket_path = args[args.index('--socket') + 1] if '--socket' in args[:-1] else None
+        try:
+            if socket_path:
+                RenderDaemon().serve_unix(socket_path)
+            else:
+                # stdout 只用于响应，渲染过程中的提示改写到 stderr
+                out, sys.stdout = sys.stdout, sys.stderr
+                RenderDaemon().serve_stdio(out)
+        except KeyboardInterrupt:
+            pass
+        return
+    md_file = args[0] if args else 'main.md'
     md_file = os.path.abspath(md_file)
-    server = PreviewServer(md_file=md_file)
+    if os.path.isdir(md_file):
+        server = PreviewServer(root=md_file)
+    else:
+        server = PreviewServer(md_file=md_file)
     try:
         server.start()
     except KeyboardInterrupt:
@@ -0,0 +1,50 @@
+"""pdf_generator 内联标记回归测试"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.platypus import Paragraph  # noqa: E402
+
+import pdf_generator  # noqa: E402
+
+
+class InlineMarkupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generator = pdf_generator.PDFGenerator()
+        cls.style = cls.generator.styles['normal']
+
+    def assert_parses(self, text):
+        markup = self.generator._inline(text)
+        Paragraph(markup, self.style)   # 标签嵌套错误时抛出 ValueError
+        return markup
+
+    def test_overlapping_emphasis(self):
+        markup = self.assert_parses('see **a *b** c* here')
+        self.assertEqual(markup, 'see <b>a *b</b> c* here')
+
+    def test_asterisk_in_link_url(self):
+        markup = self.assert_parses('see [the *docs*](http://x/a*b*c) and *this*')
+        self.assertIn('href="http://x/a*b*c"', markup)
+        self.assertIn('<i>docs</i></link>', markup)
+        self.assertTrue(markup.endswith('and <i>this</i>'))
+
+    def test_nested_emphasis(self):
+        self.assertEqual(self.assert_parses('***a*** **b *c* d** ~~e~~'),
+                         '<b><i>a</i></b> <b>b <i>c</i> d</b> <strike>e</strike>')
+
+    def test_generate_with_overlapping_markers(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'out.pdf')
+            content = '# T\n\nsee **a *b** c* here\n\n- [x](http://x/a*b) *y\n'
+            self.assertEqual(self.generator.generate(content, out, streaming=False), out)
+            self.assertGreater(os.path.getsize(out), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Theme Compiler
+主题编译器 - 把 (主题, 配置) 解析为只读的编译结果，预览服务器与 PDF 生成器共用
+"""
+
+import os
+import json
+import hashlib
+import threading
+from types import MappingProxyType
+
+import yaml
+
+
+# 亮色 CSS 变量: (变量名, 配置节, 键, 默认值)
+LIGHT_VARS = [
+    ('--color-title', 'colors', 'title', '#1a365d'),
+    ('--color-heading', 'colors', 'heading', '#2c5282'),
+    ('--color-subheading', 'colors', 'subheading', '#2f855a'),
+    ('--color-text', 'colors', 'text', '#1a202c'),
+    ('--color-code-bg', 'colors', 'code_bg', '#f7fafc'),
+    ('--color-code-text', 'colors', 'code_text', '#1a202c'),
+    ('--color-table-header', 'colors', 'table_header', '#2c5282'),
+    ('--color-table-header-text', 'colors', 'table_header_text', '#ffffff'),
+    ('--color-table-row', 'colors', 'table_row', '#ebf8ff'),
+    ('--color-table-border', 'colors', 'table_border', '#a0aec0'),
+    ('--color-link', 'colors', 'link', '#3182ce'),
+    ('--header-bg', 'colors', 'topbar_bg', 'linear-gradient(135deg, #1a365d 0%, #2c5282 100%)'),
+    ('--header-text', 'colors', 'topbar_text', '#ffffff'),
+
+    ('--font-size-title', 'font_sizes', 'title', 28),
+    ('--font-size-heading', 'font_sizes', 'heading', 18),
+    ('--font-size-subheading', 'font_sizes', 'subheading', 14),
+    ('--font-size-subsubheading', 'font_sizes', 'subsubheading', 12),
+    ('--font-size-normal', 'font_sizes', 'normal', 11),
+    ('--font-size-code', 'font_sizes', 'code', 9),
+    ('--font-size-table-header', 'font_sizes', 'table_header', 12),
+
+    ('--spacing-title-after', 'spacing', 'title_after', 0.5),
+    ('--spacing-heading-before', 'spacing', 'heading_before', 0.4),
+    ('--spacing-heading-after', 'spacing', 'heading_after', 0.3),
+    ('--spacing-subheading-before', 'spacing', 'subheading_before', 0.3),
+    ('--spacing-subheading-after', 'spacing', 'subheading_after', 0.2),
+    ('--spacing-normal-after', 'spacing', 'normal_after', 0.2),
+    ('--spacing-code-after', 'spacing', 'code_after', 0.3),
+]
+
+# 暗色 CSS 变量: (变量名, 键, 默认值)，取自 dark_colors
+DARK_VARS = [
+    ('--color-title', 'title', '#90cdf4'),
+    ('--color-heading', 'heading', '#63b3ed'),
+    ('--color-subheading', 'subheading', '#68d391'),
+    ('--color-text', 'text', '#e2e8f0'),
+    ('--color-code-bg', 'code_bg', '#2d3748'),
+    ('--color-code-text', 'code_text', '#e2e8f0'),
+    ('--color-table-header', 'table_header', '#2c5282'),
+    ('--color-table-header-text', 'table_header_text', '#e2e8f0'),
+    ('--color-table-row', 'table_row', '#1e3a5f'),
+    ('--color-table-border', 'table_border', '#4a5568'),
+    ('--bg-color', 'bg', '#1a1a2e'),
+    ('--surface-color', 'surface', '#1e2433'),
+    ('--header-bg', 'topbar_bg', 'linear-gradient(135deg, #1a365d 0%, #2c5282 100%)'),
+    ('--header-text', 'topbar_text', '#ffffff'),
+]
+
+
+def _read_yaml(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def theme_path(config_dir, theme_name):
+    """主题文件路径，找不到时回退到 default"""
+    path = os.path.join(config_dir, 'themes', f'{theme_name}.yaml')
+    if not os.path.exists(path):
+        path = os.path.join(config_dir, 'themes', 'default.yaml')
+    return path
+
+
+def merge_config(main, theme_cfg, theme_name):
+    """合并：main 中的 preview/buttons/font_sizes/spacing 等保留，theme 文件提供颜色等"""
+    result = dict(theme_cfg)
+    result['preview'] = main.get('preview', {})
+    result['buttons'] = main.get('buttons', {})
+    result['font_sizes'] = main.get('font_sizes', theme_cfg.get('font_sizes', {}))
+    result['spacing'] = main.get('spacing', theme_cfg.get('spacing', {}))
+    result['hotkeys'] = main.get('hotkeys', {})
+    result['theme'] = theme_name
+    result['author'] = main.get('author', '')
+    result['pdf'] = main.get('pdf', {})
+    return result
+
+
+def load_config(config_dir, theme_name=None):
+    """读取 config.yaml 与主题文件并合并；theme_name 为空时使用 config.yaml 中的 theme"""
+    main_cfg_path = os.path.join(config_dir, 'config.yaml')
+    if not os.path.exists(main_cfg_path):
+        # 兼容旧路径
+        old = os.path.join(os.path.dirname(config_dir), 'theme_config.yaml')
+        if os.path.exists(old):
+            return _read_yaml(old)
+        return {}
+    main = _read_yaml(main_cfg_path)
+    theme_name = theme_name or main.get('theme', 'default')
+    path = theme_path(config_dir, theme_name)
+    theme_cfg = _read_yaml(path) if os.path.exists(path) else {}
+    return merge_config(main, theme_cfg, theme_name)
+
+
+def _css_block(variables, indent='            '):
+    lines = []
+    for k, v in variables.items():
+        if k.startswith('--spacing'):
+            lines.append(f'{indent}{k}: {v}rem;')
+        elif k.startswith('--font-size'):
+            lines.append(f'{indent}{k}: {v}px;')
+        else:
+            lines.append(f'{indent}{k}: {v};')
+    return '\n'.join(lines)
+
+
+class FrozenDict(dict):
+    """只读字典：仍可 json 序列化、isinstance(dict) 判断，修改时抛出 TypeError"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('配置快照只读')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return id(self)
+
+
+def freeze(value):
+    """递归转换为只读结构（dict -> FrozenDict，list -> tuple）"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class CompiledTheme:
+    """编译后的主题（只读）
+
+    light_vars / dark_vars: CSS 变量映射
+    light_css / dark_css:   CSS 变量声明文本
+    light_json / dark_json: CSS 变量 JSON
+    stylesheet / css_url:   独立样式表（:root 亮色 + body.dark 暗色）及带内容哈希的地址
+    reportlab_styles():     ReportLab ParagraphStyle（按字体名缓存）
+    """
+
+    def __init__(self, config):
+        self.config = config = freeze(config)
+        self.name = config.get('theme', 'default')
+        colors = config.get('colors', {})
+        dark = config.get('dark_colors', {})
+        sections = {'colors': colors, 'font_sizes': config.get('font_sizes', {}),
+                    'spacing': config.get('spacing', {})}
+        self.light_vars = MappingProxyType({
+            var: sections[section].get(key, default) for var, section, key, default in LIGHT_VARS
+        })
+        self.dark_vars = MappingProxyType({var: dark.get(key, default) for var, key, default in DARK_VARS})
+        self.color_vars = MappingProxyType({
+            k: v for k, v in self.light_vars.items()
+            if not k.startswith('--font-size') and not k.startswith('--spacing')
+        })
+        self.light_css = _css_block(self.light_vars)
+        self.dark_css = _css_block(self.dark_vars)
+        self.light_json = json.dumps(dict(self.light_vars))
+        self.dark_json = json.dumps(dict(self.dark_vars))
+        self.stylesheet = (f'/* markit theme: {self.name} */\n'
+                           f':root {{\n{_css_block(self.light_vars, "    ")}\n}}\n'
+                           f'body.dark {{\n{_css_block(self.dark_vars, "    ")}\n}}\n')
+        self.css_hash = hashlib.sha1(self.stylesheet.encode('utf-8')).hexdigest()[:12]
+        self.css_url = f'/themes/{self.name}.{self.css_hash}.css'
+        self._styles = {}
+        self._lock = threading.Lock()
+
+    def style_config(self, style_type):
+        """ReportLab 样式参数"""
+        from reportlab.lib import colors
+        from reportlab.lib.units import cm
+        from reportlab.lib.enums import TA_CENTER
+
+        def color(key):
+            return colors.HexColor(self.config.get('colors', {}).get(key, '#000000'))
+
+        config = {}
+        if style_type in ['title', 'heading', 'subheading', 'normal', 'code', 'table_header']:
+            config['fontSize'] = self.config.get('font_sizes', {}).get(style_type, 11)
+            config['leading'] = self.config.get('line_height', {}).get(style_type, 14)
+            if style_type == 'title':
+                config['textColor'] = color('title')
+                config['alignment'] = TA_CENTER
+            elif style_type == 'heading':
+                config['textColor'] = color('heading')
+            elif style_type == 'subheading':
+                config['textColor'] = color('subheading')
+            elif style_type == 'normal':
+                config['textColor'] = color('text')
+            elif style_type == 'code':
+                config['textColor'] = color('code_text')
+                config['backColor'] = color('code_bg')
+                config['leftIndent'] = self.config.get('code_block', {}).get('indent', 0.5) * cm
+                config['rightIndent'] = self.config.get('code_block', {}).get('indent', 0.5) * cm
+                config['borderPadding'] = self.config.get('code_block', {}).get('padding', 0.2) * cm
+        return config
+
+    def reportlab_styles(self, font_name):
+        """创建 ReportLab 样式，同一字体只创建一次"""
+        with self._lock:
+            styles = self._styles.get(font_name)
+            if styles is None:
+                styles = self._styles[font_name] = self._create_styles(font_name)
+            return styles
+
+    def _create_styles(self, font_name):
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.lib.units import cm
+        styles = getSampleStyleSheet()
+        spacing = self.config.get('spacing', {})
+        base_styles = {}
+
+        # Title Style
+        cfg = self.style_config('title')
+        base_styles['title'] = ParagraphStyle('Title', parent=styles['Heading1'], fontName=font_name, **cfg)
+
+        # Heading Style
+        cfg = self.style_config('heading')
+        cfg['spaceAfter'] = spacing.get('heading_after', 0.3) * cm
+        cfg['spaceBefore'] = spacing.get('heading_before', 0.4) * cm
+        base_styles['heading'] = ParagraphStyle('Heading', parent=styles['Heading2'], fontName=font_name, **cfg)
+
+        # Subheading Style
+        cfg = self.style_config('subheading')
+        cfg['spaceAfter'] = spacing.get('subheading_after', 0.2) * cm
+        cfg['spaceBefore'] = spacing.get('subheading_before', 0.3) * cm
+        base_styles['subheading'] = ParagraphStyle('Subheading', parent=styles['Heading3'], fontName=font_name, **cfg)
+
+        # Normal Style
+        cfg = self.style_config('normal')
+        cfg['spaceAfter'] = spacing.get('normal_after', 0.2) * cm
+        base_styles['normal'] = ParagraphStyle('Normal', parent=styles['Normal'], fontName=font_name, **cfg)
+
+        # Code Style
+        cfg = self.style_config('code')
+        cfg['spaceAfter'] = spacing.get('code_after', 0.3) * cm
+        base_styles['code'] = ParagraphStyle('Code', parent=styles['Code'], fontName=font_name, **cfg)
+
+        return base_styles
+
+
+_compiled_by_config = {}
+_memo_lock = threading.Lock()
+
+
+def compile_config(config):
+    """编译任意配置字典，按内容缓存"""
+    key = json.dumps(config, sort_keys=True, default=str)
+    with _memo_lock:
+        compiled = _compiled_by_config.get(key)
+        if compiled is not None:
+            return compiled
+    compiled = CompiledTheme(config)
+    with _memo_lock:
+        _compiled_by_config[key] = compiled
+        while len(_compiled_by_config) > 32:
+            _compiled_by_config.pop(next(iter(_compiled_by_config)))
+    return compiled
+
+
+def validate_theme(data):
+    """校验主题文件内容，不合法时抛出 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('顶层必须是映射')
+    if not isinstance(data.get('name', ''), str):
+        raise ValueError('name 必须是字符串')
+    for section in ('colors', 'dark_colors'):
+        values = data.get(section, {})
+        if not isinstance(values, dict):
+            raise ValueError(f'{section} 必须是映射')
+        for key, value in values.items():
+            if not isinstance(value, (str, int, float)):
+                raise ValueError(f'{section}.{key} 必须是颜色字符串')
+    return data
+
+
+class ConfigSnapshot:
+    """某一时刻的完整配置（只读），version 单调递增，可作为缓存键的一部分"""
+
+    def __init__(self, version, themes, default):
+        self.version = version
+        self.themes = MappingProxyType(themes)   # 主题名 -> CompiledTheme
+        self.default = default
+
+    @property
+    def config(self):
+        """默认主题合并后的配置"""
+        return self.default.config
+
+    def names(self):
+        """全部可用主题名"""
+        return sorted(self.themes)
+
+    def get(self, name=None):
+        """取编译结果；为空或不存在时返回默认主题"""
+        return self.themes.get(name) or self.default
+
+
+class ThemeRegistry:
+    """主题注册表
+
+    启动时解析并编译 config/themes 下的全部主题，之后由配置目录监听器按文件调用
+    update() 增量更新；列出和切换主题只读内存。不合法的主题文件只报告一次，
+    并保留该主题上一次的有效版本。
+
+    每次更新生成新的 ConfigSnapshot 并整体替换 snapshot；请求线程取一次引用后
+    始终看到同一份完整配置。
+    """
+
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+        self.themes_dir = os.path.join(config_dir, 'themes')
+        self.main_path = os.path.join(config_dir, 'config.yaml')
+        self._lock = threading.Lock()
+        self._main = {}
+        self._sources = {}    # 主题名 -> 主题文件内容
+        self._errors = {}     # 文件路径 -> 已报告的错误
+        self.snapshot = None
+        self.reload()
+
+    def _report(self, path, error):
+        """同一文件的同一错误只打印一次"""
+        message = str(error)
+        if self._errors.get(path) != message:
+            self._errors[path] = message
+            print(f"[Theme] 警告: 主题文件无效 {os.path.basename(path)}: {message}")
+
+    def _parse(self, path, validate=None):
+        """读取 YAML；失败时报告并返回 None"""
+        try:
+            data = _read_yaml(path)
+            if validate:
+                validate(data)
+        except (OSError, yaml.YAMLError, ValueError) as e:
+            self._report(path, e)
+            return None
+        self._errors.pop(path, None)
+        return data
+
+    def _compile(self, name):
+        return compile_config(merge_config(self._main, self._sources[name], name))
+
+    def _publish(self, themes):
+        """生成新快照并替换（调用方持有 _lock）"""
+        if not os.path.exists(self.main_path):
+            # 兼容旧路径
+            default = compile_config(load_config(self.config_dir))
+        else:
+            name = self._main.get('theme', 'default')
+            if name not in themes:
+                name = 'default'
+            default = themes.get(name) or compile_config(merge_config(self._main, {}, name))
+        version = self.snapshot.version + 1 if self.snapshot else 1
+        self.snapshot = ConfigSnapshot(version, themes, default)
+
+    def reload(self):
+        """重新解析全部配置与主题文件"""
+        with self._lock:
+            if os.path.exists(self.main_path):
+                main = self._parse(self.main_path)
+                self._main = main if main is not None else self._main
+            names = []
+            if os.path.isdir(self.themes_dir):
+                names = [f[:-5] for f in sorted(os.listdir(self.themes_dir)) if f.endswith('.yaml')]
+            for name in names:
+                data = self._parse(os.path.join(self.themes_dir, f'{name}.yaml'), validate_theme)
+                if data is not None:
+                    self._sources[name] = data
+            for name in list(self._sources):
+                if name not in names:
+                    del self._sources[name]
+            self._publish({name: self._compile(name) for name in sorted(self._sources)})
+
+    def update(self, path):
+        """单个文件变化：config.yaml 影响全部主题，主题文件只重新编译自身"""
+        path = os.path.abspath(path)
+        if path == os.path.abspath(self.main_path):
+            self.reload()
+            return True
+        if os.path.dirname(path) != os.path.abspath(self.themes_dir) or not path.endswith('.yaml'):
+            return False
+        name = os.path.basename(path)[:-5]
+        with self._lock:
+            themes = dict(self.snapshot.themes)
+            if not os.path.exists(path):
+                self._sources.pop(name, None)
+                themes.pop(name, None)
+                self._errors.pop(path, None)
+            else:
+                data = self._parse(path, validate_theme)
+                if data is None:
+                    return False
+                self._sources[name] = data
+                themes[name] = self._compile(name)
+            self._publish(themes)
+        return True